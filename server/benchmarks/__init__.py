@@ -0,0 +1 @@
+"""Local performance benchmarks. Run each module with ``python -m``."""
@@ -0,0 +1,184 @@
+"""
+Benchmark document extraction: one file after another on the event loop
+(as before) against process_multiple_files on the process pool, first with
+a cold extraction cache and then with a warm one. The last column extracts
+only the prompt budget (cold cache), as AI generation does.
+
+Builds synthetic PDF, DOCX and PPTX files in memory, then reports the wall
+time of each strategy and checks the full extractions produce the same
+text. The caches are throwaway files, not the server's.
+
+    python -m server.benchmarks.file_extraction --files 8 --paragraphs 4000 --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+from docx import Document
+from pptx import Presentation
+from pptx.util import Inches
+
+from ..services import file_processor
+from ..services.content_hash import file_sha256
+from ..services.disk_cache import DiskCache
+from ..services.file_processor import SpooledFile
+from ..services.gemini_service import PROMPT_CONTENT_BUDGET
+
+
+def synthetic_pdf(pages: int, seed: int) -> bytes:
+    """A plain text PDF, written by hand (no PDF writer is a dependency)."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for i in range(pages):
+        lines = "".join(
+            f"(Page {seed}-{i} line {k}: enzymes lower activation energy.) Tj T* " for k in range(40)
+        )
+        stream = f"BT /F1 10 Tf 12 TL 50 780 Td {lines}ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    out.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def synthetic_docx(paragraphs: int, seed: int) -> bytes:
+    doc = Document()
+    for i in range(paragraphs):
+        doc.add_paragraph(f"Paragraph {seed}-{i}: mitochondria produce ATP through respiration.")
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def synthetic_pptx(slides: int, seed: int) -> bytes:
+    presentation = Presentation()
+    layout = presentation.slide_layouts[5]
+    for i in range(slides):
+        slide = presentation.slides.add_slide(layout)
+        slide.shapes.title.text = f"Slide title {seed}-{i}"
+        box = slide.shapes.add_textbox(Inches(1), Inches(2), Inches(6), Inches(3))
+        box.text_frame.text = f"Body text {seed}-{i}: photosynthesis converts light to sugar."
+    out = io.BytesIO()
+    presentation.save(out)
+    return out.getvalue()
+
+
+def synthetic_files(count: int, paragraphs: int) -> List[Tuple[str, bytes]]:
+    files = []
+    for i in range(count):
+        if i % 3 == 0:
+            files.append((f"chapter{i}.pdf", synthetic_pdf(max(paragraphs // 40, 1), i)))
+        elif i % 3 == 1:
+            files.append((f"notes{i}.docx", synthetic_docx(paragraphs, i)))
+        else:
+            files.append((f"deck{i}.pptx", synthetic_pptx(max(paragraphs // 20, 1), i)))
+    return files
+
+
+def spooled_files(files: List[Tuple[str, bytes]], directory: str) -> List[SpooledFile]:
+    """Write files to directory, as spool_uploads would."""
+    spooled = []
+    for name, content in files:
+        path = os.path.join(directory, name)
+        with open(path, "wb") as out:
+            out.write(content)
+        spooled.append(SpooledFile(name, path, len(content), file_sha256(content)))
+    return spooled
+
+
+def serial_extract(files: List[SpooledFile]) -> str:
+    """The old behaviour: each file parsed in turn, in the calling thread."""
+    sections = []
+    for file in files:
+        extractor = {
+            ".pdf": file_processor.pdf_text,
+            ".docx": file_processor.docx_text,
+            ".pptx": file_processor.pptx_text,
+        }[os.path.splitext(file.filename)[1]]
+        sections.append(f"=== Content from {file.filename} ===\n{extractor(file.path)}")
+    return "\n\n".join(sections)
+
+
+async def pooled_extract(
+    files: List[SpooledFile], budgets: List[Optional[int]]
+) -> List[Tuple[str, float]]:
+    """(text, seconds) for one process_multiple_files run per budget."""
+    # Warm the pool first so worker start-up is not counted
+    await asyncio.gather(
+        *(file_processor._run_extractor(len, b"") for _ in range(file_processor.EXTRACT_WORKERS))
+    )
+    runs = []
+    for budget in budgets:
+        started = time.perf_counter()
+        text = await file_processor.process_multiple_files(files, budget=budget)
+        runs.append((text, time.perf_counter() - started))
+    return runs
+
+
+def run_with_cache(cache_dir: str, files: List[SpooledFile], budgets: List[Optional[int]]) -> List[Tuple[str, float]]:
+    cache = DiskCache(os.path.join(cache_dir, "extraction.sqlite3"), max_bytes=1 << 30)
+    file_processor.extraction_cache = cache
+    try:
+        return asyncio.run(pooled_extract(files, budgets))
+    finally:
+        file_processor.shutdown_extraction_pool()
+        cache.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument(
+        "--paragraphs", type=int, default=4000, help="paragraphs per DOCX (PDF pages: /40, PPTX slides: /20)"
+    )
+    parser.add_argument("--workers", type=int, default=file_processor.EXTRACT_WORKERS)
+    args = parser.parse_args()
+
+    file_processor.EXTRACT_WORKERS = args.workers
+    file_processor.EXTRACT_CONCURRENCY = max(args.workers, 1)
+    with tempfile.TemporaryDirectory() as directory:
+        files = spooled_files(synthetic_files(args.files, args.paragraphs), directory)
+        size = sum(file.size for file in files)
+        print(f"{args.files} files, {size / 1e6:.1f} MB, {args.workers} workers")
+
+        started = time.perf_counter()
+        expected = serial_extract(files)
+        serial = time.perf_counter() - started
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            (cold_text, cold), (warm_text, warm) = run_with_cache(cache_dir, files, [None, None])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            [(budget_text, budgeted)] = run_with_cache(cache_dir, files, [PROMPT_CONTENT_BUDGET])
+    if cold_text != expected or warm_text != expected:
+        raise SystemExit("Output mismatch between serial and pooled extraction")
+    if len(budget_text) > PROMPT_CONTENT_BUDGET:
+        raise SystemExit(f"Budgeted extraction returned {len(budget_text)} characters")
+    print(f"{'serial s':>10}{'pooled s':>10}{'cached s':>10}{'budget s':>10}{'pool':>8}{'cache':>8}{'budget':>8}")
+    print(
+        f"{serial:>10.2f}{cold:>10.2f}{warm:>10.3f}{budgeted:>10.3f}"
+        f"{serial / cold:>7.1f}x{serial / warm:>7.0f}x{serial / budgeted:>7.0f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Read/write concurrency benchmark for the SQLite storage profiles.
+
+Writers grade exams (one attempt plus its answers per transaction) while
+readers page through attempt history, mirroring a busy local session.
+
+    python -m server.benchmarks.sqlite_concurrency --seconds 5 --writers 4 --readers 8
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy.orm import sessionmaker
+
+from ..db import STORAGE_PROFILES, Base, build_engine, is_locked_error
+from ..models import Attempt, AttemptAnswer, Exam, Question, Upload
+from ..routes.dashboard import _attempt_history_query
+from ..services.exams import build_exam_questions
+
+QUESTIONS_PER_EXAM = 20
+
+
+def _seed(Session) -> int:
+    with Session() as db:
+        upload = Upload(filename="bench.csv", file_type="csv")
+        db.add(upload)
+        db.flush()
+        questions = [
+            Question(upload_id=upload.id, stem=f"Q{i}", qtype="short", answer={"value": "a"})
+            for i in range(QUESTIONS_PER_EXAM)
+        ]
+        db.add_all(questions)
+        db.flush()
+        exam = Exam(
+            upload_id=upload.id,
+            settings={},
+            exam_questions=build_exam_questions([q.id for q in questions]),
+        )
+        db.add(exam)
+        db.commit()
+        return exam.id
+
+
+def run_profile(profile_name: str, seconds: float, writers: int, readers: int) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = build_engine(url, STORAGE_PROFILES[profile_name])
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine, autoflush=False)
+        exam_id = _seed(Session)
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        write_count = 0
+        lock_errors = 0
+        read_latencies: List[float] = []
+
+        def writer() -> None:
+            nonlocal write_count, lock_errors
+            while not stop.is_set():
+                try:
+                    with Session() as db:
+                        attempt = Attempt(exam_id=exam_id, finished_at=datetime.utcnow(), score_pct=50.0)
+                        db.add(attempt)
+                        db.flush()
+                        db.add_all(
+                            AttemptAnswer(
+                                attempt_id=attempt.id,
+                                question_id=qid,
+                                response={"value": "a"},
+                                correct=qid % 2 == 0,
+                            )
+                            for qid in range(1, QUESTIONS_PER_EXAM + 1)
+                        )
+                        db.commit()
+                    with lock:
+                        write_count += 1
+                except Exception as exc:
+                    if not is_locked_error(exc):
+                        raise
+                    with lock:
+                        lock_errors += 1
+
+        def reader() -> None:
+            nonlocal lock_errors
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    with Session() as db:
+                        db.execute(_attempt_history_query(limit=50)).all()
+                except Exception as exc:
+                    if not is_locked_error(exc):
+                        raise
+                    with lock:
+                        lock_errors += 1
+                    continue
+                with lock:
+                    read_latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=writer) for _ in range(writers)]
+        threads += [threading.Thread(target=reader) for _ in range(readers)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        engine.dispose()
+
+    latencies_ms = sorted(l * 1000 for l in read_latencies) or [0.0]
+    return {
+        "writes_per_s": write_count / seconds,
+        "reads_per_s": len(read_latencies) / seconds,
+        "read_p50_ms": statistics.median(latencies_ms),
+        "read_p95_ms": latencies_ms[int(len(latencies_ms) * 0.95) - 1 if len(latencies_ms) > 1 else 0],
+        "lock_errors": float(lock_errors),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--profiles", default="legacy,production")
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'writes/s':>10}{'reads/s':>10}{'read p50 ms':>13}{'read p95 ms':>13}{'lock errors':>13}")
+    for name in args.profiles.split(","):
+        r = run_profile(name.strip(), args.seconds, args.writers, args.readers)
+        print(
+            f"{name:<12}{r['writes_per_s']:>10.1f}{r['reads_per_s']:>10.1f}"
+            f"{r['read_p50_ms']:>13.2f}{r['read_p95_ms']:>13.2f}{int(r['lock_errors']):>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Peak memory of extracting a large batch of study files for one AI request.
+
+Compares reading every upload into a bytes object and parsing BytesIO
+copies of it (as before) with spooling the uploads to disk and letting the
+parsers open the files (spool_uploads + process_multiple_files). Both
+extract the prompt budget. Each strategy runs in a fresh interpreter so its
+peak RSS is its own; worker processes are reported separately.
+
+    python -m server.benchmarks.upload_memory --total-mb 500 --file-mb 50
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Iterator, List
+
+import PyPDF2
+from fastapi import UploadFile
+from PIL import Image
+
+from ..services import file_processor
+from ..services.gemini_service import PROMPT_CONTENT_BUDGET
+from .file_extraction import synthetic_pdf
+
+# Bytes per page of synthetic_pdf, measured
+_PDF_PAGE_BYTES = len(synthetic_pdf(10, 0)) / 10
+
+
+def write_batch(directory: str, total_mb: int, file_mb: int) -> None:
+    """Alternate PDFs and uncompressed BMP images of about file_mb each."""
+    for i in range(max(total_mb // file_mb, 1)):
+        if i % 2 == 0:
+            path = os.path.join(directory, f"chapter{i}.pdf")
+            with open(path, "wb") as out:
+                out.write(synthetic_pdf(int(file_mb * 1024 * 1024 / _PDF_PAGE_BYTES), i))
+        else:
+            side = int((file_mb * 1024 * 1024 / 3) ** 0.5)
+            Image.new("RGB", (side, side), (i * 40 % 256, 120, 200)).save(
+                os.path.join(directory, f"scan{i}.bmp")
+            )
+
+
+def open_uploads(directory: str) -> List[UploadFile]:
+    # Disk-backed, like the multipart parser's spooled temp files
+    return [
+        UploadFile(file=open(os.path.join(directory, name), "rb"), filename=name, size=os.path.getsize(os.path.join(directory, name)))
+        for name in sorted(os.listdir(directory))
+    ]
+
+
+def _buffered_pdf_pages(content: bytes) -> Iterator[str]:
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
+    for page in pdf_reader.pages:
+        text = page.extract_text()
+        if text:
+            yield text
+
+
+async def buffered(uploads: List[UploadFile]) -> int:
+    """The previous request path: every body read into memory, parsed from copies."""
+    bodies = [(upload.filename, await upload.read()) for upload in uploads]
+    share = PROMPT_CONTENT_BUDGET // len(bodies)
+    sections = []
+    for name, content in bodies:
+        if name.endswith(".pdf"):
+            parts: List[str] = []
+            for page in _buffered_pdf_pages(content):
+                parts.append(page)
+                if sum(map(len, parts)) >= share:
+                    break
+            sections.append("\n\n".join(parts)[:share])
+        else:
+            image = Image.open(io.BytesIO(content))
+            sections.append(f"[Image file: {name}, Size: {image.size}, Format: {image.format}]")
+    return len("\n\n".join(sections))
+
+
+async def spooled(uploads: List[UploadFile]) -> int:
+    files = await file_processor.spool_uploads(uploads, max_file_bytes=1 << 40, max_request_bytes=1 << 40)
+    try:
+        text = await file_processor.process_multiple_files(files, budget=PROMPT_CONTENT_BUDGET)
+    finally:
+        file_processor.remove_spooled(files)
+    return len(text)
+
+
+def run_mode(mode: str, directory: str) -> None:
+    """Child process: run one strategy and print its measurements."""
+    file_processor.extraction_cache.max_bytes = 0  # measure extraction, not cache hits
+    uploads = open_uploads(directory)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    chars = asyncio.run(buffered(uploads) if mode == "buffered" else spooled(uploads))
+    seconds = time.perf_counter() - started
+    if file_processor._pool is not None:
+        # Join the workers so their peak shows up under RUSAGE_CHILDREN
+        file_processor._pool.shutdown(wait=True)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    print(f"{mode:>10}{(peak - baseline) / 1024:>16.1f}{workers / 1024:>16.1f}{seconds:>10.2f}{chars:>10}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--total-mb", type=int, default=500)
+    parser.add_argument("--file-mb", type=int, default=50)
+    parser.add_argument("--mode", choices=["buffered", "spooled"], help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.dir)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_batch(directory, args.total_mb, args.file_mb)
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"{len(os.listdir(directory))} files, {size / 1024 / 1024:.0f} MiB")
+        print(f"{'mode':>10}{'peak RSS +MiB':>16}{'workers MiB':>16}{'seconds':>10}{'chars':>10}")
+        sys.stdout.flush()
+        for mode in ("buffered", "spooled"):
+            subprocess.run(
+                [sys.executable, "-m", "server.benchmarks.upload_memory", "--mode", mode, "--dir", directory],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
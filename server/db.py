@@ -1,20 +1,125 @@
 from __future__ import annotations
 
+import asyncio
+import functools
+import inspect
+import os
+import random
+import time
 from contextlib import contextmanager
-from typing import Generator
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Callable, Dict, Generator, Optional, TypeVar
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker, Session
 
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./exam.db"
+SQLALCHEMY_DATABASE_URL = os.environ.get("EXAM_DB_URL", "sqlite:///./exam.db")
+# Same database through aiosqlite, for routes that run on the event loop
+ASYNC_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("sqlite:", "sqlite+aiosqlite:", 1)
 
-# For SQLite + FastAPI threads
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """SQLite pragmas applied to every new pooled connection.
+
+    A field left as None keeps SQLite's compiled-in default.
+    """
+
+    journal_mode: Optional[str] = None
+    synchronous: Optional[str] = None
+    busy_timeout_ms: Optional[int] = None
+    cache_size: Optional[int] = None  # negative = KiB, positive = pages
+    mmap_size: Optional[int] = None  # bytes
+    temp_store: Optional[str] = None
+
+
+STORAGE_PROFILES: Dict[str, StorageProfile] = {
+    # WAL lets readers run alongside a writer; NORMAL is durable in WAL mode
+    # except for the last transactions before a power loss.
+    "production": StorageProfile(
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        busy_timeout_ms=5000,
+        cache_size=-65536,  # 64 MiB
+        mmap_size=268435456,  # 256 MiB
+        temp_store="MEMORY",
+    ),
+    # Plain SQLite defaults (rollback journal), kept for comparison
+    "legacy": StorageProfile(),
+}
+
+STORAGE_PROFILE_NAME = os.environ.get("EXAM_DB_PROFILE", "production")
+if STORAGE_PROFILE_NAME not in STORAGE_PROFILES:
+    raise ValueError(
+        f"Unknown EXAM_DB_PROFILE '{STORAGE_PROFILE_NAME}'. "
+        f"Choose one of: {', '.join(sorted(STORAGE_PROFILES))}"
+    )
+
+# Retry policy for "database is locked" errors that outlast busy_timeout
+LOCKED_RETRY_ATTEMPTS = int(os.environ.get("EXAM_DB_LOCKED_RETRIES", "5"))
+LOCKED_RETRY_BASE_DELAY = float(os.environ.get("EXAM_DB_LOCKED_RETRY_DELAY", "0.05"))
+
+
+def apply_storage_profile(dbapi_connection: Any, profile: StorageProfile) -> None:
+    """Issue the profile's PRAGMA statements on a raw DB-API connection."""
+    pragmas = []
+    if profile.busy_timeout_ms is not None:
+        pragmas.append(f"PRAGMA busy_timeout={int(profile.busy_timeout_ms)}")
+    if profile.journal_mode is not None:
+        pragmas.append(f"PRAGMA journal_mode={profile.journal_mode}")
+    if profile.synchronous is not None:
+        pragmas.append(f"PRAGMA synchronous={profile.synchronous}")
+    if profile.cache_size is not None:
+        pragmas.append(f"PRAGMA cache_size={int(profile.cache_size)}")
+    if profile.mmap_size is not None:
+        pragmas.append(f"PRAGMA mmap_size={int(profile.mmap_size)}")
+    if profile.temp_store is not None:
+        pragmas.append(f"PRAGMA temp_store={profile.temp_store}")
+
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def build_engine(url: str, profile: StorageProfile) -> Engine:
+    """Create a SQLite engine that applies the storage profile on connect."""
+    # For SQLite + FastAPI threads
+    new_engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(new_engine, "connect")
+    def _on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+        apply_storage_profile(dbapi_connection, profile)
+
+    return new_engine
+
+
+def build_async_engine(url: str, profile: StorageProfile) -> AsyncEngine:
+    """Create an aiosqlite engine that applies the storage profile on connect."""
+    new_engine = create_async_engine(url)
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+        apply_storage_profile(dbapi_connection, profile)
+
+    return new_engine
+
+
+engine = build_engine(SQLALCHEMY_DATABASE_URL, STORAGE_PROFILES[STORAGE_PROFILE_NAME])
+async_engine = build_async_engine(ASYNC_DATABASE_URL, STORAGE_PROFILES[STORAGE_PROFILE_NAME])
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attributes stay readable after commit without an
+# implicit (and, under asyncio, forbidden) lazy refresh
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
 
 Base = declarative_base()
 
@@ -27,6 +132,11 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 @contextmanager
 def session_scope() -> Generator[Session, None, None]:
     session = SessionLocal()
@@ -40,3 +150,73 @@ def session_scope() -> Generator[Session, None, None]:
         session.close()
 
 
+def is_locked_error(exc: BaseException) -> bool:
+    """True if exc is SQLite's 'database is locked' / 'database is busy'."""
+    if not isinstance(exc, OperationalError):
+        return False
+    message = str(exc.orig if exc.orig is not None else exc).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def _locked_retry_delay(attempt: int) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, LOCKED_RETRY_BASE_DELAY * (2 ** attempt))
+
+
+def _rollback_sessions(args: tuple, kwargs: dict) -> None:
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, Session):
+            value.rollback()
+
+
+async def _rollback_async_sessions(args: tuple, kwargs: dict) -> None:
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, AsyncSession):
+            await value.rollback()
+        elif isinstance(value, Session):
+            value.rollback()
+
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def retry_on_locked(func: F) -> F:
+    """Re-run a unit of work when SQLite reports the database is locked.
+
+    busy_timeout already waits for most lock holders, but a deferred
+    transaction that reads and then tries to write can fail immediately when
+    another writer got there first. The wrapped function must be safe to run
+    again from the start; any Session or AsyncSession among its arguments is
+    rolled back between attempts.
+    """
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            for attempt in range(LOCKED_RETRY_ATTEMPTS + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except OperationalError as exc:
+                    if not is_locked_error(exc) or attempt == LOCKED_RETRY_ATTEMPTS:
+                        raise
+                    await _rollback_async_sessions(args, kwargs)
+                    await asyncio.sleep(_locked_retry_delay(attempt))
+
+        # Resolve string annotations against func's module so FastAPI can
+        # still read the route signature through the wrapper.
+        async_wrapper.__signature__ = inspect.signature(func, eval_str=True)  # type: ignore[attr-defined]
+        return async_wrapper  # type: ignore[return-value]
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        for attempt in range(LOCKED_RETRY_ATTEMPTS + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_locked_error(exc) or attempt == LOCKED_RETRY_ATTEMPTS:
+                    raise
+                _rollback_sessions(args, kwargs)
+                time.sleep(_locked_retry_delay(attempt))
+
+    wrapper.__signature__ = inspect.signature(func, eval_str=True)  # type: ignore[attr-defined]
+    return wrapper  # type: ignore[return-value]
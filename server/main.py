@@ -1,13 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .db import Base, engine
+from .db import engine
+from .migrations import run_migrations
 from .routes import files as files_routes
 from .routes import concepts as concepts_routes
 from .routes import exam as exam_routes
 from .routes import dashboard as dashboard_routes
 from .routes import classes as classes_routes
 from .routes import ai_generation as ai_routes
+from .routes import jobs as jobs_routes
+from .routes import cache as cache_routes
+from .services.file_processor import shutdown_extraction_pool
+from .services.gemini_service import gemini_clients
+from .services.jobs import job_manager
 
 
 def create_app() -> FastAPI:
@@ -33,11 +39,24 @@ def create_app() -> FastAPI:
     app.include_router(dashboard_routes.router, prefix="/api")
     app.include_router(classes_routes.router, prefix="/api")
     app.include_router(ai_routes.router, prefix="/api")
+    app.include_router(jobs_routes.router, prefix="/api")
+    app.include_router(cache_routes.router, prefix="/api")
 
     @app.on_event("startup")
     def _startup() -> None:
-        # Create tables on startup for local dev
-        Base.metadata.create_all(bind=engine)
+        # Create tables and missing indexes on startup for local dev
+        run_migrations(engine)
+
+    @app.on_event("startup")
+    async def _start_jobs() -> None:
+        # Requeues or closes out jobs left unfinished by the last run
+        await job_manager.start()
+
+    @app.on_event("shutdown")
+    async def _stop_jobs() -> None:
+        await job_manager.stop()
+        shutdown_extraction_pool()
+        await gemini_clients.close()
 
     return app
 
@@ -0,0 +1,281 @@
+"""
+Versioned schema migrations for exam.db.
+
+create_all only creates missing tables; it never alters existing ones or adds
+indexes to them. Each migration below brings an existing database forward one
+step, and the applied version is tracked in SQLite's PRAGMA user_version.
+
+    python -m server.migrations                 # apply pending migrations
+    python -m server.migrations --check-plans   # EXPLAIN QUERY PLAN for hot queries
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import Select, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from .db import Base
+
+
+Migration = Tuple[int, str, Callable[[Connection], None]]
+
+
+def run_migrations(engine: Engine) -> None:
+    """Create missing tables, then apply pending migrations in order."""
+    # Import models so every table is registered on Base.metadata
+    from . import models  # noqa: F401
+
+    fresh = not inspect(engine).get_table_names()
+    Base.metadata.create_all(bind=engine)
+
+    if fresh:
+        # create_all just built the current schema; nothing to migrate
+        with engine.begin() as conn:
+            _set_version(conn, latest_version())
+        return
+
+    with engine.connect() as conn:
+        current = _get_version(conn)
+
+    for version, _description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            _set_version(conn, version)
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0]
+
+
+def _get_version(conn: Connection) -> int:
+    return int(conn.exec_driver_sql("PRAGMA user_version").scalar() or 0)
+
+
+def _set_version(conn: Connection, version: int) -> None:
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def _column_names(conn: Connection, table: str) -> set[str]:
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def _create_indexes(conn: Connection, *names: str) -> None:
+    """Create model-declared indexes by name if they do not exist yet."""
+    indexes = {
+        index.name: index
+        for table in Base.metadata.sorted_tables
+        for index in table.indexes
+    }
+    for name in names:
+        indexes[name].create(bind=conn, checkfirst=True)
+
+
+def _add_history_indexes(conn: Connection) -> None:
+    """Indexes behind attempt history ordering and class filters."""
+    _create_indexes(conn, "ix_attempts_finished_at", "ix_upload_classes_class_id")
+
+
+def _migrate_exam_question_ids(conn: Connection) -> None:
+    """Move the legacy exams.question_ids JSON list into exam_questions."""
+    if "question_ids" not in _column_names(conn, "exams"):
+        return
+
+    already_migrated = {
+        row.exam_id
+        for row in conn.execute(text("SELECT DISTINCT exam_id FROM exam_questions"))
+    }
+    rows = []
+    for exam_id, raw_ids in conn.execute(text("SELECT id, question_ids FROM exams")):
+        if exam_id in already_migrated or not raw_ids:
+            continue
+        question_ids = json.loads(raw_ids) if isinstance(raw_ids, str) else raw_ids
+        rows.extend(
+            {"exam_id": exam_id, "position": position, "question_id": question_id}
+            for position, question_id in enumerate(question_ids)
+            if question_id is not None
+        )
+    if rows:
+        conn.execute(
+            text(
+                "INSERT INTO exam_questions (exam_id, position, question_id) "
+                "VALUES (:exam_id, :position, :question_id)"
+            ),
+            rows,
+        )
+    # Requires SQLite 3.35+
+    conn.execute(text("ALTER TABLE exams DROP COLUMN question_ids"))
+
+
+def _migrate_question_concept_ids(conn: Connection) -> None:
+    """Move the legacy questions.concept_ids JSON list into question_concepts."""
+    if "concept_ids" not in _column_names(conn, "questions"):
+        return
+
+    rows = []
+    for question_id, raw_ids in conn.execute(
+        text("SELECT id, concept_ids FROM questions WHERE concept_ids IS NOT NULL")
+    ):
+        concept_ids = json.loads(raw_ids) if isinstance(raw_ids, str) else raw_ids
+        rows.extend(
+            {"question_id": question_id, "concept_id": concept_id}
+            for concept_id in dict.fromkeys(concept_ids or [])
+            if concept_id
+        )
+    if rows:
+        conn.execute(
+            text(
+                "INSERT OR IGNORE INTO question_concepts (question_id, concept_id) "
+                "VALUES (:question_id, :concept_id)"
+            ),
+            rows,
+        )
+    conn.execute(text("ALTER TABLE questions DROP COLUMN concept_ids"))
+
+
+def _add_hot_query_indexes(conn: Connection) -> None:
+    """Composite indexes for exam creation, library listing and overrides."""
+    _create_indexes(
+        conn,
+        "ix_questions_upload_id_qtype",
+        "ix_uploads_created_at",
+        "ix_attempt_answers_attempt_id_question_id",
+    )
+
+
+def _add_upload_stats_columns(conn: Connection) -> None:
+    """Denormalized statistics on uploads, backfilled from existing rows."""
+    from .services.upload_stats import reconcile_upload_stats
+
+    existing = _column_names(conn, "uploads")
+    for name, ddl in (
+        ("question_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("exam_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("attempt_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("question_type_counts", "JSON"),
+    ):
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE uploads ADD COLUMN {name} {ddl}"))
+    reconcile_upload_stats(conn)
+
+
+def _create_jobs_table(conn: Connection) -> None:
+    """Background job records."""
+    from .models import Job
+
+    Job.__table__.create(bind=conn, checkfirst=True)
+
+
+def _add_content_hashes(conn: Connection) -> None:
+    """Content hash columns for upload and question deduplication."""
+    from .services.content_hash import question_hash
+
+    for table in ("uploads", "questions"):
+        if "content_hash" not in _column_names(conn, table):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN content_hash VARCHAR(64)"))
+
+    # Uploaded bytes were never kept, so only questions can be backfilled.
+    # Existing duplicates may be referenced by exams and are not deleted:
+    # the first copy in each upload gets the hash, later ones stay NULL.
+    seen = set()
+    rows = []
+    for question_id, upload_id, stem, raw_answer in conn.execute(
+        text("SELECT id, upload_id, stem, answer FROM questions WHERE content_hash IS NULL ORDER BY id")
+    ):
+        answer = json.loads(raw_answer) if isinstance(raw_answer, str) else raw_answer
+        key = (upload_id, question_hash(stem, answer))
+        if key in seen:
+            continue
+        seen.add(key)
+        rows.append({"id": question_id, "content_hash": key[1]})
+    if rows:
+        conn.execute(text("UPDATE questions SET content_hash = :content_hash WHERE id = :id"), rows)
+
+    _create_indexes(conn, "ix_uploads_content_hash", "ix_questions_upload_id_content_hash")
+
+
+# Append only; never renumber or edit a released migration
+MIGRATIONS: List[Migration] = [
+    (1, "attempt history indexes", _add_history_indexes),
+    (2, "exam_questions join table", _migrate_exam_question_ids),
+    (3, "question_concepts join table", _migrate_question_concept_ids),
+    (4, "composite indexes for hot queries", _add_hot_query_indexes),
+    (5, "upload statistics columns", _add_upload_stats_columns),
+    (6, "background jobs table", _create_jobs_table),
+    (7, "content hashes for deduplication", _add_content_hashes),
+]
+
+
+def hot_queries() -> Dict[str, Select]:
+    """Representative statements for the request paths that must stay indexed."""
+    from .models import Attempt, AttemptAnswer, Question, Upload
+
+    return {
+        "create_exam questions by upload and type": select(Question.id).where(
+            Question.upload_id == 1, Question.qtype.in_(["mcq", "short"])
+        ),
+        "upload library newest first": select(Upload.id)
+        .order_by(Upload.created_at.desc(), Upload.id.desc())
+        .limit(50),
+        "attempt history newest first": select(Attempt.id)
+        .where(Attempt.finished_at.isnot(None))
+        .order_by(Attempt.finished_at.desc(), Attempt.id.desc())
+        .limit(50),
+        "override answer lookup": select(AttemptAnswer.id).where(
+            AttemptAnswer.attempt_id == 1, AttemptAnswer.question_id == 1
+        ),
+    }
+
+
+def explain_hot_queries(conn: Connection) -> Dict[str, List[str]]:
+    """EXPLAIN QUERY PLAN detail lines for each hot query."""
+    plans: Dict[str, List[str]] = {}
+    for name, statement in hot_queries().items():
+        sql = str(statement.compile(conn, compile_kwargs={"literal_binds": True}))
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+        plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+def unindexed_plans(plans: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Hot queries whose plan scans a table or sorts in a temp b-tree."""
+    failures = {}
+    for name, details in plans.items():
+        uses_index = any("USING" in d and "INDEX" in d for d in details)
+        sorts = any("TEMP B-TREE" in d for d in details)
+        if not uses_index or sorts:
+            failures[name] = details
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check-plans", action="store_true", help="verify hot queries use an index")
+    args = parser.parse_args()
+
+    from .db import engine
+
+    run_migrations(engine)
+    with engine.connect() as conn:
+        print(f"schema version {_get_version(conn)} (latest {latest_version()})")
+        if not args.check_plans:
+            return
+        plans = explain_hot_queries(conn)
+
+    for name, details in plans.items():
+        print(f"{name}:")
+        for detail in details:
+            print(f"    {detail}")
+    failures = unindexed_plans(plans)
+    if failures:
+        print(f"NOT INDEXED: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
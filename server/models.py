@@ -10,6 +10,7 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Table,
@@ -26,6 +27,18 @@ upload_classes = Table(
     Base.metadata,
     Column("upload_id", Integer, ForeignKey("uploads.id"), primary_key=True),
     Column("class_id", Integer, ForeignKey("classes.id"), primary_key=True),
+    # Reverse lookup for class filters (the PK only covers upload_id first)
+    Index("ix_upload_classes_class_id", "class_id"),
+)
+
+# Association table for many-to-many relationship between questions and concepts
+question_concepts = Table(
+    "question_concepts",
+    Base.metadata,
+    Column("question_id", Integer, ForeignKey("questions.id"), primary_key=True),
+    Column("concept_id", Integer, ForeignKey("concepts.id"), primary_key=True),
+    # Concept -> questions lookups (the PK only covers question_id first)
+    Index("ix_question_concepts_concept_id", "concept_id"),
 )
 
 
@@ -36,8 +49,18 @@ class Upload(Base):
     filename: Mapped[str] = mapped_column(String(512), nullable=False)
     file_type: Mapped[str] = mapped_column(String(16), nullable=False)  # csv | text
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, default=datetime.utcnow, nullable=False
+        DateTime, default=datetime.utcnow, nullable=False, index=True
+    )
+    # SHA-256 of the uploaded file; a repeat upload resolves to this row
+    content_hash: Mapped[Optional[str]] = mapped_column(
+        String(64), nullable=True, unique=True, index=True
     )
+    # Denormalized library statistics, kept current by the writers in
+    # services/upload_stats.py and rebuildable with its reconcile command
+    question_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    exam_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    attempt_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    question_type_counts: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
 
     concepts: Mapped[List["Concept"]] = relationship(
         back_populates="upload", cascade="all, delete-orphan"
@@ -66,6 +89,12 @@ class Concept(Base):
 
 class Question(Base):
     __tablename__ = "questions"
+    __table_args__ = (
+        # create_exam filters on upload + question type
+        Index("ix_questions_upload_id_qtype", "upload_id", "qtype"),
+        # One copy of each question per bank (NULL hashes never collide)
+        Index("ix_questions_upload_id_content_hash", "upload_id", "content_hash", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     upload_id: Mapped[int] = mapped_column(ForeignKey("uploads.id"), index=True)
@@ -73,9 +102,11 @@ class Question(Base):
     qtype: Mapped[str] = mapped_column(String(16), nullable=False)  # mcq|multi|short|truefalse|cloze
     options: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)  # list[str]
     answer: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
-    concept_ids: Mapped[Optional[List[int]]] = mapped_column(JSON, nullable=True)
+    # services/content_hash.question_hash of stem + answer
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
 
     upload: Mapped[Upload] = relationship(back_populates="questions")
+    concepts: Mapped[List["Concept"]] = relationship(secondary=question_concepts)
 
 
 class Exam(Base):
@@ -84,14 +115,27 @@ class Exam(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     upload_id: Mapped[int] = mapped_column(ForeignKey("uploads.id"), index=True)
     settings: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
-    question_ids: Mapped[List[int]] = mapped_column(JSON)
 
     upload: Mapped[Upload] = relationship(back_populates="exams")
+    exam_questions: Mapped[List["ExamQuestion"]] = relationship(
+        order_by="ExamQuestion.position", cascade="all, delete-orphan"
+    )
     attempts: Mapped[List["Attempt"]] = relationship(
         back_populates="exam", cascade="all, delete-orphan"
     )
 
 
+class ExamQuestion(Base):
+    """Ordered membership of a question in an exam."""
+
+    __tablename__ = "exam_questions"
+
+    exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id"), primary_key=True)
+    position: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Indexed for reverse lookups ("which exams used this question")
+    question_id: Mapped[int] = mapped_column(ForeignKey("questions.id"), index=True)
+
+
 class Attempt(Base):
     __tablename__ = "attempts"
 
@@ -100,7 +144,7 @@ class Attempt(Base):
     started_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.utcnow, nullable=False
     )
-    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, index=True)
     score_pct: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
 
     exam: Mapped[Exam] = relationship(back_populates="attempts")
@@ -111,6 +155,10 @@ class Attempt(Base):
 
 class AttemptAnswer(Base):
     __tablename__ = "attempt_answers"
+    __table_args__ = (
+        # Grade overrides look up one answer of an attempt
+        Index("ix_attempt_answers_attempt_id_question_id", "attempt_id", "question_id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     attempt_id: Mapped[int] = mapped_column(ForeignKey("attempts.id"), index=True)
@@ -137,3 +185,24 @@ class Class(Base):
     )
 
 
+class Job(Base):
+    """A background upload or generation run by services/jobs.py."""
+
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)  # csv_upload | ai_generation
+    # queued | running | succeeded | failed | cancelled | interrupted
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="queued", index=True)
+    stage: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    percent: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    params: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    # Handler state that must outlive a restart (e.g. a partially written upload)
+    checkpoint: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    result: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, nullable=False
+    )
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
@@ -1,24 +1,38 @@
 """
 AI-powered exam generation routes using Gemini API.
 """
-from typing import List, Optional
+import asyncio
+from contextlib import aclosing
+from dataclasses import asdict
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
 from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+import anyio
 
 from ..services import file_processor, gemini_service
+from ..services.content_hash import question_hash
+from ..services.file_processor import SpooledFile
 from ..services.gemini_service import ExamConfig
+from ..services.exams import build_exam_questions
+from ..services.jobs import JobContext, job_manager
+from ..services.upload_stats import count_question_types
 import google.generativeai as genai
 import pkg_resources
 import socket
 import ssl
-from ..db import SessionLocal
-from ..models import Upload, Question, Concept, Exam
+from sqlalchemy import delete, func, select
+from ..db import AsyncSessionLocal
+from ..models import Upload, Question, Concept, Exam, ExamQuestion, upload_classes
+from .jobs import SSE_HEARTBEAT_SECONDS
 from datetime import datetime
 import json
 
 
 router = APIRouter(tags=["AI Generation"])
 
+AI_GENERATION_JOB = "ai_generation"
+
 
 class ValidateKeyRequest(BaseModel):
     """Request model for API key validation."""
@@ -69,26 +83,18 @@ async def env_diagnostics():
 async def list_available_models(x_gemini_api_key: str = Header(..., alias="X-Gemini-API-Key")):
     """List available models that support generateContent for the provided key."""
     try:
-        genai.configure(api_key=x_gemini_api_key)
-        models = list(genai.list_models())
-        result = []
-        for m in models:
-            try:
-                methods = getattr(m, 'supported_generation_methods', []) or []
-                if 'generateContent' not in methods:
-                    continue
-                name_raw = getattr(m, 'name', '') or ''
-                plain = name_raw.split('/')[-1]
-                if plain.endswith('-latest'):
-                    plain = plain[:-7]
-                result.append(plain)
-            except Exception:
-                continue
+        models = await gemini_service.model_catalog.get(x_gemini_api_key)
         # Prefer unique sorted output
-        return {"models": sorted(set(result))}
+        return {"models": sorted(models)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to list models: {str(e)}")
 
+@router.get("/ai/scheduler")
+async def scheduler_stats() -> Dict[str, Any]:
+    """Queue depth, in-flight calls, retries and queue wait times of Gemini generation calls."""
+    return gemini_service.gemini_scheduler.stats()
+
+
 @router.post("/ai/test-key")
 async def test_api_key_detailed(request: ValidateKeyRequest):
     """
@@ -108,13 +114,12 @@ async def test_api_key_detailed(request: ValidateKeyRequest):
     }
     
     try:
-        # Configure the API
-        genai.configure(api_key=request.api_key)
+        # Clients are bound to the key per call; nothing global to configure
         results["configured"] = True
         
-        # List all models
+        # List all models (uncached: this is a diagnostic)
         try:
-            models = list(genai.list_models())
+            models = await asyncio.to_thread(gemini_service.list_models, request.api_key)
             results["models_listed"] = [str(model.name) for model in models]
         except Exception as e:
             results["errors"].append(f"Failed to list models: {str(e)}")
@@ -132,8 +137,8 @@ async def test_api_key_detailed(request: ValidateKeyRequest):
         
         for model_name in model_formats_to_test:
             try:
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content(
+                model = gemini_service.generative_model(request.api_key, model_name)
+                response = await model.generate_content_async(
                     "Say 'OK'",
                     generation_config=genai.GenerationConfig(
                         max_output_tokens=10,
@@ -205,6 +210,9 @@ async def generate_exam_from_files(
     exam_name: Optional[str] = Form(None),  # Optional exam name
     exam_mode: Optional[str] = Form("exam"),  # exam or practice
     class_id: Optional[int] = Form(None),  # Optional class assignment
+    background: bool = Form(False),  # Return a job id at once, generate in the background
+    map_reduce: bool = Form(False),  # Cover long material in chunks instead of its first prompt's worth
+    fresh: bool = Form(False),  # New questions even if identical material and settings were generated before
     x_gemini_api_key: str = Header(..., alias="X-Gemini-API-Key")
 ):
     """
@@ -216,57 +224,175 @@ async def generate_exam_from_files(
     3. Parse response
     4. Create exam in database
     5. Return exam ID ready to take
+
+    Files are spooled to disk first (413 if one is over EXAM_MAX_UPLOAD_MB or
+    all of them over EXAM_MAX_REQUEST_MB). With background=true a job id is
+    returned immediately (202) and progress is available under /api/jobs/{id}.
+
+    Normally only the first PROMPT_CONTENT_BUDGET characters of material are
+    used. With map_reduce=true up to EXAM_MAP_REDUCE_MAX_CHUNKS prompts'
+    worth is extracted, questions are generated from each chunk at once and
+    merged (near-duplicates removed).
+
+    Results are cached by material, settings and model; fresh=true asks
+    Gemini again regardless.
     """
-    db = SessionLocal()
-    
+    settings = {
+        "question_count": question_count,
+        "difficulty": difficulty,
+        "question_types": question_types,
+        "focus_concepts": focus_concepts,
+        "exam_name": exam_name,
+        "exam_mode": exam_mode,
+        "class_id": class_id,
+        "map_reduce": map_reduce,
+        "fresh": fresh,
+    }
     try:
-        # Step 1: Extract text from files
-        content = await file_processor.process_multiple_files(files)
-        
-        if not content or len(content) < 100:
-            raise HTTPException(
-                status_code=400,
-                detail="Could not extract enough content from files. Please ensure files contain text."
+        if background:
+            spooled = await file_processor.spool_uploads(files, make_path=job_manager.spool_path)
+        else:
+            spooled = await file_processor.spool_uploads(files)
+    except file_processor.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    if background:
+        try:
+            job_id = await job_manager.submit(
+                AI_GENERATION_JOB,
+                {
+                    **settings,
+                    "source_files": [asdict(f) for f in spooled],
+                    "spool_files": [f.path for f in spooled],
+                },
+                # The key is never persisted
+                runtime={"api_key": x_gemini_api_key},
             )
-        
-        # Step 2: Build configuration
-        question_types_list = [qt.strip() for qt in question_types.split(",") if qt.strip()]
-        focus_concepts_list = None
-        if focus_concepts:
-            focus_concepts_list = [fc.strip() for fc in focus_concepts.split(",") if fc.strip()]
-        
-        config = ExamConfig(
+        except Exception:
+            file_processor.remove_spooled(spooled)
+            raise
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+    try:
+        return await _generate_exam(spooled, api_key=x_gemini_api_key, **settings)
+    finally:
+        file_processor.remove_spooled(spooled)
+
+
+@router.post("/ai/generate-exam/stream")
+async def stream_exam_from_files(
+    files: List[UploadFile] = File(...),
+    question_count: int = Form(20),
+    difficulty: str = Form("medium"),
+    question_types: str = Form("mcq,short"),  # Comma-separated
+    focus_concepts: Optional[str] = Form(None),  # Comma-separated
+    exam_name: Optional[str] = Form(None),  # Optional exam name
+    exam_mode: Optional[str] = Form("exam"),  # exam or practice
+    class_id: Optional[int] = Form(None),  # Optional class assignment
+    map_reduce: bool = Form(False),  # Cover long material in chunks instead of its first prompt's worth
+    fresh: bool = Form(False),  # New questions even if identical material and settings were generated before
+    x_gemini_api_key: str = Header(..., alias="X-Gemini-API-Key")
+) -> StreamingResponse:
+    """
+    Generate an exam like /ai/generate-exam, reporting it as server-sent events.
+
+    The exam and its upload are created first ('exam' event: exam_id,
+    upload_id). Each question is saved and sent ('question' event: position
+    and the question without its answer) as soon as Gemini has written it.
+    A 'done' event carries the GenerateExamResponse; an 'error' event
+    carries a detail message, after which the questions already sent stay
+    in the exam.
+
+    Problems with the files (too large, no text) are still plain HTTP errors.
+    """
+    try:
+        spooled = await file_processor.spool_uploads(files)
+    except file_processor.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        content, config = await _prepare_generation(
+            spooled,
             question_count=question_count,
             difficulty=difficulty,
-            question_types=question_types_list,
-            focus_concepts=focus_concepts_list
+            question_types=question_types,
+            focus_concepts=focus_concepts,
+            map_reduce=map_reduce,
+            api_key=x_gemini_api_key,
         )
+    finally:
+        file_processor.remove_spooled(spooled)
+
+    stream = gemini_service.ExamStream(
+        content, config, x_gemini_api_key, map_reduce=map_reduce, fresh=fresh
+    )
+    exam_settings = {
+        "question_count": question_count,
+        "difficulty": difficulty,
+        "question_types": config.question_types,
+        "exam_name": exam_name,
+        "exam_mode": exam_mode,
+    }
+    return StreamingResponse(
+        _exam_events(stream, exam_settings, class_id, [f.filename for f in spooled]),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _generate_exam(
+    files: List[SpooledFile],
+    *,
+    question_count: int,
+    difficulty: str,
+    question_types: str,
+    focus_concepts: Optional[str],
+    exam_name: Optional[str],
+    exam_mode: Optional[str],
+    class_id: Optional[int],
+    api_key: str,
+    map_reduce: bool = False,
+    fresh: bool = False,
+    progress: Callable[[str, float], None] = lambda stage, percent: None,
+) -> GenerateExamResponse:
+    db = AsyncSessionLocal()
+    
+    try:
+        # Steps 1-2: Extract text from files and build configuration
+        progress("extracting text", 5.0)
+        content, config = await _prepare_generation(
+            files,
+            question_count=question_count,
+            difficulty=difficulty,
+            question_types=question_types,
+            focus_concepts=focus_concepts,
+            map_reduce=map_reduce,
+            api_key=api_key,
+        )
+        question_types_list = config.question_types
         
         # Step 3: Generate exam with Gemini
-        generated_exam = await gemini_service.generate_exam_from_content(
+        progress("generating questions", 20.0)
+        generate = (
+            gemini_service.generate_exam_map_reduce if map_reduce
+            else gemini_service.generate_exam_sharded
+        )
+        generated_exam = await generate(
             content=content,
             config=config,
-            api_key=x_gemini_api_key
+            api_key=api_key,
+            fresh=fresh
         )
         
         # Step 4: Create upload record in database
+        progress("saving exam", 90.0)
         file_names = [f.filename for f in files]
         
         # Determine model used (service attaches _model_name on the returned object)
         used_model = getattr(generated_exam, '_model_name', 'gemini-2.5-flash')
 
-        # Count existing AI-generated uploads and increment
-        ai_upload_count = db.query(Upload).filter(Upload.file_type == "ai_generated").count()
-        filename = f"AI Generated Quiz {ai_upload_count + 1}"
-
-        upload = Upload(
-            filename=filename,
-            file_type="ai_generated",
-            created_at=datetime.now()
-        )
-        
+        upload = await _new_ai_upload(db)
         db.add(upload)
-        db.flush()  # Get upload ID
+        await db.flush()  # Get upload ID
         
         # Step 5: Create concept records first and build mapping
         concept_names = set()
@@ -285,46 +411,24 @@ async def generate_exam_from_files(
             db.add(concept)
             concept_map[concept_name] = concept
         
-        db.flush()  # Get concept IDs
+        await db.flush()  # Get concept IDs
         
         # Step 6: Create questions in database
         created_questions = []
+        questions_by_hash: Dict[str, Question] = {}
         
         for q_data in generated_exam.questions:
-            # Prepare options as JSON dict
-            options_dict = None
-            if q_data.options and len(q_data.options) > 0:
-                options_dict = {"list": q_data.options}
+            options_dict, answer_dict = _question_columns(q_data)
             
-            # Prepare answer as JSON dict
-            answer_dict = None
-            if q_data.answer:
-                # Convert answer to appropriate format based on question type
-                # For multi-select, parse comma-separated answers into list
-                if q_data.type == 'multi':
-                    # Check if already a list (from JSON parsing) or string to split
-                    if isinstance(q_data.answer, str):
-                        answer_list = [a.strip() for a in q_data.answer.split(",") if a.strip()]
-                        answer_dict = {"value": answer_list}
-                    elif isinstance(q_data.answer, list):
-                        answer_dict = {"value": q_data.answer}
-                    else:
-                        answer_dict = {"value": str(q_data.answer)}
-                elif q_data.type == 'cloze':
-                    # For cloze questions, parse multiple answers
-                    if isinstance(q_data.answer, str):
-                        answer_list = [a.strip() for a in q_data.answer.split(",") if a.strip()]
-                        answer_dict = {"value": answer_list}
-                    elif isinstance(q_data.answer, list):
-                        answer_dict = {"value": q_data.answer}
-                    else:
-                        answer_dict = {"value": [str(q_data.answer)]}
-                else:
-                    # For MCQ, short answer, true/false: single answer as string
-                    answer_dict = {"value": str(q_data.answer)}
+            # Prepare concept links
+            question_concepts = [concept_map[name] for name in dict.fromkeys(q_data.concepts or []) if name in concept_map]
             
-            # Prepare concept IDs
-            concept_ids = [concept_map[name].id for name in (q_data.concepts or []) if name in concept_map]
+            # The model sometimes repeats a question; keep the first copy
+            content_hash = question_hash(q_data.question, answer_dict)
+            existing = questions_by_hash.get(content_hash)
+            if existing is not None:
+                existing.concepts.extend(c for c in question_concepts if c not in existing.concepts)
+                continue
             
             question = Question(
                 upload_id=upload.id,
@@ -332,13 +436,16 @@ async def generate_exam_from_files(
                 qtype=q_data.type,
                 options=options_dict,
                 answer=answer_dict,
-                concept_ids=concept_ids if concept_ids else None
+                content_hash=content_hash,
+                concepts=question_concepts
             )
             
             db.add(question)
             created_questions.append(question)
+            questions_by_hash[content_hash] = question
         
         # Step 7: Create exam record
+        await db.flush()  # Get question IDs
         question_ids = [q.id for q in created_questions]
         exam_settings = {
             "question_count": question_count,
@@ -351,62 +458,336 @@ async def generate_exam_from_files(
         exam = Exam(
             upload_id=upload.id,
             settings=exam_settings,
-            question_ids=question_ids
+            exam_questions=build_exam_questions(question_ids)
         )
         db.add(exam)
-        db.commit()
-        db.refresh(exam)
+
+        # Library statistics commit together with the rows they describe
+        upload.question_count = len(created_questions)
+        upload.question_type_counts = count_question_types(q.qtype for q in created_questions) or None
+        upload.exam_count = 1
+        await db.commit()
         
         # Assign to class if specified
         if class_id:
-            from ..models import upload_classes
-            try:
-                db.execute(
-                    upload_classes.insert().values(upload_id=upload.id, class_id=class_id)
-                )
-                db.commit()
-            except Exception as e:
-                # Class assignment failed, but don't fail the whole request
-                print(f"Warning: Could not assign to class: {e}")
+            await _assign_class(db, upload.id, class_id)
         
         # Step 8: Prepare response
         return GenerateExamResponse(
             exam_id=exam.id,
             upload_id=upload.id,
             question_count=len(created_questions),
-            stats={
-                "metadata": {
-                    "topic": generated_exam.metadata.topic,
-                    "themes": generated_exam.metadata.themes,
-                    "difficulty": generated_exam.metadata.difficulty,
-                    "estimated_time_minutes": generated_exam.metadata.estimated_time_minutes
-                },
-                "questions_generated": len(created_questions),
-                "question_types": {
-                    qt: sum(1 for q in created_questions if q.qtype == qt)
-                    for qt in question_types_list
-                },
-                "concepts_extracted": list(concept_names),
-                "source_files": file_names
-            }
+            stats=_exam_stats(
+                generated_exam.metadata,
+                created_questions,
+                generated=len(generated_exam.questions),
+                chunks=getattr(generated_exam, '_chunks', 1),
+                question_types=question_types_list,
+                concept_names=concept_names,
+                file_names=file_names,
+            )
         )
     
     except HTTPException:
         raise
     
     except ValueError as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Failed to generate exam: {str(e)}"
         )
     
     finally:
-        db.close()
+        await db.close()
+
+async def _prepare_generation(
+    files: List[SpooledFile],
+    *,
+    question_count: int,
+    difficulty: str,
+    question_types: str,
+    focus_concepts: Optional[str],
+    map_reduce: bool,
+    api_key: str,
+) -> Tuple[str, ExamConfig]:
+    """Extract the files' text (as much as the mode uses) and build the config.
+
+    With focus concepts (and no map-reduce, which covers every chunk
+    anyway), more material is extracted and the passages about those
+    concepts are packed into the prompt budget.
+    """
+    question_types_list = [qt.strip() for qt in question_types.split(",") if qt.strip()]
+    focus_concepts_list = None
+    if focus_concepts:
+        focus_concepts_list = [fc.strip() for fc in focus_concepts.split(",") if fc.strip()]
+    
+    config = ExamConfig(
+        question_count=question_count,
+        difficulty=difficulty,
+        question_types=question_types_list,
+        focus_concepts=focus_concepts_list
+    )
+
+    budget = gemini_service.PROMPT_CONTENT_BUDGET
+    if map_reduce:
+        budget *= gemini_service.map_reduce_chunk_limit(question_count)
+    elif focus_concepts_list:
+        budget *= gemini_service.FOCUS_SEARCH_PROMPTS
+    content = await file_processor.process_multiple_files(files, budget=budget)
+    
+    if not content or len(content) < 100:
+        raise HTTPException(
+            status_code=400,
+            detail="Could not extract enough content from files. Please ensure files contain text."
+        )
+
+    if focus_concepts_list and not map_reduce:
+        content = await gemini_service.select_content(content, config, api_key)
+    return content, config
+
+
+def _question_columns(q_data: gemini_service.QuestionData) -> Tuple[Optional[dict], Optional[dict]]:
+    """Question.options and Question.answer values for a generated question."""
+    # Prepare options as JSON dict
+    options_dict = None
+    if q_data.options and len(q_data.options) > 0:
+        options_dict = {"list": q_data.options}
+    
+    # Prepare answer as JSON dict
+    answer_dict = None
+    if q_data.answer:
+        # Convert answer to appropriate format based on question type
+        # For multi-select, parse comma-separated answers into list
+        if q_data.type == 'multi':
+            # Check if already a list (from JSON parsing) or string to split
+            if isinstance(q_data.answer, str):
+                answer_list = [a.strip() for a in q_data.answer.split(",") if a.strip()]
+                answer_dict = {"value": answer_list}
+            elif isinstance(q_data.answer, list):
+                answer_dict = {"value": q_data.answer}
+            else:
+                answer_dict = {"value": str(q_data.answer)}
+        elif q_data.type == 'cloze':
+            # For cloze questions, parse multiple answers
+            if isinstance(q_data.answer, str):
+                answer_list = [a.strip() for a in q_data.answer.split(",") if a.strip()]
+                answer_dict = {"value": answer_list}
+            elif isinstance(q_data.answer, list):
+                answer_dict = {"value": q_data.answer}
+            else:
+                answer_dict = {"value": [str(q_data.answer)]}
+        else:
+            # For MCQ, short answer, true/false: single answer as string
+            answer_dict = {"value": str(q_data.answer)}
+    
+    return options_dict, answer_dict
+
+
+def _exam_stats(
+    metadata: gemini_service.ExamMetadata,
+    created_questions: List[Question],
+    *,
+    generated: int,
+    chunks: int,
+    question_types: List[str],
+    concept_names: Iterable[str],
+    file_names: List[str],
+) -> Dict[str, Any]:
+    """GenerateExamResponse.stats"""
+    return {
+        "metadata": {
+            "topic": metadata.topic,
+            "themes": metadata.themes,
+            "difficulty": metadata.difficulty,
+            "estimated_time_minutes": metadata.estimated_time_minutes
+        },
+        "questions_generated": len(created_questions),
+        "duplicates_skipped": generated - len(created_questions),
+        "chunks": chunks,
+        "question_types": {
+            qt: sum(1 for q in created_questions if q.qtype == qt)
+            for qt in question_types
+        },
+        "concepts_extracted": list(concept_names),
+        "source_files": file_names
+    }
+
+
+async def _new_ai_upload(db) -> Upload:
+    """An unsaved upload named after the count of AI-generated uploads so far."""
+    # Count existing AI-generated uploads and increment
+    ai_upload_count = await db.scalar(
+        select(func.count()).select_from(Upload).where(Upload.file_type == "ai_generated")
+    )
+    return Upload(
+        filename=f"AI Generated Quiz {ai_upload_count + 1}",
+        file_type="ai_generated",
+        created_at=datetime.now()
+    )
+
+
+async def _assign_class(db, upload_id: int, class_id: int) -> None:
+    try:
+        await db.execute(
+            upload_classes.insert().values(upload_id=upload_id, class_id=class_id)
+        )
+        await db.commit()
+    except Exception as e:
+        # Class assignment failed, but don't fail the whole request
+        print(f"Warning: Could not assign to class: {e}")
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _exam_events(
+    stream: gemini_service.ExamStream,
+    exam_settings: Dict[str, Any],
+    class_id: Optional[int],
+    file_names: List[str],
+) -> AsyncIterator[str]:
+    """Run stream, committing each question as it arrives (see stream_exam_from_files)."""
+    db = AsyncSessionLocal()
+    exam_id = upload_id = None
+    created_questions: List[Question] = []
+    questions_by_hash: Dict[str, Question] = {}
+    concept_map: Dict[str, Concept] = {}
+    try:
+        upload = await _new_ai_upload(db)
+        upload.exam_count = 1
+        db.add(upload)
+        await db.flush()
+        exam = Exam(upload_id=upload.id, settings=exam_settings)
+        db.add(exam)
+        await db.commit()
+        exam_id, upload_id = exam.id, upload.id
+        if class_id:
+            await _assign_class(db, upload_id, class_id)
+        yield _sse("exam", {"exam_id": exam_id, "upload_id": upload_id})
+
+        async with aclosing(stream.questions(heartbeat=SSE_HEARTBEAT_SECONDS)) as questions:
+            async for q_data in questions:
+                if q_data is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                options_dict, answer_dict = _question_columns(q_data)
+                content_hash = question_hash(q_data.question, answer_dict)
+                if content_hash in questions_by_hash:
+                    continue
+
+                names = list(dict.fromkeys(q_data.concepts or []))
+                for name in names:
+                    if name not in concept_map:
+                        concept_map[name] = Concept(upload_id=upload.id, name=name, score=1.0)
+                        db.add(concept_map[name])
+                question = Question(
+                    upload_id=upload.id,
+                    stem=q_data.question,
+                    qtype=q_data.type,
+                    options=options_dict,
+                    answer=answer_dict,
+                    content_hash=content_hash,
+                    concepts=[concept_map[name] for name in names]
+                )
+                db.add(question)
+                await db.flush()
+                db.add(ExamQuestion(exam_id=exam_id, position=len(created_questions), question_id=question.id))
+                created_questions.append(question)
+                questions_by_hash[content_hash] = question
+                # The exam is complete as far as it goes after every question
+                upload.question_count = len(created_questions)
+                upload.question_type_counts = count_question_types(q.qtype for q in created_questions) or None
+                await db.commit()
+
+                yield _sse("question", {
+                    "position": len(created_questions) - 1,
+                    "question": {
+                        "id": question.id,
+                        "stem": question.stem,
+                        "type": question.qtype,
+                        "options": q_data.options,
+                        "concepts": [concept_map[name].id for name in names],
+                    },
+                })
+
+        config = stream.requests[0][1]
+        metadata = stream.metadata or gemini_service.ExamMetadata(
+            topic="", themes=[], difficulty=config.difficulty, estimated_time_minutes=0
+        )
+        response = GenerateExamResponse(
+            exam_id=exam_id,
+            upload_id=upload_id,
+            question_count=len(created_questions),
+            stats=_exam_stats(
+                metadata,
+                created_questions,
+                generated=stream.generated,
+                chunks=stream.chunks,
+                question_types=exam_settings["question_types"],
+                concept_names=concept_map,
+                file_names=file_names,
+            ),
+        )
+        yield _sse("done", response.model_dump())
+
+    except Exception as e:
+        await db.rollback()
+        if not created_questions:
+            await _discard_empty_exam(db, exam_id, upload_id)
+        yield _sse("error", {"detail": str(e)})
+
+    except BaseException:
+        # The client went away: no event can be sent, but an exam without
+        # questions must not stay. Starlette cancels the response through an
+        # anyio cancel scope, which would cancel these awaits too.
+        with anyio.CancelScope(shield=True):
+            await db.rollback()
+            if not created_questions:
+                await _discard_empty_exam(db, exam_id, upload_id)
+        raise
+
+    finally:
+        with anyio.CancelScope(shield=True):
+            await db.close()
+
+
+async def _discard_empty_exam(db, exam_id: Optional[int], upload_id: Optional[int]) -> None:
+    """Remove the exam and upload _exam_events created, if it got that far."""
+    if exam_id is None:
+        return
+    await db.execute(delete(Exam).where(Exam.id == exam_id))
+    await db.execute(upload_classes.delete().where(upload_classes.c.upload_id == upload_id))
+    await db.execute(delete(Upload).where(Upload.id == upload_id))
+    await db.commit()
+
+
+async def _run_ai_generation_job(job: JobContext) -> Dict[str, Any]:
+    """Background generation over the files spooled by the request."""
+    files = [SpooledFile(**f) for f in job.params["source_files"]]
+    settings = {
+        key: value for key, value in job.params.items() if key not in ("source_files", "spool_files")
+    }
+    try:
+        response = await _generate_exam(
+            files, api_key=job.runtime["api_key"], progress=job.progress, **settings
+        )
+    except HTTPException as exc:
+        raise RuntimeError(exc.detail) from exc
+    return response.model_dump()
+
+
+# The API key only ever lives in memory, so these cannot resume after a restart
+job_manager.register(
+    AI_GENERATION_JOB,
+    _run_ai_generation_job,
+    interrupted_message="The server restarted before generation finished; please submit the files again",
+)
 
 
 @router.get("/ai/supported-formats")
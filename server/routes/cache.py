@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from typing import Any, Dict
+
+from fastapi import APIRouter
+
+from ..services.file_processor import extraction_cache
+from ..services.gemini_service import generation_cache, model_catalog
+
+router = APIRouter(tags=["cache"])
+
+
+@router.get("/cache/stats")
+def cache_stats() -> Dict[str, Any]:
+    """Size, entry count and hit/miss counters of the server's caches"""
+    return {
+        "extraction": extraction_cache.stats(),
+        "generation": generation_cache.stats(),
+        "models": model_catalog.stats(),
+    }
@@ -1,18 +1,40 @@
 from __future__ import annotations
 
+from collections import defaultdict
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, delete, exists, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
 
-from ..db import get_db
-from ..models import Attempt, AttemptAnswer, Exam, Question, Upload
+from ..db import get_async_db, get_db, retry_on_locked
+from ..models import (
+    Attempt,
+    AttemptAnswer,
+    Class as ClassModel,
+    Concept,
+    Exam,
+    Upload,
+    upload_classes,
+)
+from ..pagination import decode_cursor, encode_cursor
+from ..services.exams import (
+    exam_concepts_query,
+    exam_question_count,
+    exam_questions_query,
+    group_concept_ids,
+)
+from ..services.upload_stats import bump_upload_counts
 from ..schemas import (
     AttemptDetail,
+    AttemptPage,
     AttemptSummary,
     QuestionDTO,
     QuestionReview,
+    UploadPage,
     UploadSummary,
 )
 
@@ -32,144 +54,293 @@ def debug_routes():
     return {"routes": routes_info}
 
 
+async def _library_page(
+    db: AsyncSession,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    class_id: Optional[int] = None,
+    file_type: Optional[str] = None,
+) -> Tuple[List[UploadSummary], Optional[str]]:
+    """Build upload summaries in a fixed number of queries.
+
+    Counts come from the denormalized statistics columns on uploads; themes
+    and class tags are fetched for the whole page at once.
+    """
+    query = select(
+        Upload.id,
+        Upload.filename,
+        Upload.file_type,
+        Upload.created_at,
+        Upload.question_count,
+        Upload.exam_count,
+        Upload.attempt_count,
+        Upload.question_type_counts,
+    )
+    if file_type:
+        query = query.where(Upload.file_type == file_type)
+    if class_id is not None:
+        query = query.where(
+            exists().where(
+                upload_classes.c.upload_id == Upload.id,
+                upload_classes.c.class_id == class_id,
+            )
+        )
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        query = query.where(
+            or_(
+                Upload.created_at < cursor_created_at,
+                and_(Upload.created_at == cursor_created_at, Upload.id < cursor_id),
+            )
+        )
+    query = query.order_by(Upload.created_at.desc(), Upload.id.desc())
+    if limit is not None:
+        # Fetch one extra row to know whether another page exists
+        query = query.limit(limit + 1)
+
+    rows = (await db.execute(query)).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    upload_ids = [row.id for row in rows]
+    if not upload_ids:
+        return [], None
+
+    # Themes from concepts
+    themes: Dict[int, List[str]] = defaultdict(list)
+    for upload_id, name in await db.execute(
+        select(Concept.upload_id, Concept.name)
+        .where(Concept.upload_id.in_(upload_ids))
+        .order_by(Concept.upload_id, Concept.id)
+    ):
+        themes[upload_id].append(name)
+
+    # Class tags
+    class_tags: Dict[int, List[str]] = defaultdict(list)
+    for upload_id, name in await db.execute(
+        select(upload_classes.c.upload_id, ClassModel.name)
+        .join(ClassModel, ClassModel.id == upload_classes.c.class_id)
+        .where(upload_classes.c.upload_id.in_(upload_ids))
+        .order_by(upload_classes.c.upload_id, ClassModel.name)
+    ):
+        class_tags[upload_id].append(name)
+
+    items = [
+        UploadSummary(
+            id=row.id,
+            filename=row.filename,
+            created_at=row.created_at,
+            question_count=row.question_count,
+            themes=themes[row.id],
+            exam_count=row.exam_count,
+            attempt_count=row.attempt_count,
+            file_type=row.file_type,
+            class_tags=class_tags[row.id],
+            question_type_counts=row.question_type_counts or None,
+        )
+        for row in rows
+    ]
+    return items, next_cursor
+
+
 @router.get("/uploads", response_model=List[UploadSummary])
-def get_all_uploads(db: Session = Depends(get_db)) -> List[UploadSummary]:
+async def get_all_uploads(
+    class_id: Optional[int] = None,
+    file_type: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+) -> List[UploadSummary]:
     """Return all uploaded CSVs with question counts and metadata"""
-    uploads = db.query(Upload).order_by(Upload.created_at.desc()).all()
-    
-    result = []
-    for upload in uploads:
-        # Extract themes from concepts
-        themes = []
-        if upload.concepts:
-            themes = [concept.name for concept in upload.concepts]
-        
-        # Parse metadata if available
-        metadata = {}
-        if hasattr(upload, 'metadata_json') and upload.metadata_json:
-            try:
-                import json
-                metadata = json.loads(upload.metadata_json)
-                if 'themes' in metadata:
-                    themes = metadata['themes']
-            except (json.JSONDecodeError, KeyError):
-                pass
-        
-        # Get class tags
-        class_tags = [cls.name for cls in upload.classes] if upload.classes else []
-        
-        # Calculate question type counts
-        question_type_counts = {}
-        for question in upload.questions:
-            qtype = question.qtype
-            question_type_counts[qtype] = question_type_counts.get(qtype, 0) + 1
-        
-        result.append(
-            UploadSummary(
-                id=upload.id,
-                filename=upload.filename,
-                created_at=upload.created_at,
-                question_count=len(upload.questions),
-                themes=themes,
-                exam_count=len(upload.exams),
-                file_type=upload.file_type,
-                class_tags=class_tags,
-                question_type_counts=question_type_counts if question_type_counts else None,
+    items, _ = await _library_page(db, class_id=class_id, file_type=file_type)
+    return items
+
+
+@router.get("/uploads/page", response_model=UploadPage)
+async def get_uploads_page(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    class_id: Optional[int] = None,
+    file_type: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+) -> UploadPage:
+    """Return one keyset-paginated page of the upload library.
+
+    Pass the returned next_cursor back as cursor to fetch the following page.
+    """
+    items, next_cursor = await _library_page(
+        db, limit=limit, cursor=cursor, class_id=class_id, file_type=file_type
+    )
+    return UploadPage(items=items, next_cursor=next_cursor)
+
+
+def _attempt_history_query(
+    limit: int,
+    cursor: Optional[str] = None,
+    upload_id: Optional[int] = None,
+    class_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Select:
+    """Build the single joined query behind attempt summaries.
+
+    Ordered newest first and paginated by (finished_at, id); fetches one row
+    past limit so the caller can tell whether another page exists.
+    """
+    correct_count = (
+        select(func.count(AttemptAnswer.id))
+        .where(AttemptAnswer.attempt_id == Attempt.id, AttemptAnswer.correct.is_(True))
+        .correlate(Attempt)
+        .scalar_subquery()
+    )
+    query = (
+        select(
+            Attempt.id,
+            Attempt.exam_id,
+            Attempt.score_pct,
+            Attempt.finished_at,
+            Upload.filename,
+            exam_question_count().label("question_count"),
+            correct_count.label("correct_count"),
+        )
+        .join(Exam, Exam.id == Attempt.exam_id)
+        .join(Upload, Upload.id == Exam.upload_id)
+        .where(Attempt.finished_at.isnot(None))
+    )
+    if upload_id is not None:
+        query = query.where(Exam.upload_id == upload_id)
+    if class_id is not None:
+        query = query.where(
+            exists().where(
+                upload_classes.c.upload_id == Exam.upload_id,
+                upload_classes.c.class_id == class_id,
             )
         )
-    
-    return result
+    if since is not None:
+        query = query.where(Attempt.finished_at >= since)
+    if until is not None:
+        query = query.where(Attempt.finished_at < until)
+    if cursor:
+        try:
+            cursor_finished_at, cursor_id = decode_cursor(cursor)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        query = query.where(
+            or_(
+                Attempt.finished_at < cursor_finished_at,
+                and_(Attempt.finished_at == cursor_finished_at, Attempt.id < cursor_id),
+            )
+        )
+    return query.order_by(Attempt.finished_at.desc(), Attempt.id.desc()).limit(limit + 1)
+
+
+async def _attempt_history(
+    db: AsyncSession, limit: int, **filters: Any
+) -> Tuple[List[AttemptSummary], Optional[str]]:
+    """Fetch one page of finished attempt summaries."""
+    rows = (await db.execute(_attempt_history_query(limit, **filters))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].finished_at, rows[-1].id)
+
+    items = [
+        AttemptSummary(
+            id=row.id,
+            exam_id=row.exam_id,
+            upload_filename=row.filename,
+            score_pct=row.score_pct or 0.0,
+            finished_at=row.finished_at,
+            question_count=row.question_count or 0,
+            correct_count=row.correct_count or 0,
+        )
+        for row in rows
+    ]
+    return items, next_cursor
 
 
 @router.get("/attempts/recent", response_model=List[AttemptSummary])
-def get_recent_attempts(limit: int = 10, db: Session = Depends(get_db)) -> List[AttemptSummary]:
+async def get_recent_attempts(limit: int = 10, db: AsyncSession = Depends(get_async_db)) -> List[AttemptSummary]:
     """Return recent exam attempts with scores"""
-    attempts = (
-        db.query(Attempt)
-        .filter(Attempt.finished_at.isnot(None))
-        .order_by(Attempt.finished_at.desc())
-        .limit(limit)
-        .all()
+    items, _ = await _attempt_history(db, limit=limit)
+    return items
+
+
+@router.get("/attempts/history", response_model=AttemptPage)
+async def get_attempt_history(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    upload_id: Optional[int] = None,
+    class_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+) -> AttemptPage:
+    """Return one keyset-paginated page of finished attempts.
+
+    Pass the returned next_cursor back as cursor to fetch older attempts.
+    """
+    items, next_cursor = await _attempt_history(
+        db,
+        limit=limit,
+        cursor=cursor,
+        upload_id=upload_id,
+        class_id=class_id,
+        since=since,
+        until=until,
     )
-    
-    result = []
-    for attempt in attempts:
-        exam = db.get(Exam, attempt.exam_id)
-        if not exam:
-            continue
-            
-        upload = db.get(Upload, exam.upload_id)
-        if not upload:
-            continue
-        
-        # Count correct answers
-        correct_count = 0
-        if attempt.answers:
-            correct_count = sum(1 for answer in attempt.answers if answer.correct)
-        
-        result.append(
-            AttemptSummary(
-                id=attempt.id,
-                exam_id=attempt.exam_id,
-                upload_filename=upload.filename,
-                score_pct=attempt.score_pct or 0.0,
-                finished_at=attempt.finished_at or attempt.started_at,
-                question_count=len(exam.question_ids),
-                correct_count=correct_count,
-            )
-        )
-    
-    return result
+    return AttemptPage(items=items, next_cursor=next_cursor)
 
 
 @router.delete("/attempts/delete/{attempt_id}")
-def delete_attempt(attempt_id: int, db: Session = Depends(get_db)) -> Dict[str, Any]:
+@retry_on_locked
+async def delete_attempt(attempt_id: int, db: AsyncSession = Depends(get_async_db)) -> Dict[str, Any]:
     """Delete an exam attempt and its answers"""
-    attempt = db.get(Attempt, attempt_id)
+    attempt = await db.get(Attempt, attempt_id)
     if not attempt:
         raise HTTPException(status_code=404, detail="Attempt not found")
     
+    exam_upload_id = await db.scalar(select(Exam.upload_id).where(Exam.id == attempt.exam_id))
+    if exam_upload_id is not None:
+        await db.execute(bump_upload_counts(exam_upload_id, attempts=-1))
+
     # Delete all answers first
-    db.query(AttemptAnswer).filter(AttemptAnswer.attempt_id == attempt_id).delete()
+    await db.execute(delete(AttemptAnswer).where(AttemptAnswer.attempt_id == attempt_id))
     
-    # Delete the attempt
-    db.delete(attempt)
-    db.commit()
+    # Delete the attempt (Core delete: an ORM delete would lazy-load answers)
+    await db.execute(delete(Attempt).where(Attempt.id == attempt_id))
+    await db.commit()
     
     return {"success": True}
 
 
 @router.get("/attempts/{attempt_id}", response_model=AttemptDetail)
-def get_attempt_detail(attempt_id: int, db: Session = Depends(get_db)) -> AttemptDetail:
+async def get_attempt_detail(attempt_id: int, db: AsyncSession = Depends(get_async_db)) -> AttemptDetail:
     """Return full attempt details for review"""
-    attempt = db.get(Attempt, attempt_id)
+    attempt = await db.get(Attempt, attempt_id)
     if not attempt:
         raise HTTPException(status_code=404, detail="Attempt not found")
     
-    exam = db.get(Exam, attempt.exam_id)
+    exam = await db.get(Exam, attempt.exam_id)
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
     
-    # Get all questions for this exam (maintain order from exam.question_ids)
-    questions_query = (
-        db.query(Question)
-        .filter(Question.id.in_(exam.question_ids))
-        .all()
-    )
-    
-    # Create a lookup and maintain order
-    question_lookup = {q.id: q for q in questions_query}
-    questions = [question_lookup[qid] for qid in exam.question_ids if qid in question_lookup]
+    # Get all questions for this exam in exam order
+    questions = (await db.scalars(exam_questions_query(exam.id))).all()
     
     # Get all answers for this attempt
     answers = (
-        db.query(AttemptAnswer)
-        .filter(AttemptAnswer.attempt_id == attempt_id)
-        .all()
-    )
+        await db.scalars(select(AttemptAnswer).where(AttemptAnswer.attempt_id == attempt_id))
+    ).all()
     
     # Create answer lookup
     answer_lookup = {answer.question_id: answer for answer in answers}
+
+    # Concept tags per question
+    concept_ids = group_concept_ids(await db.execute(exam_concepts_query(exam.id)))
     
     # Build question reviews
     question_reviews = []
@@ -187,7 +358,7 @@ def get_attempt_detail(attempt_id: int, db: Session = Depends(get_db)) -> Attemp
             "stem": question.stem,
             "type": question.qtype,
             "options": options_data if options_data else None,
-            "concepts": question.concept_ids if question.concept_ids else [],
+            "concepts": concept_ids.get(question.id, []),
         })
         
         question_reviews.append(
@@ -209,6 +380,7 @@ def get_attempt_detail(attempt_id: int, db: Session = Depends(get_db)) -> Attemp
 
 
 @router.delete("/uploads/{upload_id}")
+@retry_on_locked
 def delete_upload(upload_id: int, db: Session = Depends(get_db)) -> Dict[str, Any]:
     """Delete CSV and all associated data"""
     upload = db.get(Upload, upload_id)
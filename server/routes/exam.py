@@ -4,93 +4,109 @@ from datetime import datetime
 from typing import Any, Dict, List
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..db import get_db
-from ..models import Attempt, AttemptAnswer, Exam as ExamModel, Question as QuestionModel, Upload
+from ..db import get_async_db, retry_on_locked
+from ..models import (
+    Attempt,
+    AttemptAnswer,
+    Exam as ExamModel,
+    ExamQuestion,
+    Question as QuestionModel,
+    Upload,
+)
 from ..schemas import ExamCreate, ExamOut, GradeItem, GradeReport, QuestionDTO, UserAnswer
+from ..services.exams import (
+    build_exam_questions,
+    exam_concepts_query,
+    exam_questions_query,
+    group_concept_ids,
+    questions_with_concepts,
+)
+from ..services.upload_stats import bump_upload_counts
 
 router = APIRouter(tags=["exam"])
 
 
+def _question_dto(q: QuestionModel, concept_ids: List[int]) -> QuestionDTO:
+    return QuestionDTO.model_validate({
+        "id": q.id,
+        "stem": q.stem,
+        "type": q.qtype,
+        "options": (q.options or {}).get("list"),
+        "concepts": concept_ids,
+    })
+
+
 @router.post("/exams", response_model=ExamOut)
-def create_exam(payload: ExamCreate, db: Session = Depends(get_db)) -> ExamOut:
+@retry_on_locked
+async def create_exam(payload: ExamCreate, db: AsyncSession = Depends(get_async_db)) -> ExamOut:
     # If multiple upload IDs provided, query from all of them
     if payload.uploadIds and len(payload.uploadIds) > 1:
         # Query questions from multiple uploads
-        query = db.query(QuestionModel).filter(QuestionModel.upload_id.in_(payload.uploadIds))
+        query = select(QuestionModel).where(QuestionModel.upload_id.in_(payload.uploadIds))
     else:
         # Single upload (either from uploadId or first of uploadIds)
         upload_id = payload.uploadId
-        upload = db.get(Upload, upload_id)
+        upload = await db.get(Upload, upload_id)
         if upload is None:
             raise HTTPException(status_code=404, detail="Upload not found")
-        query = db.query(QuestionModel).filter(QuestionModel.upload_id == upload_id)
+        query = select(QuestionModel).where(QuestionModel.upload_id == upload_id)
     
     if payload.questionTypes:
-        query = query.filter(QuestionModel.qtype.in_(payload.questionTypes))
+        query = query.where(QuestionModel.qtype.in_(payload.questionTypes))
+
+    if payload.includeConceptIds:
+        query = query.where(
+            QuestionModel.id.in_(questions_with_concepts(payload.includeConceptIds))
+        )
     
     # Count available questions
-    available_count = query.count()
+    available_count = await db.scalar(select(func.count()).select_from(query.subquery()))
     if payload.count > available_count:
         raise HTTPException(
             status_code=400, 
             detail=f"Requested {payload.count} questions but only {available_count} are available"
         )
     
-    questions = query.limit(payload.count).all()
+    questions = (await db.scalars(query.limit(payload.count))).all()
 
     question_ids = [q.id for q in questions]
     # Use the primary upload ID (or first one if multiple)
     primary_upload_id = payload.uploadId if not payload.uploadIds else payload.uploadIds[0]
-    exam = ExamModel(upload_id=primary_upload_id, settings=payload.model_dump(), question_ids=question_ids)
+    exam = ExamModel(
+        upload_id=primary_upload_id,
+        settings=payload.model_dump(),
+        exam_questions=build_exam_questions(question_ids),
+    )
     db.add(exam)
-    db.commit()
-    db.refresh(exam)
-
-    dto = [
-        QuestionDTO.model_validate({
-            "id": q.id,
-            "stem": q.stem,
-            "type": q.qtype,
-            "options": (q.options or {}).get("list"),
-            "concepts": q.concept_ids or [],
-        })
-        for q in questions
-    ]
+    await db.execute(bump_upload_counts(primary_upload_id, exams=1))
+    await db.commit()
+
+    concept_ids = group_concept_ids(await db.execute(exam_concepts_query(exam.id)))
+    dto = [_question_dto(q, concept_ids.get(q.id, [])) for q in questions]
     return ExamOut(examId=exam.id, questions=dto)
 
 
 @router.get("/exams/{exam_id}", response_model=ExamOut)
-def get_exam(exam_id: int, db: Session = Depends(get_db)) -> ExamOut:
-    exam = db.get(ExamModel, exam_id)
+async def get_exam(exam_id: int, db: AsyncSession = Depends(get_async_db)) -> ExamOut:
+    exam = await db.get(ExamModel, exam_id)
     if exam is None:
         raise HTTPException(status_code=404, detail="Exam not found")
-    questions = (
-        db.query(QuestionModel).filter(QuestionModel.id.in_(exam.question_ids)).all()
-    )
-    dto = [
-        QuestionDTO.model_validate({
-            "id": q.id,
-            "stem": q.stem,
-            "type": q.qtype,
-            "options": (q.options or {}).get("list"),
-            "concepts": q.concept_ids or [],
-        })
-        for q in questions
-    ]
+    questions = (await db.scalars(exam_questions_query(exam.id))).all()
+    concept_ids = group_concept_ids(await db.execute(exam_concepts_query(exam.id)))
+    dto = [_question_dto(q, concept_ids.get(q.id, [])) for q in questions]
     return ExamOut(examId=exam.id, questions=dto)
 
 
 @router.get("/exams/{exam_id}/preview")
-def preview_exam_answers(exam_id: int, db: Session = Depends(get_db)) -> Dict[str, Any]:
+async def preview_exam_answers(exam_id: int, db: AsyncSession = Depends(get_async_db)) -> Dict[str, Any]:
     """Get exam questions with correct answers for preview (does not create attempt)"""
-    exam = db.get(ExamModel, exam_id)
+    exam = await db.get(ExamModel, exam_id)
     if exam is None:
         raise HTTPException(status_code=404, detail="Exam not found")
-    questions = (
-        db.query(QuestionModel).filter(QuestionModel.id.in_(exam.question_ids)).all()
-    )
+    questions = (await db.scalars(exam_questions_query(exam.id))).all()
     
     preview_data = []
     for q in questions:
@@ -103,22 +119,21 @@ def preview_exam_answers(exam_id: int, db: Session = Depends(get_db)) -> Dict[st
 
 
 @router.post("/exams/{exam_id}/grade", response_model=GradeReport)
-def grade_exam(
-    exam_id: int, answers: List[UserAnswer], db: Session = Depends(get_db)
+@retry_on_locked
+async def grade_exam(
+    exam_id: int, answers: List[UserAnswer], db: AsyncSession = Depends(get_async_db)
 ) -> GradeReport:
-    exam = db.get(ExamModel, exam_id)
+    exam = await db.get(ExamModel, exam_id)
     if exam is None:
         raise HTTPException(status_code=404, detail="Exam not found")
 
-    questions = {q.id: q for q in db.query(QuestionModel).filter(QuestionModel.id.in_(exam.question_ids)).all()}
+    questions = (await db.scalars(exam_questions_query(exam.id))).all()
     answers_by_qid: Dict[int, Any] = {a.questionId: a.response for a in answers}
 
     per_items: List[GradeItem] = []
     correct_count = 0
-    for qid in exam.question_ids:
-        q = questions.get(qid)
-        if q is None:
-            continue
+    for q in questions:
+        qid = q.id
         user_resp = answers_by_qid.get(qid)
         correct_answer = (q.answer or {}).get("value")
         is_correct = _check_correct(q.qtype, user_resp, correct_answer)
@@ -133,7 +148,7 @@ def grade_exam(
         if is_correct:
             correct_count += 1
 
-    score_pct = (correct_count / max(1, len(exam.question_ids))) * 100.0
+    score_pct = (correct_count / max(1, len(questions))) * 100.0
     
     # Create attempt record
     attempt = Attempt(
@@ -142,7 +157,8 @@ def grade_exam(
         score_pct=score_pct
     )
     db.add(attempt)
-    db.flush()
+    await db.execute(bump_upload_counts(exam.upload_id, attempts=1))
+    await db.flush()
     
     # Save individual answers
     for item in per_items:
@@ -154,7 +170,7 @@ def grade_exam(
         )
         db.add(answer_record)
     
-    db.commit()
+    await db.commit()
     
     return GradeReport(
         scorePct=round(score_pct, 2), 
@@ -181,24 +197,25 @@ def _check_correct(qtype: str, user: Any, answer: Any) -> bool:
 
 
 @router.post("/attempts/{attempt_id}/questions/{question_id}/override")
-def override_question_grade(
+@retry_on_locked
+async def override_question_grade(
     attempt_id: int,
     question_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict[str, Any]:
     """Override the grade for a specific question in an attempt"""
-    attempt = db.get(Attempt, attempt_id)
+    attempt = await db.get(Attempt, attempt_id)
     if attempt is None:
         raise HTTPException(status_code=404, detail="Attempt not found")
     
     # Find the answer record
-    answer_record = (
-        db.query(AttemptAnswer)
-        .filter(
+    answer_record = await db.scalar(
+        select(AttemptAnswer)
+        .where(
             AttemptAnswer.attempt_id == attempt_id,
             AttemptAnswer.question_id == question_id
         )
-        .first()
+        .limit(1)
     )
     
     if answer_record is None:
@@ -208,11 +225,12 @@ def override_question_grade(
     answer_record.correct = not answer_record.correct
     
     # Recalculate overall score
+    await db.flush()
     all_answers = (
-        db.query(AttemptAnswer)
-        .filter(AttemptAnswer.attempt_id == attempt_id)
-        .all()
-    )
+        await db.scalars(
+            select(AttemptAnswer).where(AttemptAnswer.attempt_id == attempt_id)
+        )
+    ).all()
     
     correct_count = sum(1 for ans in all_answers if ans.correct)
     total_count = len(all_answers)
@@ -220,7 +238,7 @@ def override_question_grade(
     
     attempt.score_pct = new_score_pct
     
-    db.commit()
+    await db.commit()
     
     return {
         "success": True,
@@ -229,3 +247,20 @@ def override_question_grade(
     }
 
 
+@router.get("/questions/{question_id}/exams")
+async def get_exams_for_question(
+    question_id: int, db: AsyncSession = Depends(get_async_db)
+) -> Dict[str, Any]:
+    """List the exams that include a question"""
+    question = await db.get(QuestionModel, question_id)
+    if question is None:
+        raise HTTPException(status_code=404, detail="Question not found")
+    exam_ids = (
+        await db.scalars(
+            select(ExamQuestion.exam_id)
+            .where(ExamQuestion.question_id == question_id)
+            .distinct()
+            .order_by(ExamQuestion.exam_id)
+        )
+    ).all()
+    return {"questionId": question_id, "examIds": list(exam_ids)}
@@ -1,32 +1,85 @@
 from __future__ import annotations
 
 import csv
+import hashlib
 import io
-from typing import Any, Dict, List
+import os
+import tempfile
+from typing import Any, Dict, Optional, Tuple
 
 import pandas as pd
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from ..db import get_db
-from ..models import Concept, Question, Upload
-from ..services.csv_parser import normalize_csv
+from ..db import SessionLocal, get_db
+from ..models import Upload
+from ..services.content_hash import file_sha256
+from ..services.csv_parser import count_csv_lines, normalize_csv
+from ..services.ingest import (
+    CSV_STREAM_THRESHOLD_BYTES,
+    CsvIngestResult,
+    IngestProgress,
+    discard_upload,
+    ingest_csv_file,
+    ingest_questions,
+)
+from ..services.jobs import JobContext, job_manager
 from ..services.text_ingest import split_sentences
 from ..services.concepts import extract_concepts
 from ..services.question_gen import generate_cloze_questions, generate_mcq_from_concepts
 
 router = APIRouter(tags=["files"])
 
+CSV_UPLOAD_JOB = "csv_upload"
+
+
+# Bytes copied per read when spooling an upload to disk
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
 
 @router.post("/upload/csv")
 async def upload_csv(
     file: UploadFile = File(...),
+    stream: bool = Query(False, description="Parse and store the file in chunks (always on for large files)"),
+    background: bool = Query(False, description="Return a job id at once and import in the background"),
     db: Session = Depends(get_db),
 ) -> Dict[str, Any]:
     if not file.filename.lower().endswith(".csv"):
         raise HTTPException(status_code=400, detail="Please upload a CSV file")
 
+    if background:
+        path, content_hash = await _spool_to_disk(file, job_manager.spool_path(".csv"))
+        duplicate = _find_duplicate_upload(db, content_hash)
+        if duplicate is not None:
+            os.unlink(path)
+            return duplicate
+        try:
+            job_id = await job_manager.submit(
+                CSV_UPLOAD_JOB,
+                {
+                    "path": path,
+                    "filename": file.filename,
+                    "content_hash": content_hash,
+                    "spool_files": [path],
+                },
+            )
+        except Exception:
+            os.unlink(path)
+            raise
+        return JSONResponse(status_code=202, content={"jobId": job_id, "status": "queued"})
+
+    if stream or (file.size or 0) > CSV_STREAM_THRESHOLD_BYTES:
+        return await _upload_csv_streaming(file, db)
+
     content = await file.read()
+    content_hash = file_sha256(content)
+    duplicate = _find_duplicate_upload(db, content_hash)
+    if duplicate is not None:
+        return duplicate
     try:
         # Debug: Log the CSV content for troubleshooting
         print(f"DEBUG: Processing CSV file: {file.filename}")
@@ -45,7 +98,8 @@ async def upload_csv(
                 skipinitialspace=True,
                 encoding='utf-8',
                 on_bad_lines='warn',  # Warn about bad lines instead of failing
-                engine='python'  # More flexible parsing
+                engine='python',  # More flexible parsing
+                dtype=str,  # As read_csv_chunks: "4" stays "4", not 4.0
             )
             parsing_method = "QUOTE_MINIMAL (Python engine)"
         except Exception as e1:
@@ -60,7 +114,8 @@ async def upload_csv(
                     skipinitialspace=True,
                     encoding='utf-8',
                     on_bad_lines='warn',
-                    engine='python'
+                    engine='python',
+                    dtype=str
                 )
                 parsing_method = "QUOTE_ALL (Python engine)"
             except Exception as e2:
@@ -74,7 +129,8 @@ async def upload_csv(
                         doublequote=True,
                         skipinitialspace=True,
                         encoding='utf-8',
-                        engine='c'
+                        engine='c',
+                        dtype=str
                     )
                     parsing_method = "C engine with quoting"
                 except Exception as e3:
@@ -88,68 +144,204 @@ async def upload_csv(
         print(f"DEBUG: All CSV parsing methods failed: {exc}")
         raise HTTPException(status_code=400, detail=f"Invalid CSV: {exc}") from exc
 
-    upload = Upload(filename=file.filename, file_type="csv")
-    db.add(upload)
-    db.commit()
-    db.refresh(upload)
-
-    normalized, warnings, metadata = normalize_csv(df)
-
-    # Upsert concepts by name for this upload
-    name_to_concept: dict[str, Concept] = {}
-    def _get_concept_id(name: str) -> int:
-        key = name.strip().lower()
-        if not key:
-            return 0
-        if key in name_to_concept:
-            return name_to_concept[key].id
-        existing = (
-            db.query(Concept)
-            .filter(Concept.upload_id == upload.id, Concept.name == name)
-            .first()
-        )
-        if existing is None:
-            existing = Concept(upload_id=upload.id, name=name, score=1.0)
-            db.add(existing)
-            db.commit()
-            db.refresh(existing)
-        name_to_concept[key] = existing
-        return existing.id
-
-    # Insert questions and count types
-    q_count = 0
-    question_type_counts: Dict[str, int] = {}
-    for item in normalized:
-        concept_ids: List[int] = []
-        for c in item.get("concepts", []) or []:
-            cid = _get_concept_id(c)
-            if cid:
-                concept_ids.append(cid)
-        q = Question(
-            upload_id=upload.id,
-            stem=item["stem"],
-            qtype=item["qtype"],
-            options=item.get("options"),
-            answer=item.get("answer"),
-            concept_ids=concept_ids or None,
+    # Normalizing and inserting block (a locked database is waited out with
+    # sleeps), so keep them off the event loop
+    normalized, warnings, metadata = await run_in_threadpool(normalize_csv, df)
+
+    try:
+        result = await run_in_threadpool(
+            ingest_questions,
+            db,
+            filename=file.filename,
+            file_type="csv",
+            items=normalized,
+            content_hash=content_hash,
         )
-        db.add(q)
-        q_count += 1
-        
-        # Count question types
-        qtype = item["qtype"]
-        question_type_counts[qtype] = question_type_counts.get(qtype, 0) + 1
-    db.commit()
+    except IntegrityError:
+        # The same file was stored by a concurrent request in the meantime
+        db.rollback()
+        duplicate = _find_duplicate_upload(db, content_hash)
+        if duplicate is None:
+            raise
+        return duplicate
+    print(
+        f"DEBUG: Stored {result.questions} questions and {result.concepts} concepts "
+        f"in {result.seconds:.3f}s ({result.rows_per_sec:.0f} rows/s), "
+        f"skipped {result.duplicates} duplicates"
+    )
+    question_type_counts = result.question_type_counts
 
     # Add question_type_counts to metadata
     if metadata is None:
         metadata = {}
     metadata["question_type_counts"] = question_type_counts
 
-    stats = {"rows": len(df), "columns": list(df.columns), "questions": q_count, "warnings": warnings, "metadata": metadata}
+    stats = {
+        "rows": len(df),
+        "columns": list(df.columns),
+        "questions": result.questions,
+        "duplicates_skipped": result.duplicates,
+        "warnings": warnings,
+        "metadata": metadata,
+        "ingest": {"seconds": round(result.seconds, 4), "rows_per_sec": round(result.rows_per_sec, 1)},
+    }
+    return {"uploadId": result.upload_id, "stats": stats}
+
+
+def _find_duplicate_upload(db: Session, content_hash: str) -> Optional[Dict[str, Any]]:
+    """Upload response for an earlier upload of the same file, if there is one."""
+    upload = db.scalar(select(Upload).where(Upload.content_hash == content_hash))
+    if upload is None:
+        return None
+    print(f"DEBUG: File already uploaded as upload {upload.id} ({upload.filename})")
+    stats = {
+        "questions": upload.question_count,
+        "duplicate": True,
+        "warnings": [f"Identical file already uploaded as '{upload.filename}'"],
+        "metadata": {"question_type_counts": upload.question_type_counts or {}},
+    }
     return {"uploadId": upload.id, "stats": stats}
 
 
+async def _spool_to_disk(file: UploadFile, path: Optional[str] = None) -> Tuple[str, str]:
+    """Copy an upload to path (default: a new temp file) in fixed-size reads.
+
+    Returns the path written and the SHA-256 of the file's bytes.
+    """
+    if path is None:
+        spool = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".csv", delete=False)
+    else:
+        spool = open(path, "wb")
+    digest = hashlib.sha256()
+    try:
+        with spool:
+            while chunk := await file.read(SPOOL_CHUNK_BYTES):
+                spool.write(chunk)
+                digest.update(chunk)
+    except BaseException:
+        os.unlink(spool.name)
+        raise
+    return spool.name, digest.hexdigest()
+
+
+def _log_progress(progress: IngestProgress) -> None:
+    print(
+        f"DEBUG: Upload {progress.upload_id} chunk {progress.chunk}: "
+        f"{progress.rows} rows read, {progress.questions} questions stored "
+        f"({progress.seconds:.1f}s)"
+    )
+
+
+async def _upload_csv_streaming(file: UploadFile, db: Session) -> Dict[str, Any]:
+    """Spool the upload to disk and ingest it chunk by chunk.
+
+    The dialect is sniffed once from the head of the file and each chunk is
+    parsed with the C engine, so memory stays bounded by the chunk size.
+    """
+    path, content_hash = await _spool_to_disk(file)
+    try:
+        duplicate = _find_duplicate_upload(db, content_hash)
+        if duplicate is not None:
+            return duplicate
+        print(f"DEBUG: Streaming CSV file: {file.filename} ({os.path.getsize(path)} bytes)")
+        # Parsing and inserting block, so keep them off the event loop
+        result = await run_in_threadpool(
+            ingest_csv_file,
+            db,
+            path,
+            filename=file.filename,
+            content_hash=content_hash,
+            on_progress=_log_progress,
+        )
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid CSV: {exc}") from exc
+    except IntegrityError:
+        # The same file was stored by a concurrent request in the meantime
+        duplicate = _find_duplicate_upload(db, content_hash)
+        if duplicate is None:
+            raise
+        return duplicate
+    finally:
+        os.unlink(path)
+
+    return _streamed_response(result)
+
+
+def _streamed_response(result: CsvIngestResult) -> Dict[str, Any]:
+    metadata = dict(result.metadata)
+    metadata["question_type_counts"] = result.question_type_counts
+    stats = {
+        "rows": result.rows,
+        "columns": result.columns,
+        "questions": result.questions,
+        "duplicates_skipped": result.duplicates,
+        "warnings": result.warnings,
+        "metadata": metadata,
+        "ingest": {
+            "seconds": round(result.seconds, 4),
+            "rows_per_sec": round(result.rows_per_sec, 1),
+            "chunks": result.chunks,
+        },
+    }
+    return {"uploadId": result.upload_id, "stats": stats}
+
+
+async def _run_csv_upload_job(job: JobContext) -> Dict[str, Any]:
+    """Background CSV import: the streaming path, reporting job progress."""
+    path = job.params["path"]
+
+    def run() -> Dict[str, Any]:
+        total_lines = max(count_csv_lines(path) - 1, 1)
+
+        def on_progress(progress: IngestProgress) -> None:
+            if progress.chunk == 1:
+                job.save_checkpoint(upload_id=progress.upload_id)
+            job.progress(
+                f"stored {progress.questions} questions",
+                min(99.0, 100.0 * progress.rows / total_lines),
+            )
+            job.raise_if_cancelled()
+
+        db = SessionLocal()
+        try:
+            stale_upload_id = job.checkpoint.get("upload_id")
+            if stale_upload_id is not None:
+                # Left behind by a run that died mid-import
+                discard_upload(db, stale_upload_id)
+                job.save_checkpoint(upload_id=None)
+            content_hash = job.params.get("content_hash")
+            try:
+                result = ingest_csv_file(
+                    db,
+                    path,
+                    filename=job.params["filename"],
+                    content_hash=content_hash,
+                    on_progress=on_progress,
+                )
+            except IntegrityError:
+                # Another request stored the same file after this job was queued
+                job.save_checkpoint(upload_id=None)
+                duplicate = _find_duplicate_upload(db, content_hash)
+                if duplicate is None:
+                    raise
+                return duplicate
+            except BaseException:
+                # ingest_csv_file already removed its partial upload; forget
+                # the id so a rerun cannot delete a later upload reusing it
+                job.save_checkpoint(upload_id=None)
+                raise
+            return _streamed_response(result)
+        finally:
+            db.close()
+
+    job.progress("parsing", 0.0)
+    return await job.run_in_thread(run)
+
+
+# The spooled file outlives a restart, so the import can simply run again
+job_manager.register(CSV_UPLOAD_JOB, _run_csv_upload_job, resumable=True)
+
+
 # Text upload disabled - focusing on CSV workflow with Gemini integration
 # @router.post("/upload/text")
 # async def upload_text(
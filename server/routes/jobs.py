@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import json
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ..services.jobs import TERMINAL_STATUSES, job_manager
+
+router = APIRouter(tags=["jobs"])
+
+# Seconds between keep-alive comments on an idle event stream
+SSE_HEARTBEAT_SECONDS = 15.0
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int) -> Dict[str, Any]:
+    """Status, stage, percent and (once finished) result of a background job"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: int) -> StreamingResponse:
+    """Server-sent events: one 'job' event per change until the job finishes"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        _job_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _job_events(job_id: int) -> AsyncIterator[str]:
+    last = None
+    while True:
+        # Taken before the read, so a change made while it runs is not missed
+        token = job_manager.change_token()
+        job = await job_manager.get(job_id)
+        if job is None:
+            return
+        if job != last:
+            yield f"event: job\ndata: {json.dumps(job)}\n\n"
+            last = job
+        if job["status"] in TERMINAL_STATUSES:
+            return
+        if not await job_manager.changed(SSE_HEARTBEAT_SECONDS, token):
+            yield ": keep-alive\n\n"
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int) -> JSONResponse:
+    """Cancel a queued or running job; a running one stops at its next step"""
+    status = await job_manager.cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if status in TERMINAL_STATUSES and status != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job already {status}")
+    return JSONResponse(status_code=202, content=await job_manager.get(job_id))
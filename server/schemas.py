@@ -24,11 +24,17 @@ class UploadSummary(BaseModel):
     question_count: int
     themes: List[str] = []
     exam_count: int
+    attempt_count: int = 0
     file_type: str
     class_tags: List[str] = []
     question_type_counts: Optional[Dict[str, int]] = None
 
 
+class UploadPage(BaseModel):
+    items: List[UploadSummary]
+    next_cursor: Optional[str] = None
+
+
 class ConceptOut(BaseModel):
     id: int
     name: str
@@ -107,6 +113,11 @@ class AttemptSummary(BaseModel):
     correct_count: int
 
 
+class AttemptPage(BaseModel):
+    items: List[AttemptSummary]
+    next_cursor: Optional[str] = None
+
+
 class AttemptDetail(BaseModel):
     id: int
     exam_id: int
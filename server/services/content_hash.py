@@ -0,0 +1,48 @@
+"""
+Content hashes used to recognise repeated uploads and questions.
+
+Upload.content_hash is the SHA-256 of the uploaded file's bytes, so sending
+the same CSV again resolves to the existing upload. Question.content_hash
+covers the normalized stem and answer, so a question bank never stores the
+same question twice.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any
+
+
+def file_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def question_hash(stem: str, answer: Any) -> str:
+    """SHA-256 of a question's normalized stem and answer.
+
+    Case, whitespace runs, dict key order and the order of multi-select
+    answers do not matter, so trivially reformatted copies hash the same.
+    """
+    payload = json.dumps(
+        [_normalize_text(stem or ""), _normalize_value(answer)],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _normalize_text(value: str) -> str:
+    return " ".join(value.split()).casefold()
+
+
+def _normalize_value(value: Any) -> Any:
+    if isinstance(value, str):
+        return _normalize_text(value)
+    if isinstance(value, dict):
+        return {key: _normalize_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_normalize_value(item) for item in value]
+        if all(isinstance(item, str) for item in items):
+            return sorted(items)
+        return items
+    return value
@@ -1,13 +1,18 @@
 from __future__ import annotations
 
-from typing import Dict, List, Tuple
+import csv
+from typing import Dict, List, Tuple, Type
 
+import numpy as np
 import pandas as pd
 
 
-def normalize_csv(df: pd.DataFrame) -> Tuple[List[Dict], List[str], Dict]:
+def normalize_csv(df: pd.DataFrame, row_offset: int = 0) -> Tuple[List[Dict], List[str], Dict]:
     """Normalize a CSV into internal question dicts.
 
+    row_offset is the number of question rows before df when the file is
+    read in chunks, so warnings keep whole-file row numbers.
+
     Returns: (questions, warnings, metadata)
     """
     required_cols = {"question", "answer"}
@@ -20,22 +25,14 @@ def normalize_csv(df: pd.DataFrame) -> Tuple[List[Dict], List[str], Dict]:
     metadata = {}
     
     # Look for metadata in the raw CSV content
-    # Check if there are any rows that start with # or contain _metadata
-    metadata_rows = []
-    question_rows = []
-    
-    for idx, row in df.iterrows():
-        # Check if this row contains metadata
-        if any(str(val).startswith('#') for val in row.values if pd.notna(val)):
-            metadata_rows.append(idx)
-        elif any(str(val).startswith('_metadata') for val in row.values if pd.notna(val)):
-            metadata_rows.append(idx)
-        else:
-            question_rows.append(idx)
+    # A row is metadata if any non-null cell starts with # or _metadata
+    metadata_mask = pd.Series(False, index=df.index)
+    for col in df.columns:
+        values = df[col]
+        metadata_mask |= values.notna() & values.astype(str).str.startswith(("#", "_metadata"))
     
-    # Extract metadata from special rows
-    for idx in metadata_rows:
-        row = df.iloc[idx]
+    # Extract metadata from special rows (few, so a plain loop is fine)
+    for _, row in df[metadata_mask].iterrows():
         for col, val in row.items():
             if pd.notna(val):
                 val_str = str(val).strip()
@@ -74,61 +71,173 @@ def normalize_csv(df: pd.DataFrame) -> Tuple[List[Dict], List[str], Dict]:
                                 warnings.append(f"Invalid recommended_count: {value}")
 
     # Filter out metadata rows from question processing
-    if metadata_rows:
-        df = df.drop(metadata_rows).reset_index(drop=True)
+    df = df[~metadata_mask].reset_index(drop=True)
 
     # Normalize columns to lowercase keys
     lower_map = {c: c.lower() for c in df.columns}
     work = df.rename(columns=lower_map)
 
+    stems = _cell_text(work, "question", "").str.strip()
+    qtypes = _cell_text(work, "type", "").str.strip().str.lower()
+    options = _split_cells(_string_cells(work, "options"), "|")
+    # str(answer) of a missing column is "None", matching row.get() semantics
+    answer_text = _cell_text(work, "answer", "None")
+    concepts = _split_cells(_string_cells(work, "concepts"), ",")
+
+    # Validation: Check if any option contains commas (likely a formatting error)
+    exploded = options.explode().dropna()
+    suspicious = exploded[
+        exploded.str.contains(",", regex=False)
+        & qtypes.reindex(exploded.index).isin(("mcq", "multi"))
+    ]
+    for row_idx, opt in suspicious.items():
+        warnings.append(
+            f"Row {row_idx + row_offset + 2}: Option contains comma which may indicate improper CSV formatting: '{opt[:50]}...'. "
+            f"Options should use pipe (|) delimiters only, and the options field should be quoted if it contains commas."
+        )
+
+    has_options = options.notna()
+    qtypes = qtypes.mask(qtypes == "", has_options.map({True: "mcq", False: "short"}))
+
+    # Parse answer
+    # For multi-select, answer should be pipe-separated list
+    # For MCQ, short, cloze: answer is a single value (even if it contains pipes - display as-is)
+    is_multi = qtypes == "multi"
+    multi_answers = _split_cells(answer_text[is_multi], "|")
+    truefalse_answers = answer_text.str.strip().str.lower().isin(("true", "t", "1", "yes"))
+    # For MCQ, short, cloze: keep answer as single string (don't split by pipes)
+    plain_answers = answer_text.str.strip()
+
+    multi_by_row = multi_answers.to_dict()
     results: List[Dict] = []
-    for row_idx, row in work.iterrows():
-        stem = str(row.get("question", "")).strip()
-        qtype = str(row.get("type", "")).strip().lower()
-        options_raw = row.get("options")
-        answer_raw = row.get("answer")
-        concepts_raw = row.get("concepts")
-
-        options_list: List[str] | None = None
-        if isinstance(options_raw, str) and options_raw.strip():
-            options_list = [o.strip() for o in options_raw.split("|") if o.strip()]
-            
-            # Validation: Check if any option contains commas (likely a formatting error)
-            for opt in options_list:
-                if "," in opt and qtype in ("mcq", "multi"):
-                    warnings.append(
-                        f"Row {row_idx + 2}: Option contains comma which may indicate improper CSV formatting: '{opt[:50]}...'. "
-                        f"Options should use pipe (|) delimiters only, and the options field should be quoted if it contains commas."
-                    )
-
-        if not qtype:
-            qtype = "mcq" if options_list else "short"
-
-        # Parse answer
-        # For multi-select, answer should be pipe-separated list
-        # For MCQ, short, cloze: answer is a single value (even if it contains pipes - display as-is)
+    for row_idx, (stem, qtype, options_list, concept_list, truefalse_value, plain_value) in enumerate(
+        zip(
+            stems.tolist(),
+            qtypes.tolist(),
+            options.tolist(),
+            concepts.tolist(),
+            truefalse_answers.tolist(),
+            plain_answers.tolist(),
+        )
+    ):
         if qtype == "multi":
-            answer_value = [a.strip() for a in str(answer_raw).split("|") if a.strip()]
+            answer_value = multi_by_row.get(row_idx)
+            if not isinstance(answer_value, list):
+                answer_value = []
         elif qtype == "truefalse":
-            answer_value = str(answer_raw).strip().lower() in ("true", "t", "1", "yes")
+            answer_value = truefalse_value
         else:
-            # For MCQ, short, cloze: keep answer as single string (don't split by pipes)
-            answer_value = str(answer_raw).strip()
-
-        concepts = []
-        if isinstance(concepts_raw, str) and concepts_raw.strip():
-            concepts = [c.strip() for c in concepts_raw.split(",") if c.strip()]
+            answer_value = plain_value
 
         results.append(
             {
                 "stem": stem,
                 "qtype": qtype,
-                "options": {"list": options_list} if options_list else None,
+                "options": {"list": options_list} if isinstance(options_list, list) else None,
                 "answer": {"value": answer_value},
-                "concepts": concepts,
+                "concepts": concept_list if isinstance(concept_list, list) else [],
             }
         )
 
     return results, warnings, metadata
 
 
+def _cell_text(work: pd.DataFrame, col: str, default: str) -> pd.Series:
+    """str(value) of every cell in a column, like str(row.get(col, default))."""
+    if col not in work.columns:
+        return pd.Series(default, index=work.index, dtype=object)
+    values = work[col]
+    return values.astype(str).where(values.notna(), "nan")
+
+
+def _string_cells(work: pd.DataFrame, col: str) -> pd.Series:
+    """Cells of a column that hold strings; everything else becomes NaN."""
+    if col not in work.columns:
+        return pd.Series(None, index=work.index, dtype=object)
+    values = work[col]
+    if values.dtype != object and not isinstance(values.dtype, pd.StringDtype):
+        # Numeric/bool columns never hold strings
+        return pd.Series(None, index=work.index, dtype=object)
+    # Object columns may mix strings with floats/bools (or hold no strings at
+    # all, where the .str accessor refuses to work), so test each cell
+    return values.where(values.map(lambda value: isinstance(value, str)))
+
+
+def _split_cells(cells: pd.Series, sep: str) -> pd.Series:
+    """Split string cells on sep into lists of stripped, non-empty parts.
+
+    Rows without any parts (non-strings, blanks, only separators) become NaN.
+    """
+    if not cells.notna().any():
+        return pd.Series(None, index=cells.index, dtype=object)
+    parts = cells.str.split(sep, regex=False).explode().str.strip()
+    parts = parts[parts.notna() & (parts != "")]
+    if parts.empty:
+        return pd.Series(None, index=cells.index, dtype=object)
+
+    # explode keeps each row's parts contiguous, so regroup them by slicing
+    # at the boundaries where the row label changes (groupby(list) is far slower)
+    labels = parts.index.to_numpy()
+    values = parts.tolist()
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], len(values)]
+    lists = [values[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+    return pd.Series(lists, index=labels[starts], dtype=object).reindex(cells.index)
+
+
+# Bytes read from the start of a file to guess its dialect
+CSV_SNIFF_BYTES = 64 * 1024
+
+
+def sniff_csv_dialect(path: str, sample_bytes: int = CSV_SNIFF_BYTES) -> Type[csv.Dialect]:
+    """Guess a CSV file's delimiter and quoting from its first bytes.
+
+    Falls back to the standard (excel) dialect when the sample is ambiguous.
+    """
+    with open(path, "rb") as fh:
+        raw = fh.read(sample_bytes)
+    sample = raw.decode("utf-8", errors="ignore")
+    if len(raw) == sample_bytes and "\n" in sample:
+        # Drop the partial last line
+        sample = sample[: sample.rindex("\n") + 1]
+    try:
+        # "|" separates options inside a cell, never fields
+        return csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        return csv.excel
+
+
+def read_csv_chunks(path: str, chunksize: int, dialect: Type[csv.Dialect] | None = None) -> pd.io.parsers.TextFileReader:
+    """Iterate a CSV file as DataFrames of at most chunksize rows.
+
+    Uses the C parser (pyarrow cannot read in chunks) with the sniffed
+    dialect. Every column is read as text so a chunk's type inference cannot
+    differ from its neighbours' (an all-numeric answer chunk would otherwise
+    turn "4" into "4.0").
+    """
+    dialect = dialect or sniff_csv_dialect(path)
+    return pd.read_csv(
+        path,
+        sep=dialect.delimiter,
+        quotechar=dialect.quotechar or '"',
+        doublequote=dialect.doublequote,
+        escapechar=dialect.escapechar,
+        skipinitialspace=True,
+        encoding="utf-8",
+        on_bad_lines="warn",
+        engine="c",
+        dtype=str,
+        chunksize=chunksize,
+    )
+
+
+def count_csv_lines(path: str, block_bytes: int = 1024 * 1024) -> int:
+    """Count newline-terminated lines, for progress estimates.
+
+    Quoted cells may contain newlines, so this is an upper bound on rows.
+    """
+    lines = 0
+    with open(path, "rb") as fh:
+        while block := fh.read(block_bytes):
+            lines += block.count(b"\n")
+    return lines
@@ -0,0 +1,169 @@
+"""
+Size-bounded key/value cache on disk.
+
+Each DiskCache is one SQLite file under EXAM_CACHE_DIR, separate from the
+application database so it can be deleted at any time. Values are bytes.
+When the stored values outgrow max_bytes, expired entries and then the
+least recently read ones are evicted. An entry may be given a time to live
+after which it reads as a miss. Hit/miss/eviction counters cover the life
+of the process.
+
+A cache must never fail the request it is speeding up: storage errors are
+logged and treated as misses.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+CACHE_DIR = os.environ.get("EXAM_CACHE_DIR", "./cache")
+
+# Bump when the table layout changes; older cache files are rebuilt empty
+_SCHEMA_VERSION = 2
+
+
+class DiskCache:
+    def __init__(self, path: str, *, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use, so importing a module that defines a cache
+        # (e.g. in a worker process) touches no files
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS entries")
+                conn.execute(
+                    "CREATE TABLE entries ("
+                    "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                    "size INTEGER NOT NULL, accessed_at REAL NOT NULL, expires_at REAL)"
+                )
+                conn.execute("CREATE INDEX ix_entries_accessed_at ON entries (accessed_at)")
+                conn.execute("CREATE INDEX ix_entries_expires_at ON entries (expires_at)")
+                conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            try:
+                conn = self._connection()
+                now = time.time()
+                row = conn.execute(
+                    "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] is not None and row[1] <= now:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self.expirations += 1
+                    row = None
+                if row is not None:
+                    conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as exc:
+                print(f"Warning: cache {self.path} unavailable: {exc}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """Store value; with ttl it reads as a miss after ttl seconds."""
+        # A value bigger than the whole cache would only evict everything else
+        if not self.enabled or len(value) > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO entries (key, value, size, accessed_at, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, value, len(value), now, expires_at),
+                    )
+                    self._evict(conn)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as exc:
+                print(f"Warning: cache {self.path} unavailable: {exc}")
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        now = time.time()
+        count, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE expires_at <= ?", (now,)
+        ).fetchone()
+        if count:
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            self.expirations += count
+            excess -= size
+            if excess <= 0:
+                return
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Any]:
+        entries, size = 0, 0
+        if self.enabled:
+            with self._lock:
+                try:
+                    entries, size = self._connection().execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+                    ).fetchone()
+                except sqlite3.Error as exc:
+                    print(f"Warning: cache {self.path} unavailable: {exc}")
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
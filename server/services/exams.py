@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import ScalarSelect, Select, func, select
+
+from ..models import Exam, ExamQuestion, Question, question_concepts
+
+
+def exam_questions_query(exam_id: int) -> Select:
+    """Questions of an exam in their original order."""
+    return (
+        select(Question)
+        .join(ExamQuestion, ExamQuestion.question_id == Question.id)
+        .where(ExamQuestion.exam_id == exam_id)
+        .order_by(ExamQuestion.position)
+    )
+
+
+def exam_question_count() -> ScalarSelect:
+    """Correlated COUNT of an exam's questions, for use alongside Exam columns."""
+    return (
+        select(func.count())
+        .where(ExamQuestion.exam_id == Exam.id)
+        .correlate(Exam)
+        .scalar_subquery()
+    )
+
+
+def build_exam_questions(question_ids: List[int]) -> List[ExamQuestion]:
+    """ExamQuestion rows for Exam.exam_questions, preserving order."""
+    return [
+        ExamQuestion(position=position, question_id=question_id)
+        for position, question_id in enumerate(question_ids)
+    ]
+
+
+def exam_concepts_query(exam_id: int) -> Select:
+    """(question_id, concept_id) pairs for every question of an exam."""
+    return (
+        select(question_concepts.c.question_id, question_concepts.c.concept_id)
+        .join(ExamQuestion, ExamQuestion.question_id == question_concepts.c.question_id)
+        .where(ExamQuestion.exam_id == exam_id)
+        .order_by(question_concepts.c.question_id, question_concepts.c.concept_id)
+    )
+
+
+def group_concept_ids(rows: Iterable[Tuple[int, int]]) -> Dict[int, List[int]]:
+    """Group (question_id, concept_id) rows into question_id -> concept ids."""
+    concept_ids: Dict[int, List[int]] = defaultdict(list)
+    for question_id, concept_id in rows:
+        concept_ids[question_id].append(concept_id)
+    return concept_ids
+
+
+def questions_with_concepts(concept_ids: List[int]) -> Select:
+    """Ids of questions tagged with any of the given concepts."""
+    return select(question_concepts.c.question_id).where(
+        question_concepts.c.concept_id.in_(concept_ids)
+    )
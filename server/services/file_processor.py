@@ -1,61 +1,235 @@
 """
 File processing utilities for extracting text from various file formats.
 Supports PDF, DOCX, PPTX, and images.
+
+PyPDF2, python-docx and python-pptx parse in pure Python and hold the GIL,
+so the document extractors run in a process pool: a large PDF no longer
+freezes the event loop, and several files are parsed on several cores at
+once. The extractors themselves are plain module-level functions of a
+spooled file's path (pdf_pages(path) etc.), so they can be pickled to the
+workers and only the path crosses the process boundary.
+
+Extracted text is cached on disk by file SHA-256 (and extractor version),
+so re-uploading the same lecture notes skips parsing altogether.
+
+Documents are read as generators of pages, paragraphs or slides. When the
+caller only has room for so much text (the prompt budget), parsing stops
+there instead of running through hundreds of pages that would be cut.
+
+Uploads are first spooled to disk (spool_uploads) in fixed-size reads,
+under per-file and per-request size limits. Parsers then open the files
+themselves, so no request holds whole uploads in memory and only paths
+are sent to the worker processes.
 """
-import io
-from typing import List
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
 from fastapi import UploadFile
 import PyPDF2
 from docx import Document
 from pptx import Presentation
 from PIL import Image
 
+from .disk_cache import CACHE_DIR, DiskCache
 
-async def extract_text_from_pdf(file: UploadFile) -> str:
-    """Extract text content from a PDF file."""
+
+# Worker processes for document extraction; 0 runs extractors in a thread instead
+EXTRACT_WORKERS = int(os.environ.get("EXAM_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Files of one request extracted at the same time
+EXTRACT_CONCURRENCY = int(os.environ.get("EXAM_EXTRACT_CONCURRENCY", str(max(EXTRACT_WORKERS, 1))))
+# Seconds one file may take before it is reported as failed
+EXTRACT_TIMEOUT_SECONDS = float(os.environ.get("EXAM_EXTRACT_TIMEOUT", "120"))
+
+# Largest single study file, and largest total per request
+MAX_UPLOAD_BYTES = int(os.environ.get("EXAM_MAX_UPLOAD_MB", "100")) * 1024 * 1024
+MAX_REQUEST_BYTES = int(os.environ.get("EXAM_MAX_REQUEST_MB", "512")) * 1024 * 1024
+# Bytes copied per read when spooling an upload to disk
+SPOOL_CHUNK_BYTES = 1024 * 1024
+# Parsed by the extractors (the rest is read inline)
+DOCUMENT_SUFFIXES = ('.pdf', '.docx', '.doc', '.pptx', '.ppt')
+
+# Bump whenever an extractor's output changes, so cached text is not reused
+EXTRACTOR_VERSION = 2
+EXTRACTION_CACHE_MB = int(os.environ.get("EXAM_EXTRACTION_CACHE_MB", "256"))
+
+extraction_cache = DiskCache(
+    os.path.join(CACHE_DIR, "extraction.sqlite3"), max_bytes=EXTRACTION_CACHE_MB * 1024 * 1024
+)
+
+T = TypeVar("T")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class UploadTooLarge(ValueError):
+    """An upload exceeds MAX_UPLOAD_BYTES, or a request MAX_REQUEST_BYTES."""
+
+
+@dataclass
+class SpooledFile:
+    """An uploaded file copied to disk, which is where parsers read it."""
+
+    filename: str
+    path: str
+    size: int
+    sha256: str
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):g} MB"
+
+
+def _temp_spool_path(suffix: str = "") -> str:
+    fd, path = tempfile.mkstemp(prefix="study-", suffix=suffix)
+    os.close(fd)
+    return path
+
+
+async def spool_uploads(
+    files: List[UploadFile],
+    *,
+    make_path: Callable[[str], str] = _temp_spool_path,
+    max_file_bytes: Optional[int] = None,
+    max_request_bytes: Optional[int] = None,
+) -> List[SpooledFile]:
+    """Copy uploads to disk in fixed-size reads, hashing them on the way.
+
+    make_path(suffix) picks each destination (default: a temp file). If a
+    limit is crossed, UploadTooLarge is raised and everything written so
+    far is removed. Call remove_spooled() once the files are done with.
+    """
+    max_file_bytes = MAX_UPLOAD_BYTES if max_file_bytes is None else max_file_bytes
+    max_request_bytes = MAX_REQUEST_BYTES if max_request_bytes is None else max_request_bytes
+    spooled: List[SpooledFile] = []
+    total = 0
     try:
-        content = await file.read()
-        pdf_file = io.BytesIO(content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        text_parts = []
-        for page in pdf_reader.pages:
-            text = page.extract_text()
-            if text:
-                text_parts.append(text)
-        
-        await file.seek(0)  # Reset file pointer
-        return "\n\n".join(text_parts)
+        for file in files:
+            if (file.size or 0) > max_file_bytes:
+                raise UploadTooLarge(f"{file.filename} is larger than {_megabytes(max_file_bytes)}")
+            spool = SpooledFile(file.filename, make_path(os.path.splitext(file.filename or "")[1]), 0, "")
+            spooled.append(spool)
+            digest = hashlib.sha256()
+            with open(spool.path, "wb") as out:
+                while chunk := await file.read(SPOOL_CHUNK_BYTES):
+                    spool.size += len(chunk)
+                    total += len(chunk)
+                    if spool.size > max_file_bytes:
+                        raise UploadTooLarge(f"{file.filename} is larger than {_megabytes(max_file_bytes)}")
+                    if total > max_request_bytes:
+                        raise UploadTooLarge(f"Files are larger than {_megabytes(max_request_bytes)} in total")
+                    out.write(chunk)
+                    digest.update(chunk)
+            spool.sha256 = digest.hexdigest()
+    except BaseException:
+        remove_spooled(spooled)
+        raise
+    return spooled
+
+
+def remove_spooled(files: List[SpooledFile]) -> None:
+    for file in files:
+        try:
+            os.unlink(file.path)
+        except FileNotFoundError:
+            pass
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn rather than fork: the server process has threads (SQLite,
+        # the thread pool) that a forked child would inherit mid-flight
+        _pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown_extraction_pool() -> None:
+    """Stop the worker processes (called on app shutdown)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _run_extractor(extractor: Callable[..., T], *args: Any) -> T:
+    """Run a document extractor on the pool, bounded by EXTRACT_TIMEOUT_SECONDS.
+
+    A worker cannot be interrupted mid-parse, so on a timeout the pool's
+    workers are terminated and a new pool started for the next file;
+    otherwise a few pathological files would keep every worker busy.
+    Extractions running alongside on the old pool fail with it. A worker
+    that dies takes the pool with it too, so it is rebuilt the same way.
+    """
+    global _pool
+    loop = asyncio.get_running_loop()
+    pool = None
+    if EXTRACT_WORKERS <= 0:
+        work = asyncio.to_thread(extractor, *args)
+    else:
+        pool = _get_pool()
+        work = loop.run_in_executor(pool, extractor, *args)
+    try:
+        return await asyncio.wait_for(work, timeout=EXTRACT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        if pool is not None:
+            _terminate_pool(pool)
+        raise ValueError(f"Extraction timed out after {EXTRACT_TIMEOUT_SECONDS:g}s")
+    except BrokenProcessPool:
+        if _pool is pool:
+            _pool = None
+        raise ValueError("Extraction worker crashed")
+
+
+def _terminate_pool(pool: ProcessPoolExecutor) -> None:
+    """Kill pool's workers (stuck in a parse) and stop handing it work."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    if hasattr(pool, "terminate_workers"):  # Python 3.14+
+        pool.terminate_workers()
+        return
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def pdf_pages(path: str) -> Iterator[str]:
+    """Text of each PDF page, parsed only as far as it is consumed."""
+    try:
+        # Hand PyPDF2 an open file: given a path it reads the whole file into memory
+        with open(path, "rb") as pdf_file:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            for page in pdf_reader.pages:
+                text = page.extract_text()
+                if text:
+                    yield text
     except Exception as e:
         raise ValueError(f"Failed to extract text from PDF: {str(e)}")
 
 
-async def extract_text_from_docx(file: UploadFile) -> str:
-    """Extract text content from a Word document."""
+def docx_paragraphs(path: str) -> Iterator[str]:
+    """Non-blank paragraphs of a Word document."""
     try:
-        content = await file.read()
-        doc_file = io.BytesIO(content)
-        doc = Document(doc_file)
-        
-        text_parts = []
+        doc = Document(path)
         for paragraph in doc.paragraphs:
             if paragraph.text.strip():
-                text_parts.append(paragraph.text)
-        
-        await file.seek(0)  # Reset file pointer
-        return "\n\n".join(text_parts)
+                yield paragraph.text
     except Exception as e:
         raise ValueError(f"Failed to extract text from DOCX: {str(e)}")
 
 
-async def extract_text_from_pptx(file: UploadFile) -> str:
-    """Extract text content from a PowerPoint presentation."""
+def pptx_slides(path: str) -> Iterator[str]:
+    """Text of each PowerPoint slide that has any, prefixed with its number."""
     try:
-        content = await file.read()
-        ppt_file = io.BytesIO(content)
-        presentation = Presentation(ppt_file)
-        
-        text_parts = []
+        presentation = Presentation(path)
         for slide_num, slide in enumerate(presentation.slides, 1):
             slide_text = []
             for shape in slide.shapes:
@@ -63,69 +237,219 @@ async def extract_text_from_pptx(file: UploadFile) -> str:
                     slide_text.append(shape.text)
             
             if slide_text:
-                text_parts.append(f"Slide {slide_num}:\n" + "\n".join(slide_text))
-        
-        await file.seek(0)  # Reset file pointer
-        return "\n\n".join(text_parts)
+                yield f"Slide {slide_num}:\n" + "\n".join(slide_text)
     except Exception as e:
         raise ValueError(f"Failed to extract text from PPTX: {str(e)}")
 
 
-async def extract_text_from_image(file: UploadFile) -> str:
+def extract_prefix(
+    units: Callable[[str], Iterator[str]], path: str, max_chars: Optional[int] = None
+) -> Tuple[str, bool]:
+    """Join a document's text units until max_chars is reached.
+
+    Returns the text and whether it is the whole document. Parsing stops
+    with the unit that crosses max_chars, so the text may run a little over.
+    """
+    parts: List[str] = []
+    size = 0
+    for unit in units(path):
+        parts.append(unit)
+        size += len(unit) + 2
+        if max_chars is not None and size >= max_chars:
+            return "\n\n".join(parts), False
+    return "\n\n".join(parts), True
+
+
+def pdf_text(path: str) -> str:
+    return "\n\n".join(pdf_pages(path))
+
+
+def docx_text(path: str) -> str:
+    return "\n\n".join(docx_paragraphs(path))
+
+
+def pptx_text(path: str) -> str:
+    return "\n\n".join(pptx_slides(path))
+
+
+def plain_text(path: str, max_chars: Optional[int] = None) -> Tuple[str, bool]:
+    """A text file decoded as UTF-8, reading at most max_chars bytes of it."""
+    with open(path, "rb") as text_file:
+        data = text_file.read(-1 if max_chars is None else max_chars + 1)
+    complete = max_chars is None or len(data) <= max_chars
+    return data[:max_chars].decode('utf-8', errors='ignore'), complete
+
+
+def _cache_lookup(key: str) -> Optional[Tuple[str, bool]]:
+    cached = extraction_cache.get(key)
+    if cached is None:
+        return None
+    # One flag byte: "1" for a whole document, "0" for a prefix of one
+    return cached[1:].decode("utf-8"), cached[:1] == b"1"
+
+
+async def _extract_cached(
+    units: Callable[[str], Iterator[str]], file: SpooledFile, max_chars: Optional[int] = None
+) -> Tuple[str, bool]:
+    """extract_prefix on the pool, skipped when the cache already covers it.
+
+    Prefixes are cached too, and a later request that needs more of the
+    document re-parses it and replaces the entry with the longer prefix.
+    """
+    if not extraction_cache.enabled:
+        return await _run_extractor(extract_prefix, units, file.path, max_chars)
+    key = f"{units.__name__}:{EXTRACTOR_VERSION}:{file.sha256}"
+    cached = await asyncio.to_thread(_cache_lookup, key)
+    if cached is not None:
+        text, complete = cached
+        if complete or (max_chars is not None and len(text) >= max_chars):
+            return cached
+    text, complete = await _run_extractor(extract_prefix, units, file.path, max_chars)
+    value = (b"1" if complete else b"0") + text.encode("utf-8")
+    await asyncio.to_thread(extraction_cache.set, key, value)
+    return text, complete
+
+
+async def extract_text_from_pdf(file: SpooledFile) -> str:
+    """Extract text content from a PDF file."""
+    text, _ = await _extract_cached(pdf_pages, file)
+    return text
+
+
+async def extract_text_from_docx(file: SpooledFile) -> str:
+    """Extract text content from a Word document."""
+    text, _ = await _extract_cached(docx_paragraphs, file)
+    return text
+
+
+async def extract_text_from_pptx(file: SpooledFile) -> str:
+    """Extract text content from a PowerPoint presentation."""
+    text, _ = await _extract_cached(pptx_slides, file)
+    return text
+
+
+async def extract_text_from_image(file: SpooledFile) -> str:
     """
     Extract text from an image file.
     Note: This returns the image data for Gemini to process with OCR.
     Actual OCR is handled by Gemini API.
     """
     try:
-        content = await file.read()
-        # Verify it's a valid image
-        image = Image.open(io.BytesIO(content))
-        
-        await file.seek(0)  # Reset file pointer
-        return f"[Image file: {file.filename}, Size: {image.size}, Format: {image.format}]"
+        # Verify it's a valid image (only the header is read, so this stays inline)
+        with Image.open(file.path) as image:
+            return f"[Image file: {file.filename}, Size: {image.size}, Format: {image.format}]"
     except Exception as e:
         raise ValueError(f"Failed to process image: {str(e)}")
 
 
-async def process_multiple_files(files: List[UploadFile]) -> str:
-    """
-    Process multiple files and combine their content.
-    Automatically detects file type and uses appropriate extraction method.
-    """
-    combined_content = []
+class Section(NamedTuple):
+    """One file's part of the combined content."""
+
+    header: str
+    text: str
+    complete: bool  # False when text stops short of the end of the file
+
+    def render(self, max_chars: Optional[int] = None) -> str:
+        return f"{self.header}\n{self.text[:max_chars]}"
+
+
+def _content_header(file: SpooledFile) -> str:
+    return f"=== Content from {file.filename} ==="
+
+
+def _error_header(file: SpooledFile) -> str:
+    return f"=== Error processing {file.filename} ==="
+
+
+async def process_file(file: SpooledFile, max_chars: Optional[int] = None) -> Section:
+    """Extract one file's section, reading no further than max_chars if given."""
+    filename = file.filename.lower()
     
-    for file in files:
-        filename = file.filename.lower()
+    try:
+        if filename.endswith('.pdf'):
+            text, complete = await _extract_cached(pdf_pages, file, max_chars)
+            return Section(_content_header(file), text, complete)
         
-        try:
-            if filename.endswith('.pdf'):
-                text = await extract_text_from_pdf(file)
-                combined_content.append(f"=== Content from {file.filename} ===\n{text}")
-            
-            elif filename.endswith(('.docx', '.doc')):
-                text = await extract_text_from_docx(file)
-                combined_content.append(f"=== Content from {file.filename} ===\n{text}")
-            
-            elif filename.endswith(('.pptx', '.ppt')):
-                text = await extract_text_from_pptx(file)
-                combined_content.append(f"=== Content from {file.filename} ===\n{text}")
-            
-            elif filename.endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                text = await extract_text_from_image(file)
-                combined_content.append(f"=== Image: {file.filename} ===\n{text}")
-            
-            else:
-                # Try to read as plain text
-                content = await file.read()
-                text = content.decode('utf-8', errors='ignore')
-                combined_content.append(f"=== Content from {file.filename} ===\n{text}")
-                await file.seek(0)
+        elif filename.endswith(('.docx', '.doc')):
+            text, complete = await _extract_cached(docx_paragraphs, file, max_chars)
+            return Section(_content_header(file), text, complete)
+        
+        elif filename.endswith(('.pptx', '.ppt')):
+            text, complete = await _extract_cached(pptx_slides, file, max_chars)
+            return Section(_content_header(file), text, complete)
         
-        except Exception as e:
-            combined_content.append(f"=== Error processing {file.filename} ===\n{str(e)}")
+        elif filename.endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+            text = await extract_text_from_image(file)
+            return Section(f"=== Image: {file.filename} ===", text, True)
+        
+        else:
+            # Try to read as plain text
+            text, complete = await asyncio.to_thread(plain_text, file.path, max_chars)
+            return Section(_content_header(file), text, complete)
+    
+    except Exception as e:
+        return Section(_error_header(file), str(e), True)
+
+
+async def process_multiple_files(files: List[SpooledFile], budget: Optional[int] = None) -> str:
+    """
+    Process multiple files and combine their content.
+    Automatically detects file type and uses appropriate extraction method.
+    Up to EXTRACT_CONCURRENCY files are extracted at once; sections keep the
+    order of files.
     
-    return "\n\n".join(combined_content)
+    With a budget (in characters), each file gets an equal share and
+    documents are only parsed as far as their share reaches. Whatever the
+    short files leave unused is split among the files that were cut off,
+    so one long file cannot crowd out the rest.
+    """
+    limit = asyncio.Semaphore(EXTRACT_CONCURRENCY)
+
+    async def bounded(file: SpooledFile, max_chars: Optional[int]) -> Section:
+        async with limit:
+            return await process_file(file, max_chars)
+
+    if budget is None or not files:
+        sections = await asyncio.gather(*(bounded(file, None) for file in files))
+        return "\n\n".join(section.render() for section in sections)
+
+    # Headers and separators come out of the budget first (reckoned with
+    # the longest header a section can get)
+    overhead = sum(len(_error_header(file)) + 3 for file in files)
+    body_budget = max(budget - overhead, 0)
+    shares = [body_budget // len(files)] * len(files)
+    sections: List[Section] = [None] * len(files)  # type: ignore[list-item]
+
+    async def extract(indexes: List[int]) -> None:
+        results = await asyncio.gather(*(bounded(files[i], shares[i]) for i in indexes))
+        for i, section in zip(indexes, results):
+            sections[i] = section
+
+    # Images, text files and failures cost next to nothing, so they go
+    # first and the documents split whatever they leave: a document is
+    # then usually parsed once, with its final share
+    documents = [i for i, file in enumerate(files) if file.filename.lower().endswith(DOCUMENT_SUFFIXES)]
+    others = [i for i in range(len(files)) if i not in documents]
+    await extract(others)
+    if documents:
+        left = body_budget - sum(min(len(sections[i].text), shares[i]) for i in others)
+        for i in documents:
+            shares[i] = left // len(documents)
+        await extract(documents)
+
+    unused = body_budget - sum(min(len(section.text), share) for section, share in zip(sections, shares))
+    # A cached whole document can be complete and still longer than its share
+    cut_off = [
+        i for i, (section, share) in enumerate(zip(sections, shares))
+        if not section.complete or len(section.text) > share
+    ]
+    if unused > 0 and cut_off:
+        extra = unused // len(cut_off)
+        for i in cut_off:
+            shares[i] += extra
+        await extract(cut_off)
+
+    return "\n\n".join(section.render(share) for section, share in zip(sections, shares))
 
 
 def get_supported_file_types() -> List[str]:
@@ -1,13 +1,80 @@
 """
 Gemini API integration service for AI-powered exam generation.
-Handles API configuration, prompt building, and response parsing.
+Handles API clients, prompt building, and response parsing.
+
+Every call is made with a client bound to the caller's API key, never the
+SDK's process-wide genai.configure() state, so requests with different
+keys can run concurrently. Generation uses the SDK's async API and does
+not block the event loop; gemini_scheduler paces the calls to each key's
+quota and retries the ones Gemini rejects as rate limited.
 """
+import asyncio
+import hashlib
 import json
+import os
+import random
 import re
-from typing import Dict, List, Optional, Any
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Any, Set, Tuple, Union
 from pydantic import BaseModel
+import google.ai.generativelanguage as glm
 import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
+from google.api_core.client_options import ClientOptions
+
+from . import passages
+from .disk_cache import CACHE_DIR, DiskCache
+
+
+# Seconds a key's model listing is reused, and a failed listing remembered
+MODEL_CACHE_TTL_SECONDS = float(os.environ.get("EXAM_MODEL_CACHE_TTL", "3600"))
+MODEL_CACHE_ERROR_TTL_SECONDS = float(os.environ.get("EXAM_MODEL_CACHE_ERROR_TTL", "60"))
+# API keys whose generation clients (and connections) are kept open
+GEMINI_CLIENT_CACHE_SIZE = int(os.environ.get("EXAM_GEMINI_CLIENTS", "32"))
+# Seconds an evicted client may finish its in-flight calls before closing
+GEMINI_CLIENT_CLOSE_GRACE_SECONDS = 120
+
+# Characters of extracted study material that go into one prompt; files are
+# only extracted as far as their share of this budget
+PROMPT_CONTENT_BUDGET = 15000
+# Rough characters per Gemini token, for sizing prompts without a round trip
+CHARS_PER_TOKEN = 4
+# Study material tokens per map-reduce chunk (one prompt's worth)
+CHUNK_TOKEN_BUDGET = PROMPT_CONTENT_BUDGET // CHARS_PER_TOKEN
+# Prompts' worth of material one map-reduce exam may extract
+MAP_REDUCE_MAX_CHUNKS = int(os.environ.get("EXAM_MAP_REDUCE_MAX_CHUNKS", "8"))
+# Prompts' worth of material searched for the passages about an exam's
+# focus concepts (the best of it is packed into one prompt's budget)
+FOCUS_SEARCH_PROMPTS = int(os.environ.get("EXAM_FOCUS_SEARCH_PROMPTS", "8"))
+# Word-set Jaccard similarity at which two generated questions count as one
+NEAR_DUPLICATE_SIMILARITY = 0.8
+# Most questions asked of one call; larger exams are split into shards that
+# run concurrently, so no response gets near max_output_tokens
+SHARD_MAX_QUESTIONS = int(os.environ.get("EXAM_SHARD_QUESTIONS", "15"))
+# Extra attempts for a shard whose call or response fails
+SHARD_RETRIES = 2
+# Parsed exams kept for repeated identical requests (0 disables), and for how long
+GENERATION_CACHE_MB = int(os.environ.get("EXAM_GENERATION_CACHE_MB", "64"))
+GENERATION_CACHE_TTL_SECONDS = float(os.environ.get("EXAM_GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+# Bump when GeneratedExam or response parsing changes, so older entries miss
+GENERATION_CACHE_VERSION = 1
+# Per-key quota generation calls are paced to, requests and prompt tokens
+# per minute (0 disables a limit); the defaults are gemini-2.5-flash's free tier
+GEMINI_RPM = float(os.environ.get("EXAM_GEMINI_RPM", "10"))
+GEMINI_TPM = float(os.environ.get("EXAM_GEMINI_TPM", "250000"))
+# Generation calls in flight at once, across all keys
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("EXAM_GEMINI_CONCURRENCY", "8"))
+# Retries of a call Gemini turned away as rate limited (429) or unavailable
+# (503), backing off exponentially (with jitter) unless it says how long
+GEMINI_RETRIES = int(os.environ.get("EXAM_GEMINI_RETRIES", "5"))
+GEMINI_BACKOFF_SECONDS = 2.0
+GEMINI_BACKOFF_MAX_SECONDS = 60.0
+# Recent queue waits the scheduler's percentiles are computed over
+SCHEDULER_WAIT_SAMPLES = 1000
 
 
 class ExamConfig(BaseModel):
@@ -16,6 +83,12 @@ class ExamConfig(BaseModel):
     difficulty: str
     question_types: List[str]
     focus_concepts: Optional[List[str]] = None
+    # Exact questions per type, when a shard's types are not evenly split
+    type_counts: Optional[Dict[str, int]] = None
+    # (index, count) when this config is one shard of a larger exam
+    shard: Optional[Tuple[int, int]] = None
+    # Questions already generated, which this request must not repeat
+    avoid_questions: Optional[List[str]] = None
 
 
 class QuestionData(BaseModel):
@@ -55,6 +128,7 @@ Requirements:
 - Difficulty level: {difficulty}
 - Question types to include: {question_types}
 {focus_concepts_section}
+{shard_section}
 
 QUESTION TYPE DEFINITIONS:
 - mcq: Multiple choice with exactly ONE correct answer (provide 4 options)
@@ -120,16 +194,332 @@ QUALITY CHECKLIST:
 """
 
 
-def configure_gemini(api_key: str) -> None:
-    """Configure Gemini API with user's API key."""
-    try:
-        genai.configure(api_key=api_key)
-    except Exception as e:
-        raise ValueError(f"Failed to configure Gemini API: {str(e)}")
+generation_cache = DiskCache(
+    os.path.join(CACHE_DIR, "generation.sqlite3"), max_bytes=GENERATION_CACHE_MB * 1024 * 1024
+)
+
+
+def _key_fingerprint(api_key: str) -> str:
+    # What the caches below are keyed by; raw keys are never stored
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class GeminiClients:
+    """Async generation clients, one per API key, reused across requests.
+
+    Each client owns a gRPC channel, so repeated generations with a key
+    reuse its connection. The least recently used client is closed once
+    more than max_clients keys are held. A client belongs to the event
+    loop that created it, and is replaced (and closed) if its key is used
+    from another loop.
+    """
+
+    def __init__(self, max_clients: int) -> None:
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[str, Tuple[asyncio.AbstractEventLoop, glm.GenerativeServiceAsyncClient]]" = OrderedDict()
+        self._closing: Set[asyncio.Future] = set()
+
+    def get(self, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        loop = asyncio.get_running_loop()
+        fingerprint = _key_fingerprint(api_key)
+        entry = self._clients.pop(fingerprint, None)
+        if entry is None or entry[0] is not loop:
+            if entry is not None:
+                self._close_later(*entry)
+            client = glm.GenerativeServiceAsyncClient(client_options=ClientOptions(api_key=api_key))
+            entry = (loop, client)
+        self._clients[fingerprint] = entry
+        while len(self._clients) > max(self.max_clients, 1):
+            _, old_entry = self._clients.popitem(last=False)
+            self._close_later(*old_entry)
+        return entry[1]
+
+    def _close_later(self, loop: asyncio.AbstractEventLoop, client: glm.GenerativeServiceAsyncClient) -> None:
+        """Close client's channel on its own loop once in-flight calls finish
+        (or GEMINI_CLIENT_CLOSE_GRACE_SECONDS pass)."""
+        if loop.is_closed():
+            # Its channel went down with the loop; nothing is left to close
+            return
+        close = client.transport.grpc_channel.close(grace=GEMINI_CLIENT_CLOSE_GRACE_SECONDS)
+        if loop is asyncio.get_running_loop():
+            future: asyncio.Future = loop.create_task(close)
+        else:
+            future = asyncio.wrap_future(asyncio.run_coroutine_threadsafe(close, loop))
+        self._closing.add(future)
+        future.add_done_callback(self._closing.discard)
+
+    async def close(self) -> None:
+        """Close the clients created on the running loop (at shutdown)."""
+        loop = asyncio.get_running_loop()
+        clients, self._clients = self._clients, OrderedDict()
+        for client_loop, client in clients.values():
+            if client_loop is loop:
+                await client.transport.close()
+
+
+gemini_clients = GeminiClients(GEMINI_CLIENT_CACHE_SIZE)
+
+
+class TokenBucket:
+    """per_minute units, refilled continuously; 0 means unlimited.
+
+    reserve() takes its units at once, even into debt, and returns how
+    long the caller must wait for the debt to be repaid. Each reservation
+    waits behind every earlier one, so a key's calls go out in order.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        # A call larger than the whole bucket waits for a full one
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level * 60 / self.capacity)
+
+    def refund(self, amount: float, now: float) -> None:
+        """Give back units reserved but not used (negative to charge more)."""
+        if self.capacity > 0:
+            self._refill(now)
+            self.level = min(self.capacity, self.level + amount)
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.level >= self.capacity
+
+
+class _KeyQuota:
+    def __init__(self, rpm: float, tpm: float) -> None:
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        # Set after a 429/503: no call with this key starts before then
+        self.paused_until = 0.0
+        self.pending = 0
+
+
+class _FairSlots:
+    """A semaphore whose waiters are served round-robin by key, so one
+    key's large exam cannot hold back every other key's requests."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(limit, 1)
+        self.in_use = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self._turns: Deque[str] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for queue in self._waiters.values() for waiter in queue if not waiter.done())
+
+    async def acquire(self, key: str) -> None:
+        if self.in_use < self.limit and not self._turns:
+            self.in_use += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        if key not in self._waiters:
+            self._waiters[key] = deque()
+            self._turns.append(key)
+        self._waiters[key].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Granted just as we were cancelled: pass the slot on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_use -= 1
+        while self.in_use < self.limit and self._turns:
+            key = self._turns.popleft()
+            queue = self._waiters[key]
+            waiter = queue.popleft()
+            if queue:
+                self._turns.append(key)
+            else:
+                del self._waiters[key]
+            if not waiter.done():
+                waiter.set_result(None)
+                self.in_use += 1
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """Seconds Gemini asked us to wait in a rejected call's error, if any."""
+    for detail in getattr(e, "details", None) or []:
+        # google.rpc.RetryInfo, sent with gRPC quota errors
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + delay.nanos / 1e9
+    response = getattr(e, "response", None)
+    header = response.headers.get("Retry-After") if response is not None and hasattr(response, "headers") else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    # The quota message itself reads "... Please retry in 12.3s."
+    match = re.search(r"retry in ([\d.]+)\s*s", str(e))
+    return float(match.group(1)) if match else None
+
+
+class GeminiScheduler:
+    """
+    Paces generation calls so concurrent users share quota without failing.
+
+    Each API key has token buckets for requests and prompt tokens per
+    minute; a call waits (in arrival order) until its key has quota. Calls
+    then take one of max_concurrency slots, handed out round-robin across
+    keys. A call Gemini turns away with 429 or 503 pauses its key for the
+    Retry-After it was given, or an exponential backoff with full jitter,
+    and is queued again, up to GEMINI_RETRIES times.
+
+    Scheduler state belongs to the event loop that serves requests.
+    """
+
+    def __init__(self, rpm: float, tpm: float, max_concurrency: int) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self._quotas: Dict[str, _KeyQuota] = {}
+        self._slots = _FairSlots(max_concurrency)
+        self._waits: Deque[float] = deque(maxlen=SCHEDULER_WAIT_SAMPLES)
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.wait_seconds = 0.0
+
+    def _quota(self, fingerprint: str) -> _KeyQuota:
+        quota = self._quotas.get(fingerprint)
+        if quota is None:
+            # Forget idle keys whose buckets have refilled
+            now = time.monotonic()
+            for idle in [
+                f for f, q in self._quotas.items()
+                if not q.pending and q.paused_until <= now and q.requests.full(now) and q.tokens.full(now)
+            ]:
+                del self._quotas[idle]
+            quota = self._quotas[fingerprint] = _KeyQuota(self.rpm, self.tpm)
+        return quota
+
+    @asynccontextmanager
+    async def slot(self, api_key: str, tokens: float) -> AsyncIterator[None]:
+        """Wait for api_key's quota and a free slot, and hold the slot."""
+        fingerprint = _key_fingerprint(api_key)
+        quota = self._quota(fingerprint)
+        started = time.monotonic()
+        quota.pending += 1
+        try:
+            delay = max(
+                quota.requests.reserve(1, started),
+                quota.tokens.reserve(tokens, started),
+                quota.paused_until - started,
+            )
+            try:
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    # Another call may have been rate limited meanwhile
+                    delay = quota.paused_until - time.monotonic()
+                await self._slots.acquire(fingerprint)
+            except asyncio.CancelledError:
+                now = time.monotonic()
+                quota.requests.refund(1, now)
+                quota.tokens.refund(tokens, now)
+                raise
+        finally:
+            quota.pending -= 1
+        waited = time.monotonic() - started
+        self._waits.append(waited)
+        self.wait_seconds += waited
+        self.calls += 1
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def settle(self, api_key: str, estimated: float, usage: Any) -> None:
+        """Charge api_key's token bucket for what a call really used.
+
+        usage is the response's usage_metadata; without it the estimate stands.
+        """
+        used = getattr(usage, "prompt_token_count", None)
+        quota = self._quotas.get(_key_fingerprint(api_key))
+        if used and quota is not None:
+            quota.tokens.refund(estimated - used, time.monotonic())
+
+    def retry_delay(self, api_key: str, e: Exception, attempt: int) -> Optional[float]:
+        """Seconds until a call that failed with e may be retried, or None
+        if it should not be. Pauses every call with api_key until then."""
+        if not isinstance(e, (google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable)):
+            return None
+        if isinstance(e, google_exceptions.TooManyRequests):
+            self.rate_limited += 1
+        if attempt >= GEMINI_RETRIES:
+            return None
+        delay = _retry_after(e)
+        if delay is None:
+            delay = random.uniform(0, min(GEMINI_BACKOFF_MAX_SECONDS, GEMINI_BACKOFF_SECONDS * 2 ** attempt))
+        self.retries += 1
+        quota = self._quota(_key_fingerprint(api_key))
+        quota.paused_until = max(quota.paused_until, time.monotonic() + delay)
+        print(f"Warning: Gemini call rejected ({e.code}), retrying in {delay:.1f}s (attempt {attempt + 1})")
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "keys": len(self._quotas),
+            "queued": sum(quota.pending for quota in self._quotas.values()),
+            "waiting_for_slot": self._slots.waiting,
+            "in_flight": self._slots.in_use,
+            "max_concurrency": self._slots.limit,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "calls": self.calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "wait_seconds_mean": round(self.wait_seconds / self.calls, 3) if self.calls else None,
+            "wait_seconds_p95": round(waits[int(len(waits) * 0.95)], 3) if waits else None,
+            "wait_seconds_max": round(waits[-1], 3) if waits else None,
+        }
+
+
+gemini_scheduler = GeminiScheduler(GEMINI_RPM, GEMINI_TPM, GEMINI_MAX_CONCURRENCY)
+
+
+def generative_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """A GenerativeModel that calls Gemini with api_key; use its *_async methods."""
+    model = genai.GenerativeModel(model_name)
+    # GenerativeModel takes no client argument and would otherwise use the
+    # process-wide client built from genai.configure()
+    if "_async_client" not in vars(model):
+        # A private attribute, checked against the pinned SDK version
+        # (server/requirements.txt); fail loudly rather than fall back to
+        # the global client if an SDK upgrade renames it
+        raise RuntimeError(
+            f"google-generativeai {genai.__version__} has no GenerativeModel._async_client; "
+            "per-key Gemini clients need the version pinned in requirements.txt"
+        )
+    model._async_client = gemini_clients.get(api_key)
+    return model
 
 
 def build_exam_prompt(content: str, config: ExamConfig) -> str:
-    """Build the prompt for Gemini based on content and configuration."""
+    """Build the prompt for Gemini based on content and configuration.
+
+    content must already fit one prompt: extraction stops at
+    PROMPT_CONTENT_BUDGET, and split_content and select_content size
+    their output to CHUNK_TOKEN_BUDGET.
+    """
     
     # Build focus concepts section if provided
     focus_concepts_section = ""
@@ -138,14 +528,29 @@ def build_exam_prompt(content: str, config: ExamConfig) -> str:
         focus_concepts_section = f"- Focus on these concepts: {concepts_list}"
     
     # Format question types for display
-    question_types_str = ", ".join(config.question_types)
+    if config.type_counts:
+        question_types_str = ", ".join(f"{qtype} ({n})" for qtype, n in config.type_counts.items())
+    else:
+        question_types_str = ", ".join(config.question_types)
+
+    shard_section = ""
+    if config.shard:
+        index, count = config.shard
+        shard_section = (
+            f"- This is part {index + 1} of {count} of a larger exam: draw mainly on part "
+            f"{index + 1} of {count} of the study material (in reading order) so parts do not overlap"
+        )
+    if config.avoid_questions:
+        avoided = "\n".join(f"  * {question}" for question in config.avoid_questions)
+        shard_section += f"\n- These questions already exist; do not repeat them:\n{avoided}"
     
     prompt = EXAM_GENERATION_PROMPT.format(
-        content=content[:15000],  # Limit content to avoid token limits
+        content=content,
         question_count=config.question_count,
         difficulty=config.difficulty,
         question_types=question_types_str,
-        focus_concepts_section=focus_concepts_section
+        focus_concepts_section=focus_concepts_section,
+        shard_section=shard_section
     )
     
     return prompt
@@ -168,6 +573,20 @@ def extract_json_from_response(response_text: str) -> str:
     return response_text.strip()
 
 
+VALID_QUESTION_TYPES = {'mcq', 'short', 'truefalse', 'cloze', 'multi'}
+
+
+def check_question(q: QuestionData) -> QuestionData:
+    """Normalize a generated question's type; raise if it cannot be used."""
+    if q.type not in VALID_QUESTION_TYPES:
+        q.type = 'short'  # Default to short answer if invalid
+
+    # Ensure MCQ questions have options
+    if q.type == 'mcq' and (not q.options or len(q.options) < 2):
+        raise ValueError(f"MCQ question missing valid options: {q.question}")
+    return q
+
+
 def parse_gemini_response(response_text: str) -> GeneratedExam:
     """
     Parse and validate Gemini's JSON response.
@@ -186,15 +605,8 @@ def parse_gemini_response(response_text: str) -> GeneratedExam:
         if len(exam.questions) == 0:
             raise ValueError("No questions generated")
         
-        # Validate question types
-        valid_types = {'mcq', 'short', 'truefalse', 'cloze', 'multi'}
         for q in exam.questions:
-            if q.type not in valid_types:
-                q.type = 'short'  # Default to short answer if invalid
-            
-            # Ensure MCQ questions have options
-            if q.type == 'mcq' and (not q.options or len(q.options) < 2):
-                raise ValueError(f"MCQ question missing valid options: {q.question}")
+            check_question(q)
         
         return exam
         
@@ -204,6 +616,114 @@ def parse_gemini_response(response_text: str) -> GeneratedExam:
         raise ValueError(f"Failed to validate exam structure: {str(e)}")
 
 
+def list_models(api_key: str) -> List[Any]:
+    """Every model api_key can see (blocking; run it in a thread)."""
+    client = glm.ModelServiceClient(client_options=ClientOptions(api_key=api_key))
+    try:
+        return list(genai.list_models(client=client))
+    finally:
+        client.transport.close()
+
+
+def _list_generate_models(api_key: str) -> Dict[str, str]:
+    """List the key's models that support generateContent (blocking).
+
+    Maps plain names to full names ('gemini-2.5-flash' ->
+    'models/gemini-2.5-flash').
+    """
+    supported_models = {}
+    # Some SDKs return names like 'models/gemini-2.5-flash' and include supported methods
+    for m in list_models(api_key):
+        try:
+            methods = getattr(m, 'supported_generation_methods', []) or []
+            if 'generateContent' not in methods:
+                continue
+            # Get the full model name and normalize to plain model id
+            name_raw = getattr(m, 'name', '') or ''
+            plain = name_raw.split('/')[-1]
+            if plain.endswith('-latest'):
+                plain = plain[:-7]
+            supported_models[plain] = name_raw
+        except Exception:
+            continue
+    return supported_models
+
+
+@dataclass
+class _ModelListing:
+    models: Optional[Dict[str, str]]
+    error: Optional[Exception]
+    expires_at: float
+
+
+class ModelCatalog:
+    """Process-wide cache of model discovery per API key.
+
+    Entries are keyed by a SHA-256 of the key, never the key itself. A
+    listing is reused for MODEL_CACHE_TTL_SECONDS and a failed one is
+    re-raised for MODEL_CACHE_ERROR_TTL_SECONDS. Concurrent lookups for
+    the same key share one list_models call.
+    """
+
+    def __init__(self, ttl: float, error_ttl: float) -> None:
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.hits = 0
+        self.misses = 0
+        self._listings: Dict[str, _ModelListing] = {}
+        self._inflight: Dict[str, "asyncio.Task[Dict[str, str]]"] = {}
+
+    async def get(self, api_key: str) -> Dict[str, str]:
+        """generateContent-capable models for api_key, as {plain name: full name}."""
+        fingerprint = _key_fingerprint(api_key)
+        listing = self._listings.get(fingerprint)
+        if listing is not None and listing.expires_at > time.monotonic():
+            self.hits += 1
+            if listing.error is not None:
+                raise listing.error.with_traceback(None)
+            return dict(listing.models)
+
+        self.misses += 1
+        task = self._inflight.get(fingerprint)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._refresh(fingerprint, api_key))
+            self._inflight[fingerprint] = task
+            task.add_done_callback(lambda _: self._inflight.pop(fingerprint, None))
+        # Shielded: one caller giving up must not cancel the shared listing
+        return dict(await asyncio.shield(task))
+
+    async def _refresh(self, fingerprint: str, api_key: str) -> Dict[str, str]:
+        try:
+            models = await asyncio.to_thread(_list_generate_models, api_key)
+        except Exception as e:
+            self._store(fingerprint, _ModelListing(None, e, time.monotonic() + self.error_ttl))
+            raise
+        self._store(fingerprint, _ModelListing(models, None, time.monotonic() + self.ttl))
+        return models
+
+    def _store(self, fingerprint: str, listing: _ModelListing) -> None:
+        now = time.monotonic()
+        for stale in [f for f, entry in self._listings.items() if entry.expires_at <= now]:
+            del self._listings[stale]
+        self._listings[fingerprint] = listing
+
+    def invalidate(self, api_key: str) -> None:
+        """Forget a key's listing (e.g. after its chosen model went missing)."""
+        self._listings.pop(_key_fingerprint(api_key), None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._listings),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+model_catalog = ModelCatalog(MODEL_CACHE_TTL_SECONDS, MODEL_CACHE_ERROR_TTL_SECONDS)
+
+
 async def resolve_model_for_key(api_key: str) -> str:
     """Resolve the best available Gemini model for the provided API key.
 
@@ -215,9 +735,6 @@ async def resolve_model_for_key(api_key: str) -> str:
     Returns the full model name (e.g., 'models/gemini-2.5-flash') that works with the API.
     Falls back to 'models/gemini-2.5-flash' if discovery fails.
     """
-    # Ensure SDK is configured with the key
-    configure_gemini(api_key)
-
     preferred_order = [
         'gemini-2.5-pro',
         'gemini-2.5-flash',
@@ -225,24 +742,7 @@ async def resolve_model_for_key(api_key: str) -> str:
     ]
 
     try:
-        # Some SDKs return names like 'models/gemini-2.5-flash' and include supported methods
-        models = list(genai.list_models())
-        # Map plain name -> full name (e.g., 'gemini-2.5-flash' -> 'models/gemini-2.5-flash')
-        supported_models = {}
-        for m in models:
-            try:
-                methods = getattr(m, 'supported_generation_methods', []) or []
-                if 'generateContent' not in methods:
-                    continue
-                # Get the full model name and normalize to plain model id
-                name_raw = getattr(m, 'name', '') or ''
-                plain = name_raw.split('/')[-1]
-                if plain.endswith('-latest'):
-                    plain = plain[:-7]
-                # Store the mapping: plain name -> full name
-                supported_models[plain] = name_raw
-            except Exception:
-                continue
+        supported_models = await model_catalog.get(api_key)
 
         # Return full name for first matching preferred model
         for candidate in preferred_order:
@@ -263,7 +763,9 @@ async def resolve_model_for_key(api_key: str) -> str:
 async def generate_exam_from_content(
     content: str,
     config: ExamConfig,
-    api_key: str
+    api_key: str,
+    *,
+    fresh: bool = False
 ) -> GeneratedExam:
     """
     Main function to generate exam from content using Gemini API.
@@ -272,52 +774,650 @@ async def generate_exam_from_content(
         content: Extracted text from study materials
         config: Exam configuration (question count, difficulty, types)
         api_key: User's Gemini API key
+        fresh: Skip generation_cache and ask Gemini again (the new result
+            replaces the cached one)
     
     Returns:
         GeneratedExam object with metadata and questions
     """
     try:
-        # Configure Gemini with user's API key
-        configure_gemini(api_key)
-        
         # Build prompt
         prompt = build_exam_prompt(content, config)
         
         # Resolve and initialize Gemini model
         model_name = await resolve_model_for_key(api_key)
-        model = genai.GenerativeModel(model_name)
+        cache_key = _generation_cache_key(model_name, prompt)
+        if not fresh:
+            exam = await _cached_exam(cache_key)
+            if exam is not None:
+                setattr(exam, '_model_name', model_name)
+                return exam
+        model = generative_model(api_key, model_name)
         
-        # Generate content
-        response = model.generate_content(
+        # Generate content (awaited, so other requests keep being served),
+        # paced to the key's quota by gemini_scheduler
+        response = await _scheduled_call(
+            api_key,
             prompt,
-            generation_config=genai.GenerationConfig(
-                temperature=0.7,
-                top_p=0.95,
-                top_k=40,
-                max_output_tokens=8192,
-            )
+            lambda: model.generate_content_async(prompt, generation_config=_exam_generation_config()),
         )
         
         # Parse response
         exam = parse_gemini_response(response.text)
+        await _cache_exam(cache_key, exam)
 
         # Attach the chosen model name on the fly for upstream usage (stored in metadata by route)
         # We return a tuple via an attribute to avoid breaking existing types elsewhere
         setattr(exam, '_model_name', model_name)
         return exam
 
-    except google_exceptions.NotFound as e:
-        raise ValueError(
+    except Exception as e:
+        raise _generation_error(e, api_key)
+
+
+def _generation_cache_key(model_name: str, prompt: str) -> str:
+    # The prompt renders the content, the ExamConfig and the template, so
+    # any change to one of them is a different key
+    payload = json.dumps(
+        [GENERATION_CACHE_VERSION, model_name, repr(_exam_generation_config()), prompt]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def _cached_exam(key: str) -> Optional[GeneratedExam]:
+    if not generation_cache.enabled:
+        return None
+    cached = await asyncio.to_thread(generation_cache.get, key)
+    if cached is None:
+        return None
+    try:
+        return GeneratedExam.model_validate_json(cached)
+    except Exception as e:
+        print(f"Warning: ignoring unreadable cached exam: {e}")
+        return None
+
+
+async def _cache_exam(key: str, exam: GeneratedExam) -> None:
+    if generation_cache.enabled:
+        await asyncio.to_thread(
+            generation_cache.set, key, exam.model_dump_json().encode("utf-8"), GENERATION_CACHE_TTL_SECONDS
+        )
+
+
+def _exam_generation_config() -> genai.GenerationConfig:
+    return genai.GenerationConfig(
+        temperature=0.7,
+        top_p=0.95,
+        top_k=40,
+        max_output_tokens=8192,
+    )
+
+
+async def _scheduled_call(api_key: str, prompt: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Await call() (one generation request for prompt) in a gemini_scheduler
+    slot, queued again while Gemini answers 429 or 503."""
+    tokens = len(prompt) / CHARS_PER_TOKEN
+    attempt = 0
+    while True:
+        try:
+            async with gemini_scheduler.slot(api_key, tokens):
+                response = await call()
+        except Exception as e:
+            if gemini_scheduler.retry_delay(api_key, e, attempt) is None:
+                raise
+            attempt += 1
+            continue
+        gemini_scheduler.settle(api_key, tokens, getattr(response, "usage_metadata", None))
+        return response
+
+
+def _generation_error(e: Exception, api_key: str) -> ValueError:
+    """The ValueError reported for a failed generation call."""
+    if isinstance(e, google_exceptions.NotFound):
+        # The cached listing offered a model that is gone; list again next time
+        model_catalog.invalidate(api_key)
+        return ValueError(
             "Requested model is not found or unsupported by your key. "
             "The app automatically tries free models like 'gemini-2.5-flash'."
         )
-    except google_exceptions.PermissionDenied as e:
-        raise ValueError(
+    if isinstance(e, google_exceptions.PermissionDenied):
+        return ValueError(
             "Your API key lacks access to the selected model. "
             "Please check AI Studio quotas or try a free model like 'gemini-2.5-flash'."
         )
+    if isinstance(e, google_exceptions.TooManyRequests):
+        return ValueError(
+            "Gemini kept rejecting requests for your API key as over its rate limit. "
+            "Please wait a minute, or ask for fewer questions at a time."
+        )
+    return ValueError(f"Failed to generate exam with Gemini: {str(e)}")
+
+
+async def select_content(
+    content: str, config: ExamConfig, api_key: str, max_tokens: int = CHUNK_TOKEN_BUDGET
+) -> str:
+    """The passages of content most relevant to config.focus_concepts,
+    packed into max_tokens (see services/passages).
+
+    Passages are first packed by estimated size (CHARS_PER_TOKEN). The
+    packed text is then measured once with Gemini's count_tokens and, if
+    the estimate was off, packed again with every passage's estimate
+    scaled by the measured ratio, so the prompt fills the budget without
+    going over it. Content that already fits, or in which no passage
+    mentions a focus concept, is returned as the usual prefix.
+    """
+    if not config.focus_concepts or len(content) <= PROMPT_CONTENT_BUDGET:
+        return content[:PROMPT_CONTENT_BUDGET]
+    ranked = passages.rank_passages(content, config.focus_concepts)
+    if not any(passage.score > 0 for passage in ranked):
+        return content[:PROMPT_CONTENT_BUDGET]
+
+    def estimate(text: str) -> float:
+        return len(text) / CHARS_PER_TOKEN
+
+    selected = passages.render_passages(passages.pack_passages(ranked, max_tokens, estimate))
+    try:
+        model_name = await resolve_model_for_key(api_key)
+        response = await generative_model(api_key, model_name).count_tokens_async(selected)
     except Exception as e:
-        raise ValueError(f"Failed to generate exam with Gemini: {str(e)}")
+        # Generation reports a bad key or model; here the estimate will do
+        print(f"Warning: could not count prompt tokens, packing by estimate: {e}")
+        return selected
+    ratio = response.total_tokens / max(estimate(selected), 1.0)
+    if abs(ratio - 1) < 0.01:
+        return selected
+    return passages.render_passages(
+        passages.pack_passages(ranked, max_tokens, lambda text: estimate(text) * ratio)
+    )
+
+
+def map_reduce_chunk_limit(question_count: int) -> int:
+    """Chunks worth extracting for a map-reduce exam: each needs a question."""
+    return max(1, min(MAP_REDUCE_MAX_CHUNKS, question_count))
+
+
+def split_content(content: str, max_tokens: int = CHUNK_TOKEN_BUDGET) -> List[str]:
+    """Split content into chunks of at most max_tokens (estimated) each.
+
+    Chunks are about equal in size. Cuts fall on a paragraph break where
+    there is one in the second half of a chunk, else a line break or space.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    start = 0
+    while len(content) - start > max_chars:
+        remaining = len(content) - start
+        chunk_count = -(-remaining // max_chars)
+        end = start + -(-remaining // chunk_count)
+        floor = start + (end - start) // 2
+        cut = end
+        for separator in ("\n\n", "\n", " "):
+            found = content.rfind(separator, floor, end)
+            if found != -1:
+                cut = found
+                break
+        chunks.append(content[start:cut].strip())
+        start = cut
+    chunks.append(content[start:].strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+def allocate_questions(total: int, weights: List[int]) -> List[int]:
+    """Split total questions in proportion to weights (largest remainder).
+
+    While there are enough questions every chunk gets at least one.
+    """
+    if not weights:
+        return []
+    floor = 1 if total >= len(weights) else 0
+    spare = total - floor * len(weights)
+    weight_sum = sum(weights) or len(weights)
+    quotas = [spare * (w or 1) / weight_sum for w in weights]
+    shares = [floor + int(q) for q in quotas]
+    by_remainder = sorted(range(len(weights)), key=lambda i: int(quotas[i]) - quotas[i])
+    for i in by_remainder[: total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def _question_words(question: QuestionData) -> frozenset:
+    # The answer counts too: short stems that differ in one word usually
+    # differ in their answer as well
+    text = f"{question.question} {question.answer}"
+    return frozenset(re.findall(r"\w+", text.casefold()))
+
+
+class NearDuplicateFilter:
+    """Remembers kept questions and spots near-duplicates of them.
+
+    Two questions are near-duplicates when the words of their stem and
+    answer overlap by NEAR_DUPLICATE_SIMILARITY or more (Jaccard).
+    """
+
+    def __init__(self) -> None:
+        self._kept: List[Tuple[frozenset, QuestionData]] = []
+
+    def __len__(self) -> int:
+        return len(self._kept)
+
+    def match(self, question: QuestionData) -> Optional[QuestionData]:
+        """The kept question this one duplicates, or None after keeping it."""
+        words = _question_words(question)
+        for other_words, other in self._kept:
+            union = len(words | other_words)
+            if union and len(words & other_words) / union >= NEAR_DUPLICATE_SIMILARITY:
+                return other
+        self._kept.append((words, question))
+        return None
+
+    @property
+    def questions(self) -> List[QuestionData]:
+        return [question for _, question in self._kept]
+
+
+def merge_metadata(metadatas: List[ExamMetadata], generated: int, kept: int) -> ExamMetadata:
+    """The most common topic, the union of themes and the time estimates
+    scaled from generated questions to kept ones."""
+    themes: Dict[str, str] = {}
+    for metadata in metadatas:
+        for theme in metadata.themes:
+            themes.setdefault(theme.strip().casefold(), theme.strip())
+    minutes = sum(metadata.estimated_time_minutes for metadata in metadatas)
+    return ExamMetadata(
+        topic=Counter(metadata.topic for metadata in metadatas).most_common(1)[0][0],
+        themes=list(themes.values()),
+        difficulty=metadatas[0].difficulty,
+        estimated_time_minutes=round(minutes * kept / generated) if generated else minutes,
+    )
+
+
+def merge_exams(exams: List[GeneratedExam]) -> GeneratedExam:
+    """Combine per-chunk exams, dropping near-duplicate questions.
+
+    A near-duplicate (see NearDuplicateFilter) of an earlier question is
+    dropped and its concepts are added to the earlier one. Metadata is
+    combined with merge_metadata.
+    """
+    kept = NearDuplicateFilter()
+    generated = 0
+    for exam in exams:
+        for question in exam.questions:
+            generated += 1
+            copy = question.model_copy(update={"concepts": list(question.concepts)})
+            original = kept.match(copy)
+            if original is not None:
+                original.concepts.extend(c for c in question.concepts if c not in original.concepts)
+
+    metadata = merge_metadata([exam.metadata for exam in exams], generated, len(kept))
+    return GeneratedExam(metadata=metadata, questions=kept.questions)
+
+
+def plan_shards(config: ExamConfig, max_questions: int = SHARD_MAX_QUESTIONS) -> List[ExamConfig]:
+    """Split config into shards of at most max_questions questions.
+
+    Questions are divided evenly among the types, then the type-ordered
+    list is cut into equal runs, so each shard gets its own slice of types.
+    Focus concepts are dealt out round-robin when there are enough.
+    """
+    shard_count = -(-config.question_count // max(max_questions, 1))
+    if shard_count <= 1:
+        return [config]
+
+    types = list(dict.fromkeys(config.question_types))
+    ordered = [
+        qtype
+        for qtype, n in zip(types, allocate_questions(config.question_count, [1] * len(types)))
+        for _ in range(n)
+    ]
+    concepts = config.focus_concepts or []
+    shards = []
+    start = 0
+    for index, size in enumerate(allocate_questions(config.question_count, [1] * shard_count)):
+        type_counts = dict(Counter(ordered[start:start + size]))
+        start += size
+        shards.append(config.model_copy(update={
+            "question_count": size,
+            "question_types": list(type_counts),
+            "type_counts": type_counts,
+            "focus_concepts": concepts[index::shard_count] if len(concepts) >= shard_count else config.focus_concepts,
+            "shard": (index, shard_count),
+        }))
+    return shards
+
+
+async def generate_exam_sharded(
+    content: str,
+    config: ExamConfig,
+    api_key: str,
+    *,
+    fresh: bool = False
+) -> GeneratedExam:
+    """
+    Generate an exam of any size from one prompt's worth of content.
+
+    Up to SHARD_MAX_QUESTIONS questions are asked for in one call. Larger
+    exams are split with plan_shards, the shards generated concurrently and
+    merged with merge_exams. A failed shard is retried on its own up to
+    SHARD_RETRIES times; if it still fails the exam fails.
+    """
+    shards = plan_shards(config)
+    if len(shards) == 1:
+        return await generate_exam_from_content(content, config, api_key, fresh=fresh)
+
+    async def run_shard(shard: ExamConfig) -> GeneratedExam:
+        index, count = shard.shard
+        for attempt in range(SHARD_RETRIES + 1):
+            try:
+                return await generate_exam_from_content(content, shard, api_key, fresh=fresh)
+            except ValueError as e:
+                if attempt == SHARD_RETRIES:
+                    raise ValueError(f"Part {index + 1} of {count} failed after {attempt + 1} attempts: {e}")
+                print(f"Warning: part {index + 1} of {count} failed (attempt {attempt + 1}), retrying: {e}")
+
+    exams = await asyncio.gather(*(run_shard(shard) for shard in shards))
+    exam = merge_exams(list(exams))
+    setattr(exam, '_model_name', getattr(exams[0], '_model_name'))
+    return exam
+
+
+def _chunk_shares(content: str, question_count: int) -> List[Tuple[str, int]]:
+    """(chunk, questions) for each chunk of content that gets any questions."""
+    chunks = split_content(content)
+    shares = allocate_questions(question_count, [len(chunk) for chunk in chunks])
+    return [(chunk, share) for chunk, share in zip(chunks, shares) if share > 0]
+
+
+async def generate_exam_map_reduce(
+    content: str,
+    config: ExamConfig,
+    api_key: str,
+    *,
+    fresh: bool = False
+) -> GeneratedExam:
+    """
+    Generate an exam covering all of content, however long.
+
+    content is split into CHUNK_TOKEN_BUDGET chunks and each chunk gets a
+    share of config.question_count in proportion to its size. The chunks
+    are generated concurrently (each with generate_exam_sharded), so this
+    takes about as long as one call, and merged with merge_exams. Chunks
+    that fail are left out as long as one succeeds.
+
+    Like generate_exam_from_content, the result carries _model_name, plus
+    _chunks (how many chunks were generated).
+    """
+    work = _chunk_shares(content, config.question_count)
+    if len(work) == 1:
+        exam = await generate_exam_sharded(work[0][0], config, api_key, fresh=fresh)
+        setattr(exam, '_chunks', 1)
+        return exam
+
+    results = await asyncio.gather(
+        *(
+            generate_exam_sharded(
+                chunk, config.model_copy(update={"question_count": share}), api_key, fresh=fresh
+            )
+            for chunk, share in work
+        ),
+        return_exceptions=True,
+    )
+    exams = [result for result in results if isinstance(result, GeneratedExam)]
+    errors = [result for result in results if not isinstance(result, GeneratedExam)]
+    for error in errors:
+        if not isinstance(error, Exception):
+            raise error
+    if not exams:
+        raise errors[0]
+    if errors:
+        print(f"Warning: {len(errors)} of {len(work)} chunks failed to generate: {errors[0]}")
+
+    exam = merge_exams(exams)
+    setattr(exam, '_model_name', getattr(exams[0], '_model_name'))
+    setattr(exam, '_chunks', len(exams))
+    return exam
+
+
+class QuestionStreamParser:
+    """Incremental parser for an exam response that arrives in pieces.
+
+    feed() takes the next piece of text and returns the objects of the
+    "questions" array that it completed; the "metadata" object is kept in
+    .metadata once complete. Strings and escapes are tracked, so brackets
+    inside question text do not confuse it, and a markdown fence around
+    the JSON is skipped. Objects that are not valid JSON are dropped.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.metadata: Optional[Dict[str, Any]] = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._key: Optional[str] = None  # last key of the top-level object
+        self._value_key: Optional[str] = None  # top-level key whose value is open
+        self._value_start = 0
+        self._object_start = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        self.text += text
+        buf = self.text
+        found = []
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._key = buf[self._string_start + 1:i]
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 2:
+                    self._value_key = self._key
+                    self._value_start = i
+                elif self._depth == 3 and self._value_key == "questions":
+                    self._object_start = i
+            elif ch in "}]":
+                if self._depth == 3 and self._value_key == "questions" and ch == "}":
+                    found.append(self._load(buf[self._object_start:i + 1]))
+                elif self._depth == 2 and self._value_key == "metadata" and ch == "}":
+                    self.metadata = self._load(buf[self._value_start:i + 1])
+                self._depth = max(self._depth - 1, 0)
+        self._pos = len(buf)
+        return [item for item in found if isinstance(item, dict)]
+
+    @staticmethod
+    def _load(text: str) -> Any:
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+
+def _chunk_text(chunk: Any) -> str:
+    # The final chunk of a stream may carry only a finish reason
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+async def stream_exam_from_content(
+    content: str,
+    config: ExamConfig,
+    api_key: str,
+    *,
+    fresh: bool = False
+) -> AsyncIterator[Union[ExamMetadata, QuestionData]]:
+    """
+    Like generate_exam_from_content, but yields each question as soon as
+    the model has finished writing it, and the ExamMetadata once complete.
+
+    Questions that fail validation are skipped. A response cut off part way
+    simply yields fewer questions. Complete responses share
+    generation_cache with generate_exam_from_content.
+    """
+    prompt = build_exam_prompt(content, config)
+    model_name = await resolve_model_for_key(api_key)
+    cache_key = _generation_cache_key(model_name, prompt)
+    if not fresh:
+        exam = await _cached_exam(cache_key)
+        if exam is not None:
+            yield exam.metadata
+            for question in exam.questions:
+                yield question
+            return
+    model = generative_model(api_key, model_name)
+    parser = QuestionStreamParser()
+    questions: List[QuestionData] = []
+    metadata: Optional[ExamMetadata] = None
+    tokens = len(prompt) / CHARS_PER_TOKEN
+    received = False
+    attempt = 0
+    while True:
+        try:
+            async with gemini_scheduler.slot(api_key, tokens):
+                response = await model.generate_content_async(
+                    prompt,
+                    generation_config=_exam_generation_config(),
+                    stream=True,
+                )
+                async for chunk in response:
+                    received = True
+                    had_metadata = parser.metadata is not None
+                    for data in parser.feed(_chunk_text(chunk)):
+                        try:
+                            question = check_question(QuestionData(**data))
+                        except Exception as e:
+                            print(f"Warning: skipping invalid generated question: {e}")
+                            continue
+                        questions.append(question)
+                        yield question
+                    if parser.metadata is not None and not had_metadata:
+                        try:
+                            metadata = ExamMetadata(**parser.metadata)
+                        except Exception as e:
+                            print(f"Warning: ignoring invalid exam metadata: {e}")
+                            continue
+                        yield metadata
+            break
+        except Exception as e:
+            # Only a call turned away before it streamed anything is repeated
+            if received or gemini_scheduler.retry_delay(api_key, e, attempt) is None:
+                raise _generation_error(e, api_key)
+            attempt += 1
+    gemini_scheduler.settle(api_key, tokens, getattr(response, "usage_metadata", None))
+    if metadata is not None and len(questions) >= config.question_count:
+        await _cache_exam(cache_key, GeneratedExam(metadata=metadata, questions=questions))
+
+
+class ExamStream:
+    """
+    Streams a whole exam's questions as they are generated.
+
+    The work is planned as for generate_exam_map_reduce (when map_reduce)
+    and generate_exam_sharded. Every request streams concurrently and
+    questions are yielded in the order they arrive. Near-duplicates of
+    questions already yielded are dropped (and counted in .duplicates);
+    their concepts are not merged, as the earlier question is already out.
+
+    A request that fails or stops short is asked again for its missing
+    questions (and told which it already wrote), up to SHARD_RETRIES times. One that still fails is left out
+    as long as any question was produced.
+    """
+
+    def __init__(
+        self, content: str, config: ExamConfig, api_key: str, *, map_reduce: bool = False, fresh: bool = False
+    ) -> None:
+        self.api_key = api_key
+        self.fresh = fresh
+        work = _chunk_shares(content, config.question_count) if map_reduce else [(content, config.question_count)]
+        self.chunks = len(work)
+        self.requests = [
+            (chunk, shard)
+            for chunk, share in work
+            for shard in plan_shards(config.model_copy(update={"question_count": share}))
+        ]
+        self.generated = 0
+        self.duplicates = 0
+        self.errors: List[ValueError] = []
+        self._metadata: List[ExamMetadata] = []
+
+    @property
+    def metadata(self) -> Optional[ExamMetadata]:
+        """All requests' metadata combined (after questions() finishes)."""
+        if not self._metadata:
+            return None
+        return merge_metadata(self._metadata, self.generated, self.generated - self.duplicates)
+
+    async def questions(self, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[QuestionData]]:
+        """Yield questions as they arrive; None after heartbeat idle seconds."""
+        queue: "asyncio.Queue[Optional[QuestionData]]" = asyncio.Queue()
+        tasks = [asyncio.create_task(self._run(chunk, shard, queue)) for chunk, shard in self.requests]
+        kept = NearDuplicateFilter()
+        running = len(tasks)
+        try:
+            while running:
+                try:
+                    question = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if question is None:
+                    running -= 1
+                    continue
+                self.generated += 1
+                if kept.match(question) is not None:
+                    self.duplicates += 1
+                    continue
+                yield question
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if not len(kept) and self.errors:
+            raise self.errors[0]
+
+    async def _run(self, content: str, config: ExamConfig, queue: asyncio.Queue) -> None:
+        produced: List[str] = []
+        try:
+            for attempt in range(SHARD_RETRIES + 1):
+                remaining = config.question_count - len(produced)
+                request = config
+                if produced:
+                    request = config.model_copy(update={
+                        "question_count": remaining, "type_counts": None, "avoid_questions": produced,
+                    })
+                error = None
+                try:
+                    async for item in stream_exam_from_content(content, request, self.api_key, fresh=self.fresh):
+                        if isinstance(item, ExamMetadata):
+                            # A retry's metadata describes only the missing questions
+                            if attempt == 0:
+                                self._metadata.append(item)
+                        else:
+                            produced.append(item.question)
+                            remaining -= 1
+                            await queue.put(item)
+                except ValueError as e:
+                    error = e
+                if remaining <= 0:
+                    return
+                print(
+                    f"Warning: generation stopped {remaining} questions short "
+                    f"(attempt {attempt + 1}): {error or 'response ended early'}"
+                )
+            self.errors.append(error or ValueError("Gemini returned fewer questions than requested"))
+        finally:
+            await queue.put(None)
 
 
 async def validate_api_key(api_key: str) -> bool:
@@ -328,27 +1428,9 @@ async def validate_api_key(api_key: str) -> bool:
     This function uses the same approach as resolve_model_for_key() to discover
     what models are actually available rather than trying hardcoded names.
     """
-    # Configure Gemini SDK with the provided API key
-    configure_gemini(api_key)
-    
     try:
-        # Discover available models (same approach as resolve_model_for_key)
-        models = list(genai.list_models())
-        supported_models = []
-        
-        # Find models that support generateContent
-        for m in models:
-            try:
-                methods = getattr(m, 'supported_generation_methods', []) or []
-                if 'generateContent' in methods:
-                    name_raw = getattr(m, 'name', '') or ''
-                    # Normalize to plain model id without 'models/' prefix or '-latest' suffix
-                    plain = name_raw.split('/')[-1]
-                    if plain.endswith('-latest'):
-                        plain = plain[:-7]
-                    supported_models.append((plain, name_raw))
-            except Exception:
-                continue
+        # Discover available models (same cached listing as resolve_model_for_key)
+        supported_models = list((await model_catalog.get(api_key)).items())
         
         if not supported_models:
             raise ValueError(
@@ -361,8 +1443,8 @@ async def validate_api_key(api_key: str) -> bool:
         last_error = None
         for plain_name, full_name in supported_models:
             try:
-                model = genai.GenerativeModel(full_name)
-                response = model.generate_content(
+                model = generative_model(api_key, full_name)
+                response = await model.generate_content_async(
                     "Say 'OK' if you can read this.",
                     generation_config=genai.GenerationConfig(
                         max_output_tokens=10,
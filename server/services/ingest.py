@@ -0,0 +1,367 @@
+"""
+Set-based writer for parsed question rows.
+
+Adding Question objects one at a time (and committing every new concept as
+it is first seen) costs a round trip per row and an fsync per concept. This
+writer resolves concept names per batch and inserts the upload, its
+concepts, questions and question_concepts links with one executemany per
+table.
+
+Small uploads are written in a single transaction (ingest_questions). Large
+CSV files are streamed from disk in chunks (ingest_csv_file): each chunk is
+parsed, normalized and committed on its own, so memory stays flat however
+big the file is and other writers are never locked out for the whole import.
+"""
+from __future__ import annotations
+
+import os
+import time
+from collections import ChainMap
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from ..db import retry_on_locked
+from ..models import Concept, Question, Upload, question_concepts
+from .content_hash import question_hash
+from .csv_parser import normalize_csv, read_csv_chunks
+from .upload_stats import count_question_types
+
+
+# Rows per chunk when streaming a CSV file
+CSV_CHUNK_ROWS = int(os.environ.get("EXAM_CSV_CHUNK_ROWS", "5000"))
+# Question hashes per IN (...) lookup, well under SQLite's variable limit
+HASH_LOOKUP_BATCH = 500
+# Uploads larger than this are streamed even without ?stream=true
+CSV_STREAM_THRESHOLD_BYTES = int(os.environ.get("EXAM_CSV_STREAM_BYTES", str(8 * 1024 * 1024)))
+
+
+@dataclass
+class IngestResult:
+    upload_id: int
+    questions: int
+    concepts: int
+    question_type_counts: Dict[str, int] = field(default_factory=dict)
+    seconds: float = 0.0
+    chunks: int = 1
+    # Questions skipped because the bank already held the same stem + answer
+    duplicates: int = 0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.questions / self.seconds if self.seconds > 0 else 0.0
+
+
+@dataclass
+class CsvIngestResult(IngestResult):
+    rows: int = 0
+    columns: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class IngestProgress:
+    """Reported after each committed chunk of a streamed CSV."""
+
+    upload_id: int
+    chunk: int
+    rows: int  # CSV rows read so far, metadata rows included
+    questions: int  # questions stored so far
+    seconds: float
+
+
+def resolve_concept_names(items: Sequence[Dict]) -> Dict[str, str]:
+    """Map each case-insensitive concept key to its first spelling, in order."""
+    names: Dict[str, str] = {}
+    for item in items:
+        for name in item.get("concepts") or []:
+            key = name.strip().lower()
+            if key and key not in names:
+                names[key] = name
+    return names
+
+
+def _next_ids(conn: Connection, model: type, count: int) -> range:
+    """The next count primary keys for model's table."""
+    current = conn.execute(select(func.max(model.id))).scalar()
+    start = (current or 0) + 1
+    return range(start, start + count)
+
+
+class UploadWriter:
+    """Appends batches of normalized question dicts to one new upload.
+
+    The first write() creates the upload row. Every write() is its own
+    transaction, and the upload's statistics columns are updated in it.
+    """
+
+    def __init__(
+        self, db: Session, *, filename: str, file_type: str, content_hash: Optional[str] = None
+    ) -> None:
+        self.db = db
+        self.filename = filename
+        self.file_type = file_type
+        self.content_hash = content_hash
+        self.upload_id: Optional[int] = None
+        self.concept_ids: Dict[str, int] = {}
+        self.question_type_counts: Dict[str, int] = {}
+        self.questions = 0
+        self.duplicates = 0
+        self.chunks = 0
+        self.seconds = 0.0
+
+    def write(self, items: Sequence[Dict]) -> None:
+        started = time.perf_counter()
+        upload_id, new_concepts, type_counts, stored = _write_batch(self.db, self, items)
+        # Only advance once the batch is committed, so a retried batch
+        # starts from the same state
+        self.upload_id = upload_id
+        self.concept_ids.update(new_concepts)
+        self.question_type_counts = type_counts
+        self.questions += stored
+        self.duplicates += len(items) - stored
+        self.chunks += 1
+        self.seconds += time.perf_counter() - started
+
+    def discard(self) -> None:
+        """Delete everything earlier batches committed (after a failed import)."""
+        self.db.rollback()
+        if self.upload_id is None:
+            return
+        discard_upload(self.db, self.upload_id)
+        self.upload_id = None
+
+    def result(self) -> IngestResult:
+        if self.upload_id is None:
+            raise RuntimeError("Nothing has been written yet")
+        return IngestResult(
+            upload_id=self.upload_id,
+            questions=self.questions,
+            concepts=len(self.concept_ids),
+            question_type_counts=dict(self.question_type_counts),
+            seconds=self.seconds,
+            chunks=self.chunks,
+            duplicates=self.duplicates,
+        )
+
+
+@retry_on_locked
+def _write_batch(
+    db: Session, writer: UploadWriter, items: Sequence[Dict]
+) -> Tuple[int, Dict[str, int], Dict[str, int], int]:
+    """Insert one batch for writer and commit.
+
+    Returns (upload_id, newly created concept ids by key, running type
+    counts, number of questions stored).
+    """
+    conn = db.connection()
+
+    # The first copy of a question wins; later copies (in this batch or
+    # already stored by an earlier one) only add their concepts to it
+    unique: Dict[str, Tuple[Dict, Dict[str, None]]] = {}
+    for item in items:
+        content_hash = question_hash(item["stem"], item.get("answer"))
+        keys = dict.fromkeys(
+            key for key in (name.strip().lower() for name in item.get("concepts") or []) if key
+        )
+        if content_hash in unique:
+            unique[content_hash][1].update(keys)
+        else:
+            unique[content_hash] = (item, keys)
+    stored_ids: Dict[str, int] = {}
+    if writer.upload_id is not None:
+        hashes = list(unique)
+        for start in range(0, len(hashes), HASH_LOOKUP_BATCH):
+            stored_ids.update(
+                conn.execute(
+                    select(Question.content_hash, Question.id).where(
+                        Question.upload_id == writer.upload_id,
+                        Question.content_hash.in_(hashes[start : start + HASH_LOOKUP_BATCH]),
+                    )
+                ).all()
+            )
+    new_items = [
+        (content_hash, item) for content_hash, (item, _) in unique.items()
+        if content_hash not in stored_ids
+    ]
+
+    type_counts = dict(writer.question_type_counts)
+    for qtype, count in count_question_types(item["qtype"] for _, item in new_items).items():
+        type_counts[qtype] = type_counts.get(qtype, 0) + count
+    stats = {
+        "question_count": writer.questions + len(new_items),
+        "question_type_counts": type_counts or None,
+    }
+
+    if writer.upload_id is None:
+        upload_id = conn.execute(
+            insert(Upload.__table__)
+            .values(
+                filename=writer.filename,
+                file_type=writer.file_type,
+                content_hash=writer.content_hash,
+                **stats,
+            )
+            .returning(Upload.__table__.c.id)
+        ).scalar_one()
+    else:
+        upload_id = writer.upload_id
+        conn.execute(
+            update(Upload.__table__).where(Upload.__table__.c.id == upload_id).values(**stats)
+        )
+
+    # The upload write took SQLite's write lock, so no other writer can
+    # claim ids until we commit: hand out consecutive ids past the current
+    # maximum and insert with plain executemany. (RETURNING with guaranteed
+    # row order falls back to one statement per row on SQLite.)
+    concept_names = {
+        key: name
+        for key, name in resolve_concept_names(items).items()
+        if key not in writer.concept_ids
+    }
+    new_concepts = dict(zip(concept_names, _next_ids(conn, Concept, len(concept_names))))
+    if new_concepts:
+        conn.execute(
+            insert(Concept.__table__),
+            [
+                {"id": new_concepts[key], "upload_id": upload_id, "name": name, "score": 1.0}
+                for key, name in concept_names.items()
+            ],
+        )
+
+    question_ids = dict(zip((h for h, _ in new_items), _next_ids(conn, Question, len(new_items))))
+    if new_items:
+        conn.execute(
+            insert(Question.__table__),
+            [
+                {
+                    "id": question_ids[content_hash],
+                    "upload_id": upload_id,
+                    "stem": item["stem"],
+                    "qtype": item["qtype"],
+                    "options": item.get("options"),
+                    "answer": item.get("answer"),
+                    "content_hash": content_hash,
+                }
+                for content_hash, item in new_items
+            ],
+        )
+
+    concept_ids = ChainMap(new_concepts, writer.concept_ids)
+    question_ids.update(stored_ids)
+    links = [
+        {"question_id": question_ids[content_hash], "concept_id": concept_ids[key]}
+        for content_hash, (_, keys) in unique.items()
+        for key in keys
+    ]
+    if links:
+        # Copies merged into an earlier batch's question may repeat its links
+        conn.execute(insert(question_concepts).prefix_with("OR IGNORE"), links)
+
+    db.commit()
+    return upload_id, new_concepts, type_counts, len(new_items)
+
+
+def discard_upload(db: Session, upload_id: int) -> None:
+    """Delete a partially imported upload and everything written under it."""
+    # Set-based deletes; an ORM cascade would load every question first.
+    # Nothing else can reference a half-imported upload yet.
+    question_ids = select(Question.id).where(Question.upload_id == upload_id)
+    db.execute(delete(question_concepts).where(question_concepts.c.question_id.in_(question_ids)))
+    db.execute(delete(Question).where(Question.upload_id == upload_id))
+    db.execute(delete(Concept).where(Concept.upload_id == upload_id))
+    db.execute(delete(Upload).where(Upload.id == upload_id))
+    db.commit()
+
+
+def ingest_questions(
+    db: Session,
+    *,
+    filename: str,
+    file_type: str,
+    items: Sequence[Dict],
+    content_hash: Optional[str] = None,
+) -> IngestResult:
+    """Create an upload holding the normalized question dicts and commit.
+
+    items are shaped like normalize_csv output: stem, qtype, options, answer
+    and a list of concept names. Everything is written in one transaction,
+    so a failure (or a locked-database retry) leaves nothing behind.
+    """
+    writer = UploadWriter(db, filename=filename, file_type=file_type, content_hash=content_hash)
+    writer.write(items)
+    return writer.result()
+
+
+def ingest_csv_file(
+    db: Session,
+    path: str,
+    *,
+    filename: str,
+    content_hash: Optional[str] = None,
+    chunksize: int = CSV_CHUNK_ROWS,
+    on_progress: Optional[Callable[[IngestProgress], None]] = None,
+) -> CsvIngestResult:
+    """Stream a CSV file from disk into a new upload, chunk by chunk.
+
+    Only one chunk of rows is held in memory at a time. If any chunk fails
+    to parse or store, the partially written upload is deleted and the
+    error re-raised.
+    """
+    started = time.perf_counter()
+    writer = UploadWriter(db, filename=filename, file_type="csv", content_hash=content_hash)
+    rows = 0
+    question_rows = 0
+    columns: List[str] = []
+    warnings: Dict[str, None] = {}  # ordered set
+    metadata: Dict[str, Any] = {}
+    try:
+        with read_csv_chunks(path, chunksize) as chunks:
+            for chunk in chunks:
+                if not columns:
+                    columns = list(chunk.columns)
+                items, chunk_warnings, chunk_metadata = normalize_csv(
+                    chunk, row_offset=question_rows
+                )
+                question_rows += len(items)
+                # Per-file warnings (e.g. missing columns) repeat in every chunk
+                warnings.update(dict.fromkeys(chunk_warnings))
+                metadata.update(chunk_metadata)
+                rows += len(chunk)
+                writer.write(items)
+                if on_progress is not None:
+                    on_progress(
+                        IngestProgress(
+                            upload_id=writer.upload_id,
+                            chunk=writer.chunks,
+                            rows=rows,
+                            questions=writer.questions,
+                            seconds=time.perf_counter() - started,
+                        )
+                    )
+        if writer.upload_id is None:
+            # Header-only file: still record the (empty) upload
+            writer.write([])
+    except Exception:
+        writer.discard()
+        raise
+
+    result = writer.result()
+    return CsvIngestResult(
+        upload_id=result.upload_id,
+        questions=result.questions,
+        concepts=result.concepts,
+        question_type_counts=result.question_type_counts,
+        # Wall time including parsing, which is what bounds a streamed import
+        seconds=time.perf_counter() - started,
+        chunks=result.chunks,
+        duplicates=result.duplicates,
+        rows=rows,
+        columns=columns,
+        warnings=list(warnings),
+        metadata=metadata,
+    )
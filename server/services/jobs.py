@@ -0,0 +1,424 @@
+"""
+In-process background jobs.
+
+Large CSV imports and AI generations can run outside the HTTP request: the
+endpoint records a jobs row and returns its id, and a small pool of asyncio
+workers runs the handler registered for the job's kind.
+
+Live stage/percent is kept in memory and pushed to listeners (the SSE
+endpoint waits on changed()). Status transitions, checkpoints and results
+are persisted, so after a restart resumable jobs are queued again and the
+rest are closed out as interrupted.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import uuid
+from contextlib import suppress
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update
+
+from ..db import AsyncSessionLocal
+from ..models import Job
+
+
+JOB_WORKERS = int(os.environ.get("EXAM_JOB_WORKERS", "2"))
+# Files a job reads after its request has returned (kept across restarts)
+JOB_SPOOL_DIR = os.environ.get("EXAM_JOB_SPOOL_DIR", "./job_spool")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+TERMINAL_STATUSES = frozenset({SUCCEEDED, FAILED, CANCELLED, INTERRUPTED})
+
+
+T = TypeVar("T")
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler once its job has been cancelled."""
+
+
+class JobContext:
+    """What a running handler sees of its job.
+
+    progress() and raise_if_cancelled() may be called from worker threads.
+    """
+
+    def __init__(
+        self,
+        manager: "JobManager",
+        job_id: int,
+        params: Dict[str, Any],
+        checkpoint: Dict[str, Any],
+        runtime: Dict[str, Any],
+    ) -> None:
+        self.job_id = job_id
+        self.params = params
+        self.checkpoint = checkpoint
+        # Values that are never persisted (API keys, in-memory file bodies)
+        self.runtime = runtime
+        self.stage: Optional[str] = None
+        self.percent = 0.0
+        self._manager = manager
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._cancel = threading.Event()
+        # Checkpoint writes started on the loop, held until they finish
+        self._writes: Set[asyncio.Task] = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+    def progress(self, stage: str, percent: Optional[float] = None) -> None:
+        if threading.get_ident() != self._loop_thread:
+            self._loop.call_soon_threadsafe(self.progress, stage, percent)
+            return
+        self.stage = stage
+        if percent is not None:
+            self.percent = max(0.0, min(100.0, float(percent)))
+        self._manager._notify()
+
+    async def run_in_thread(self, func: Callable[..., T], *args: Any) -> T:
+        """Run blocking work in the threadpool, cancellable through the job.
+
+        A thread cannot be interrupted: on cancellation this waits for func
+        to notice raise_if_cancelled() and clean up before re-raising, so the
+        job is never reported cancelled while its work is still running.
+        """
+        work = asyncio.ensure_future(run_in_threadpool(func, *args))
+        try:
+            return await asyncio.shield(work)
+        except asyncio.CancelledError:
+            self._cancel.set()
+            with suppress(Exception):
+                await work
+            raise
+
+    def save_checkpoint(self, **values: Any) -> None:
+        """Merge values into the persisted checkpoint.
+
+        From a worker thread this blocks until the row is written.
+        """
+        self.checkpoint.update(values)
+        write = self._manager._update_job(self.job_id, checkpoint=dict(self.checkpoint))
+        if threading.get_ident() == self._loop_thread:
+            task = self._loop.create_task(write)
+            self._writes.add(task)
+            task.add_done_callback(self._write_done)
+        else:
+            asyncio.run_coroutine_threadsafe(write, self._loop).result()
+
+    def _write_done(self, task: asyncio.Task) -> None:
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Warning: job {self.job_id} checkpoint could not be saved: {task.exception()!r}")
+
+
+Handler = Callable[[JobContext], Awaitable[Dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class JobKind:
+    handler: Handler
+    # Can run again from its params alone after a restart
+    resumable: bool = False
+    interrupted_message: str = "The server restarted before this job finished"
+
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS) -> None:
+        self.workers = workers
+        self._kinds: Dict[str, JobKind] = {}
+        self._queue: Optional[asyncio.Queue[int]] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._runtime: Dict[int, Dict[str, Any]] = {}
+        self._running: Dict[int, JobContext] = {}
+        self._handler_tasks: Dict[int, asyncio.Task] = {}
+        # Claimed by a worker but not started yet when cancel() came in
+        self._cancel_requested: Set[int] = set()
+        self._changed: Optional[asyncio.Event] = None
+
+    def register(
+        self,
+        kind: str,
+        handler: Handler,
+        *,
+        resumable: bool = False,
+        interrupted_message: Optional[str] = None,
+    ) -> None:
+        options = {"interrupted_message": interrupted_message} if interrupted_message else {}
+        self._kinds[kind] = JobKind(handler=handler, resumable=resumable, **options)
+
+    def spool_path(self, suffix: str = "") -> str:
+        """A fresh path under the spool directory for a job's input file.
+
+        List it in the job's params["spool_files"] so it is removed once the
+        job is finished.
+        """
+        os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+        return os.path.join(JOB_SPOOL_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+    async def start(self) -> None:
+        """Recover unfinished jobs from the last run and start the workers."""
+        self._queue = asyncio.Queue()
+        self._changed = asyncio.Event()
+        for job_id in await self._recover():
+            self._queue.put_nowait(job_id)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stop the workers. Jobs still running stay 'running' for recovery."""
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._worker_tasks = []
+
+    async def submit(
+        self, kind: str, params: Dict[str, Any], runtime: Optional[Dict[str, Any]] = None
+    ) -> int:
+        if kind not in self._kinds:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        if self._queue is None:
+            raise RuntimeError("Job workers are not running")
+        async with AsyncSessionLocal() as db:
+            job = Job(kind=kind, status=QUEUED, stage="queued", params=params)
+            db.add(job)
+            await db.commit()
+            job_id = job.id
+        if runtime:
+            self._runtime[job_id] = runtime
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def cancel(self, job_id: int) -> Optional[str]:
+        """Cancel a queued or running job. Returns its status, None if unknown."""
+        context = self._running.get(job_id)
+        if context is not None:
+            context._cancel.set()
+            task = self._handler_tasks.get(job_id)
+            if task is not None:
+                # Awaits are interrupted at once; thread work (run_in_thread)
+                # stops at its next raise_if_cancelled()
+                task.cancel()
+            return RUNNING
+
+        async with AsyncSessionLocal() as db:
+            claimed = await db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == QUEUED)
+                .values(status=CANCELLED, stage="cancelled", finished_at=datetime.utcnow())
+            )
+            await db.commit()
+            if claimed.rowcount:
+                job = await db.get(Job, job_id)
+                self._runtime.pop(job_id, None)
+                _remove_spool_files(job.params)
+                self._notify()
+                return CANCELLED
+            job = await db.get(Job, job_id)
+            if job is None:
+                return None
+            if job.status == RUNNING:
+                self._cancel_requested.add(job_id)
+            return job.status
+
+    async def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        async with AsyncSessionLocal() as db:
+            job = await db.get(Job, job_id)
+            return self.describe(job) if job is not None else None
+
+    def describe(self, job: Job) -> Dict[str, Any]:
+        """JSON view of a job, with live progress if it is running here."""
+        context = self._running.get(job.id) if job.status == RUNNING else None
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "stage": context.stage if context is not None and context.stage else job.stage,
+            "percent": context.percent if context is not None else job.percent,
+            "result": job.result,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
+
+    def change_token(self) -> Optional[asyncio.Event]:
+        """Take before reading a job; changed() then also sees changes made
+        during the read."""
+        return self._changed
+
+    async def changed(self, timeout: float, token: Optional[asyncio.Event] = None) -> bool:
+        """Wait until any job changes (since change_token() returned token,
+        if given); False if timeout passed first."""
+        event = token if token is not None else self._changed
+        if event is None:
+            await asyncio.sleep(timeout)
+            return False
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _notify(self) -> None:
+        # Wake every waiter, then arm a fresh event for the next change
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    async def _recover(self) -> List[int]:
+        requeued: List[int] = []
+        async with AsyncSessionLocal() as db:
+            unfinished = (
+                await db.scalars(
+                    select(Job).where(Job.status.in_([QUEUED, RUNNING])).order_by(Job.id)
+                )
+            ).all()
+            for job in unfinished:
+                kind = self._kinds.get(job.kind)
+                if kind is not None and kind.resumable:
+                    job.status = QUEUED
+                    job.stage = "requeued after restart"
+                    job.percent = 0.0
+                    job.started_at = None
+                    requeued.append(job.id)
+                else:
+                    job.status = INTERRUPTED
+                    job.stage = INTERRUPTED
+                    job.error = kind.interrupted_message if kind else JobKind.interrupted_message
+                    job.finished_at = datetime.utcnow()
+                    _remove_spool_files(job.params)
+            await db.commit()
+        return requeued
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # never let one job take a worker down
+                print(f"Warning: job {job_id} could not be run: {exc}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: int) -> None:
+        async with AsyncSessionLocal() as db:
+            # Claim the job; it may have been cancelled while queued
+            claimed = await db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == QUEUED)
+                .values(status=RUNNING, stage="starting", started_at=datetime.utcnow())
+            )
+            await db.commit()
+            if not claimed.rowcount:
+                return
+            job = await db.get(Job, job_id)
+            kind = self._kinds.get(job.kind)
+            params = dict(job.params or {})
+            checkpoint = dict(job.checkpoint or {})
+
+        if kind is None:
+            await self._finish(job_id, FAILED, params, error=f"Unknown job kind '{job.kind}'")
+            return
+
+        runtime = self._runtime.pop(job_id, {})
+        if job_id in self._cancel_requested:
+            self._cancel_requested.discard(job_id)
+            await self._finish(job_id, CANCELLED, params)
+            return
+
+        context = JobContext(self, job_id, params, checkpoint, runtime)
+        task = asyncio.create_task(kind.handler(context))
+        self._running[job_id] = context
+        self._handler_tasks[job_id] = task
+        self._notify()
+        try:
+            await asyncio.wait([task])
+            if task.cancelled() or isinstance(task.exception(), JobCancelled):
+                await self._finish(job_id, CANCELLED, params, percent=context.percent)
+            elif task.exception() is not None:
+                exc = task.exception()
+                print(f"Warning: job {job_id} failed: {exc!r}")
+                await self._finish(
+                    job_id,
+                    FAILED,
+                    params,
+                    # Keep the stage it failed in
+                    stage=context.stage,
+                    percent=context.percent,
+                    error=str(exc) or repr(exc),
+                )
+            else:
+                await self._finish(job_id, SUCCEEDED, params, percent=100.0, result=task.result())
+        except asyncio.CancelledError:
+            # Shutting down: stop the handler and leave the row 'running'
+            # so the next start() recovers it
+            context._cancel.set()
+            task.cancel()
+            with suppress(BaseException):
+                await task
+            raise
+        finally:
+            # Dropped only after the final row is written, so readers never
+            # fall back to the stale stored stage in between
+            self._running.pop(job_id, None)
+            self._handler_tasks.pop(job_id, None)
+
+    async def _finish(
+        self,
+        job_id: int,
+        status: str,
+        params: Dict[str, Any],
+        *,
+        stage: Optional[str] = None,
+        percent: float = 0.0,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        await self._update_job(
+            job_id,
+            status=status,
+            stage=stage or status,
+            percent=percent,
+            result=result,
+            error=error,
+            finished_at=datetime.utcnow(),
+        )
+        _remove_spool_files(params)
+        self._notify()
+
+    async def _update_job(self, job_id: int, **values: Any) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(**values))
+            await db.commit()
+
+
+def _remove_spool_files(params: Optional[Dict[str, Any]]) -> None:
+    for path in (params or {}).get("spool_files") or []:
+        with suppress(FileNotFoundError):
+            os.remove(path)
+
+
+# The application's job manager; started and stopped by main.py
+job_manager = JobManager()
@@ -0,0 +1,183 @@
+"""
+Relevance-ranked selection of study material for focused exams.
+
+The extracted text is split into passages of about PASSAGE_WORDS words
+(on paragraph, then sentence, breaks) and each passage is scored against
+the exam's focus concepts with Okapi BM25. pack_passages then fills a
+token budget with the best-scoring passages and returns them in reading
+order, so a prompt carries the material about the focus concepts wherever
+it sits in the files instead of just their first pages.
+
+Pure Python: the optional concept extractors in services/concepts are
+not needed to rank a few hundred passages against a handful of terms.
+"""
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence
+
+
+# Target passage length; paragraphs are merged or split to get near it
+PASSAGE_WORDS = 120
+# Okapi BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Marks material left out between two selected passages
+GAP_MARKER = "[...]"
+
+_WORD = re.compile(r"\w+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Section headers written by file_processor, e.g. "=== Content from notes.pdf ==="
+_HEADER = re.compile(r"^=== .* ===$", re.MULTILINE)
+
+
+class Passage(NamedTuple):
+    index: int  # position in the document
+    header: Optional[str]  # the file section it came from
+    text: str
+    score: float
+
+
+def tokenize(text: str) -> List[str]:
+    return [word.casefold() for word in _WORD.findall(text)]
+
+
+def _split_long(paragraph: str, max_words: int) -> List[str]:
+    """Split a paragraph of more than max_words into sentence runs."""
+    pieces: List[str] = []
+    current: List[str] = []
+    count = 0
+    for sentence in _SENTENCE_END.split(paragraph):
+        words = sentence.split()
+        # A single sentence longer than a passage is cut by words
+        while len(words) > max_words:
+            pieces.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        if count + len(words) > max_words and current:
+            pieces.append(" ".join(current))
+            current, count = [], 0
+        current.extend(words)
+        count += len(words)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def split_passages(text: str, max_words: int = PASSAGE_WORDS) -> List[Passage]:
+    """Split text into passages of up to about max_words words (unscored).
+
+    Short paragraphs are merged and long ones split at sentence ends;
+    passages never span two file sections.
+    """
+    passages: List[Passage] = []
+    headers = list(_HEADER.finditer(text))
+    bounds = [(None, 0, headers[0].start() if headers else len(text))]
+    for i, match in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        bounds.append((match.group(0), match.end(), end))
+
+    for header, start, end in bounds:
+        current: List[str] = []
+        count = 0
+        for paragraph in _PARAGRAPH_BREAK.split(text[start:end]):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            pieces = [paragraph] if len(paragraph.split()) <= max_words else _split_long(paragraph, max_words)
+            for piece in pieces:
+                words = len(piece.split())
+                if count + words > max_words and current:
+                    passages.append(Passage(len(passages), header, "\n\n".join(current), 0.0))
+                    current, count = [], 0
+                current.append(piece)
+                count += words
+        if current:
+            passages.append(Passage(len(passages), header, "\n\n".join(current), 0.0))
+    return passages
+
+
+def bm25_scores(documents: Sequence[List[str]], query: Iterable[str]) -> List[float]:
+    """Okapi BM25 score of each tokenized document for the query terms."""
+    if not documents:
+        return []
+    average_length = sum(map(len, documents)) / len(documents) or 1.0
+    frequencies = [Counter(document) for document in documents]
+    terms = set(query)
+    document_frequency = {
+        term: sum(1 for counts in frequencies if term in counts) for term in terms
+    }
+    scores = []
+    for document, counts in zip(documents, frequencies):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(document) / average_length)
+        score = 0.0
+        for term in terms:
+            tf = counts.get(term, 0)
+            if not tf:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def rank_passages(text: str, concepts: Sequence[str], max_words: int = PASSAGE_WORDS) -> List[Passage]:
+    """text's passages, in document order, scored against concepts.
+
+    Every word of every concept is a query term, and a passage that
+    contains a multi-word concept as a phrase scores that concept again,
+    so "cell membrane" ranks above a passage about cells and membranes.
+    """
+    passages = split_passages(text, max_words)
+    documents = [tokenize(passage.text) for passage in passages]
+    scores = bm25_scores(documents, (term for concept in concepts for term in tokenize(concept)))
+    phrases = [" ".join(tokenize(concept)) for concept in concepts if len(tokenize(concept)) > 1]
+    if phrases:
+        joined = [f" {' '.join(document)} " for document in documents]
+        phrase_scores = bm25_scores(
+            [[phrase for phrase in phrases if f" {phrase} " in document] for document in joined],
+            phrases,
+        )
+        scores = [score + phrase for score, phrase in zip(scores, phrase_scores)]
+    return [passage._replace(score=score) for passage, score in zip(passages, scores)]
+
+
+def pack_passages(
+    passages: Sequence[Passage], max_tokens: int, count_tokens: Callable[[str], float]
+) -> List[Passage]:
+    """The best passages that fit in max_tokens, in document order.
+
+    Passages are taken by descending score; once the relevant ones are in,
+    the rest of the budget is filled with the remaining passages in
+    reading order, so a prompt is never sent half empty. A passage that
+    does not fit is skipped in favour of smaller ones after it.
+    """
+    chosen: List[Passage] = []
+    used = 0.0
+    for passage in sorted(passages, key=lambda p: (-p.score, p.index)):
+        tokens = count_tokens(render_passages([passage]))
+        if used + tokens <= max_tokens:
+            chosen.append(passage)
+            used += tokens
+    return sorted(chosen, key=lambda p: p.index)
+
+
+def render_passages(passages: Sequence[Passage]) -> str:
+    """Join passages (in document order) into prompt content.
+
+    Each file section's header is repeated before its first passage, and
+    GAP_MARKER stands in for left-out passages between two chosen ones.
+    """
+    parts: List[str] = []
+    previous: Optional[Passage] = None
+    for passage in passages:
+        if previous is not None and passage.index != previous.index + 1 and passage.header == previous.header:
+            parts.append(GAP_MARKER)
+        if passage.header and (previous is None or passage.header != previous.header):
+            parts.append(passage.header)
+        parts.append(passage.text)
+        previous = passage
+    return "\n\n".join(parts)
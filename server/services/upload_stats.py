@@ -0,0 +1,112 @@
+"""
+Denormalized per-upload statistics (question, exam and attempt counts and
+per-type question counts) stored on the uploads row.
+
+Writers update them in the same transaction as the rows they describe;
+reconcile_upload_stats rebuilds them from scratch:
+
+    python -m server.services.upload_stats
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import Update, bindparam, func, select, update
+from sqlalchemy.engine import Connection
+
+from ..models import Attempt, Exam, Question, Upload
+
+
+def count_question_types(qtypes: Iterable[str]) -> Dict[str, int]:
+    """Tally question types, e.g. for Upload.question_type_counts."""
+    counts: Dict[str, int] = {}
+    for qtype in qtypes:
+        counts[qtype] = counts.get(qtype, 0) + 1
+    return counts
+
+
+def bump_upload_counts(
+    upload_id: int, *, exams: int = 0, attempts: int = 0
+) -> Update:
+    """UPDATE statement adjusting an upload's exam/attempt counters in place."""
+    return (
+        update(Upload)
+        .where(Upload.id == upload_id)
+        .values(
+            exam_count=Upload.exam_count + exams,
+            attempt_count=Upload.attempt_count + attempts,
+        )
+    )
+
+
+def reconcile_upload_stats(conn: Connection, upload_id: Optional[int] = None) -> int:
+    """Recompute the statistics columns from the underlying tables.
+
+    Returns the number of uploads rewritten.
+    """
+    scope = [Upload.id == upload_id] if upload_id is not None else []
+
+    upload_ids = conn.execute(select(Upload.id).where(*scope)).scalars().all()
+    if not upload_ids:
+        return 0
+
+    type_counts: Dict[int, Dict[str, int]] = defaultdict(dict)
+    for uid, qtype, count in conn.execute(
+        select(Question.upload_id, Question.qtype, func.count())
+        .where(Question.upload_id.in_(select(Upload.id).where(*scope)))
+        .group_by(Question.upload_id, Question.qtype)
+    ):
+        type_counts[uid][qtype] = count
+
+    exam_counts = dict(
+        conn.execute(
+            select(Exam.upload_id, func.count())
+            .where(Exam.upload_id.in_(select(Upload.id).where(*scope)))
+            .group_by(Exam.upload_id)
+        ).all()
+    )
+    attempt_counts = dict(
+        conn.execute(
+            select(Exam.upload_id, func.count(Attempt.id))
+            .join(Attempt, Attempt.exam_id == Exam.id)
+            .where(Exam.upload_id.in_(select(Upload.id).where(*scope)))
+            .group_by(Exam.upload_id)
+        ).all()
+    )
+
+    conn.execute(
+        update(Upload.__table__)
+        .where(Upload.__table__.c.id == bindparam("uid"))
+        .values(
+            question_count=bindparam("question_count"),
+            exam_count=bindparam("exam_count"),
+            attempt_count=bindparam("attempt_count"),
+            question_type_counts=bindparam("question_type_counts"),
+        ),
+        [
+            {
+                "uid": uid,
+                "question_count": sum(type_counts[uid].values()),
+                "exam_count": exam_counts.get(uid, 0),
+                "attempt_count": attempt_counts.get(uid, 0),
+                "question_type_counts": type_counts[uid] or None,
+            }
+            for uid in upload_ids
+        ],
+    )
+    return len(upload_ids)
+
+
+def main() -> None:
+    from ..db import engine
+    from ..migrations import run_migrations
+
+    run_migrations(engine)
+    with engine.begin() as conn:
+        count = reconcile_upload_stats(conn)
+    print(f"Reconciled statistics for {count} uploads")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 import axios from "axios";
 import type {
   AttemptDetail,
+  AttemptPage,
   AttemptSummary,
   ExamOut,
   GradeReport,
+  Job,
+  QuestionDTO,
   QuestionType,
   UploadResponse,
+  UploadPage,
   UploadSummary,
 } from "../types";
 
@@ -20,6 +24,40 @@ export async function uploadCsv(file: File) {
   return data;
 }
 
+export async function uploadCsvInBackground(file: File): Promise<number> {
+  const form = new FormData();
+  form.append("file", file);
+  const { data } = await api.post<{ jobId: number }>("/upload/csv", form, {
+    params: { background: true },
+    headers: { "Content-Type": "multipart/form-data" },
+  });
+  return data.jobId;
+}
+
+export async function fetchJob(jobId: number): Promise<Job> {
+  const { data } = await api.get<Job>(`/jobs/${jobId}`);
+  return data;
+}
+
+export async function cancelJob(jobId: number): Promise<Job> {
+  const { data } = await api.post<Job>(`/jobs/${jobId}/cancel`);
+  return data;
+}
+
+// Server-sent events: onUpdate runs for every change until the job finishes
+export function watchJob(
+  jobId: number,
+  onUpdate: (job: Job) => void
+): () => void {
+  const source = new EventSource(`${api.defaults.baseURL}/jobs/${jobId}/events`);
+  source.addEventListener("job", (event) => {
+    const job = JSON.parse((event as MessageEvent).data) as Job;
+    onUpdate(job);
+    if (!["queued", "running"].includes(job.status)) source.close();
+  });
+  return () => source.close();
+}
+
 export async function uploadText(file: File) {
   const form = new FormData();
   form.append("file", file);
@@ -68,6 +106,23 @@ export async function fetchAllUploads(): Promise<UploadSummary[]> {
   return data;
 }
 
+export async function fetchUploadsPage(params: {
+  limit?: number;
+  cursor?: string | null;
+  classId?: number;
+  fileType?: string;
+} = {}): Promise<UploadPage> {
+  const { data } = await api.get<UploadPage>("/uploads/page", {
+    params: {
+      limit: params.limit,
+      cursor: params.cursor ?? undefined,
+      class_id: params.classId,
+      file_type: params.fileType,
+    },
+  });
+  return data;
+}
+
 export async function fetchRecentAttempts(
   limit: number = 10
 ): Promise<AttemptSummary[]> {
@@ -77,6 +132,27 @@ export async function fetchRecentAttempts(
   return data;
 }
 
+export async function fetchAttemptHistory(params: {
+  limit?: number;
+  cursor?: string | null;
+  uploadId?: number;
+  classId?: number;
+  since?: string;
+  until?: string;
+} = {}): Promise<AttemptPage> {
+  const { data } = await api.get<AttemptPage>("/attempts/history", {
+    params: {
+      limit: params.limit,
+      cursor: params.cursor ?? undefined,
+      upload_id: params.uploadId,
+      class_id: params.classId,
+      since: params.since,
+      until: params.until,
+    },
+  });
+  return data;
+}
+
 export async function fetchAttemptDetail(
   attemptId: number
 ): Promise<AttemptDetail> {
@@ -190,7 +266,7 @@ export async function validateGeminiKeyDetailed(
   }
 }
 
-export async function generateExamFromFiles(params: {
+export interface GenerateExamParams {
   files: FormData;
   questionCount: number;
   difficulty: string;
@@ -199,8 +275,14 @@ export async function generateExamFromFiles(params: {
   examName?: string;
   examMode?: string;
   selectedClassId?: number;
+  // Generate from every part of long material, not just its beginning
+  mapReduce?: boolean;
+  // Ask for new questions even if the same request was answered before
+  fresh?: boolean;
   apiKey: string;
-}): Promise<{ exam_id: number; upload_id: number; stats: any }> {
+}
+
+function generationForm(params: GenerateExamParams): FormData {
   const formData = params.files;
   formData.append("question_count", params.questionCount.toString());
   formData.append("difficulty", params.difficulty);
@@ -217,7 +299,19 @@ export async function generateExamFromFiles(params: {
   if (params.selectedClassId) {
     formData.append("class_id", params.selectedClassId.toString());
   }
+  if (params.mapReduce) {
+    formData.append("map_reduce", "true");
+  }
+  if (params.fresh) {
+    formData.append("fresh", "true");
+  }
+  return formData;
+}
 
+export async function generateExamFromFiles(
+  params: GenerateExamParams
+): Promise<{ exam_id: number; upload_id: number; stats: any }> {
+  const formData = generationForm(params);
   const { data } = await api.post("/ai/generate-exam", formData, {
     headers: {
       "X-Gemini-API-Key": params.apiKey,
@@ -227,6 +321,50 @@ export async function generateExamFromFiles(params: {
   return data;
 }
 
+export type ExamStreamEvent =
+  | { event: "exam"; data: { exam_id: number; upload_id: number } }
+  | { event: "question"; data: { position: number; question: QuestionDTO } }
+  | { event: "done"; data: { exam_id: number; upload_id: number; question_count: number; stats: any } }
+  | { event: "error"; data: { detail: string } };
+
+// Server-sent events over POST (EventSource only does GET): onEvent runs
+// for every event as it arrives; resolves when the stream ends
+export async function streamExamFromFiles(
+  params: GenerateExamParams,
+  onEvent: (event: ExamStreamEvent) => void
+): Promise<void> {
+  const response = await fetch(`${api.defaults.baseURL}/ai/generate-exam/stream`, {
+    method: "POST",
+    body: generationForm(params),
+    headers: { "X-Gemini-API-Key": params.apiKey },
+  });
+  if (!response.ok || !response.body) {
+    const body = await response.json().catch(() => null);
+    throw new Error(body?.detail || response.statusText);
+  }
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) return;
+    buffer += value;
+    let end;
+    while ((end = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      let event = "message";
+      const data: string[] = [];
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data.push(line.slice(6));
+      }
+      if (data.length) {
+        onEvent({ event, data: JSON.parse(data.join("\n")) } as ExamStreamEvent);
+      }
+    }
+  }
+}
+
 export async function getSupportedFormats(): Promise<{ formats: string[] }> {
   const { data } = await api.get("/ai/supported-formats");
   return data;
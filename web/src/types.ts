@@ -24,6 +24,9 @@ export interface UploadResponse {
   uploadId: number;
   stats: Record<string, unknown> & {
     metadata?: UploadMetadata;
+    // True when the same file was already uploaded; uploadId is that upload
+    duplicate?: boolean;
+    duplicates_skipped?: number;
   };
 }
 
@@ -34,11 +37,17 @@ export interface UploadSummary {
   question_count: number;
   themes: string[];
   exam_count: number;
+  attempt_count?: number;
   file_type: string;
   class_tags?: string[];
   question_type_counts?: Record<string, number> | null;
 }
 
+export interface UploadPage {
+  items: UploadSummary[];
+  next_cursor: string | null;
+}
+
 export interface AttemptSummary {
   id: number;
   exam_id: number;
@@ -49,6 +58,32 @@ export interface AttemptSummary {
   correct_count: number;
 }
 
+export interface AttemptPage {
+  items: AttemptSummary[];
+  next_cursor: string | null;
+}
+
+export type JobStatus =
+  | "queued"
+  | "running"
+  | "succeeded"
+  | "failed"
+  | "cancelled"
+  | "interrupted";
+
+export interface Job {
+  id: number;
+  kind: "csv_upload" | "ai_generation";
+  status: JobStatus;
+  stage: string | null;
+  percent: number;
+  result: Record<string, unknown> | null;
+  error: string | null;
+  created_at: string | null;
+  started_at: string | null;
+  finished_at: string | null;
+}
+
 export interface QuestionReview {
   question: QuestionDTO;
   user_answer: unknown;